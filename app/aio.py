@@ -0,0 +1,169 @@
+import asyncio
+import threading
+from contextlib import nullcontext
+from concurrent.futures import Future
+
+import httpx
+
+
+class RetryPolicy:
+    """
+    全ての外部APIの呼び出しで共有するタイムアウトとリトライの方針
+    429と5xx、タイムアウトと接続エラーは指数バックオフ(Retry-Afterがあればその秒数)でリトライする。
+
+    Args:
+        timeout (float): 1回の呼び出しのタイムアウト (秒)
+        max_retries (int): 最大リトライ回数
+        base_delay (float): 最初のリトライまでの待ち時間 (秒)
+        max_delay (float): リトライまでの待ち時間の最大値 (秒)
+    """
+    def __init__(self, timeout: float=300.0, max_retries: int=3, base_delay: float=1.0, max_delay: float=60.0):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def get_status(e: Exception):
+        """
+        例外からHTTPステータスを取り出す
+        (Notion: status, mistralai: status_code, httpx: response.status_code, google.api_core: code)。
+        """
+        for status in (
+            getattr(e, "status", None),
+            getattr(e, "status_code", None),
+            getattr(getattr(e, "response", None), "status_code", None),
+            getattr(e, "code", None),
+        ):
+            # mistralaiはHTTPの応答がない場合にstatus_code=-1とする
+            if isinstance(status, int) and status >= 100:
+                return status
+        return None
+
+    def is_retryable(self, e: Exception) -> bool:
+        status = self.get_status(e)
+        if status is None:
+            return isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError))
+        return status == 429 or status >= 500
+
+    def get_delay(self, attempt: int, e: Exception) -> float:
+        # Notion: headers, httpx/google.api_core: response.headers, mistralai: raw_response.headers
+        headers = (
+            getattr(e, "headers", None)
+            or getattr(getattr(e, "response", None), "headers", None)
+            or getattr(getattr(e, "raw_response", None), "headers", None)
+            or {}
+        )
+        try:
+            return float(headers["retry-after"])
+        except (KeyError, TypeError, ValueError):
+            return min(self.max_delay, self.base_delay * 2 ** attempt)
+
+    async def call(self, func, *args, limit=None, before_attempt=None, on_retry=None, **kwargs):
+        """
+        コルーチン関数を呼び出し、失敗したらリトライする。
+        limit: 1回の呼び出しの間だけ入るasync with (同時実行数の制限。待ち時間はタイムアウトに含めない)
+        before_attempt: 毎回の呼び出しの前にawaitするコルーチン関数 (レート制限の待機など)
+        on_retry: リトライする前に (例外, 待ち時間) を渡して呼び出す関数
+        """
+        for attempt in range(self.max_retries + 1):
+            if before_attempt:
+                await before_attempt()
+            try:
+                async with limit or nullcontext():
+                    return await asyncio.wait_for(func(*args, **kwargs), self.timeout)
+            except Exception as e:
+                if attempt == self.max_retries or not self.is_retryable(e):
+                    raise
+                delay = self.get_delay(attempt, e)
+                if on_retry:
+                    on_retry(e, delay)
+                await asyncio.sleep(delay)
+
+
+class AsyncIOCore:
+    """
+    外部API(Mistral, Gemini, Gyazo, Notion)の呼び出しを1つのイベントループで実行するクラス
+    イベントループは専用のスレッドで動かし、他のスレッドからは run (結果を待つ) と submit (Futureを返す) で呼び出す。
+    HTTPの接続はサービスごとのクライアントで使い回し、同時実行数はサービスごとのセマフォで全論文共通に制限する。
+
+    Args:
+        concurrency (dict): サービスごとの同時実行数 ex. {"gemini": 8, "notion": 3} (含まれないサービスは無制限)
+        policy (RetryPolicy): タイムアウトとリトライの方針 (Noneならデフォルト)
+        max_connections (int): 1つのHTTPクライアントの最大接続数
+
+    Attributes:
+        loop (asyncio.AbstractEventLoop): 外部APIを呼び出すイベントループ
+        http (httpx.AsyncClient): 汎用のHTTPクライアント (PDFのダウンロード、Gyazo)
+        clients (dict): サービスごとのSDKのクライアント (最初に使うときに作成)
+    """
+    def __init__(self, concurrency: dict=None, policy: RetryPolicy=None, max_connections: int=20):
+        self.concurrency = concurrency or {}
+        self.policy = policy or RetryPolicy()
+        self.max_connections = max_connections
+        self.semaphores = {}
+        self.clients = {}
+        self.http_clients = []
+        # get_clientのfactoryの中でmake_http_clientを呼ぶため再入可能にする
+        self.lock = threading.RLock()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="aio-core", daemon=True)
+        self.thread.start()
+        self.http = self.make_http_client()
+
+    def make_http_client(self) -> httpx.AsyncClient:
+        """
+        接続を使い回すHTTPクライアントを作成する。closeで閉じる。
+        """
+        client = httpx.AsyncClient(
+            timeout=self.policy.timeout,
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            follow_redirects=True,
+        )
+        with self.lock:
+            self.http_clients.append(client)
+        return client
+
+    def get_client(self, name: str, factory):
+        """
+        サービスのSDKのクライアントを返す。初めての場合はfactoryで作成する。
+        """
+        with self.lock:
+            if name not in self.clients:
+                self.clients[name] = factory()
+            return self.clients[name]
+
+    def get_semaphore(self, service: str):
+        if service not in self.concurrency:
+            return None
+        with self.lock:
+            if service not in self.semaphores:
+                self.semaphores[service] = asyncio.Semaphore(self.concurrency[service])
+            return self.semaphores[service]
+
+    def submit(self, service: str, func, *args, before_attempt=None, on_retry=None, **kwargs) -> Future:
+        """
+        コルーチン関数の呼び出しをイベントループに投入し、結果を返すFutureを返す。
+        """
+        coroutine = self.policy.call(
+            func, *args,
+            limit=self.get_semaphore(service),
+            before_attempt=before_attempt,
+            on_retry=on_retry,
+            **kwargs
+        )
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, service: str, func, *args, **kwargs):
+        """
+        コルーチン関数を呼び出し、結果を待って返す。
+        """
+        return self.submit(service, func, *args, **kwargs).result()
+
+    def close(self):
+        async def close_clients():
+            await asyncio.gather(*(client.aclose() for client in self.http_clients), return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(close_clients(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
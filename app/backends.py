@@ -0,0 +1,327 @@
+import os
+import time
+import asyncio
+import statistics
+from collections import deque
+
+from aio import AsyncIOCore
+from rate_limit import RateLimiter
+from metrics import Metrics
+
+
+class Translation:
+    """
+    1回の翻訳結果
+
+    Attributes:
+        text (str): 翻訳結果
+        prompt_tokens (int): 入力トークン数
+        output_tokens (int): 出力トークン数
+        truncated (bool): 出力トークン数の上限で打ち切られたか
+        backend (str): 翻訳したバックエンドの名前 (BackendRouterが設定する)
+    """
+    def __init__(self, text: str, prompt_tokens: int=0, output_tokens: int=0, truncated: bool=False):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.truncated = truncated
+        self.backend = None
+
+
+class GeminiBackend:
+    """
+    Geminiで翻訳するバックエンド
+    google.generativeaiのimportとモデルの作成は最初に翻訳するときに行う。
+
+    Args:
+        model_name (str): Geminiのモデル名
+        rate_limiter (RateLimiter): Gemini APIのリクエスト数の制限 (Noneなら無制限)
+    """
+    name = "gemini"
+
+    def __init__(self, model_name: str, rate_limiter: RateLimiter=None):
+        self.model_name = model_name
+        self.model = None
+        self.rate_limiter = rate_limiter or RateLimiter(0)
+
+    async def before_attempt(self):
+        await self.rate_limiter.acquire_async()
+
+    async def translate(self, prompt: str, md: str) -> Translation:
+        if self.model is None:
+            import google.generativeai as genai
+
+            genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+            self.model = genai.GenerativeModel(model_name=self.model_name)
+        result = await self.model.generate_content_async(
+            [prompt, md],
+            generation_config={"temperature": 0},
+        )
+        return Translation(
+            result.text,
+            result.usage_metadata.prompt_token_count,
+            result.usage_metadata.candidates_token_count,
+            bool(result.candidates) and result.candidates[0].finish_reason.name == "MAX_TOKENS",
+        )
+
+
+class MistralChatBackend:
+    """
+    Mistralのチャットモデルで翻訳するバックエンド
+    クライアントはOCRと同じ "mistral" のものをAsyncIOCoreから取得して共有する。
+
+    Args:
+        model_name (str): Mistralのチャットモデル名
+        io (AsyncIOCore): クライアントの取得先
+    """
+    name = "mistral_chat"
+
+    def __init__(self, model_name: str, io: AsyncIOCore):
+        self.model_name = model_name
+        self.io = io
+        self.client = None
+
+    async def before_attempt(self):
+        pass
+
+    async def translate(self, prompt: str, md: str) -> Translation:
+        if self.client is None:
+            from mistralai import Mistral
+            self.client = self.io.get_client("mistral", lambda: Mistral(os.getenv("MISTRAL_API_KEY"), async_client=self.io.make_http_client()))
+        response = await self.client.chat.complete_async(
+            model=self.model_name,
+            messages=[
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": md},
+            ],
+            temperature=0,
+        )
+        choice = response.choices[0]
+        return Translation(
+            choice.message.content,
+            response.usage.prompt_tokens,
+            response.usage.completion_tokens,
+            choice.finish_reason in ("length", "model_length"),
+        )
+
+
+class LocalBackend:
+    """
+    ローカルで動かすLLMサーバー(Ollama, llama.cppなどのOpenAI互換API)で翻訳するバックエンド
+    クラウドのAPIが使えないときの代替として使う。
+
+    Args:
+        model_name (str): サーバーのモデル名
+        endpoint (str): サーバーのURL ex. "http://localhost:11434"
+        io (AsyncIOCore): HTTPクライアントの取得先
+    """
+    name = "local"
+
+    def __init__(self, model_name: str, endpoint: str, io: AsyncIOCore):
+        self.model_name = model_name
+        self.endpoint = endpoint.rstrip("/")
+        self.http = io.http
+
+    async def before_attempt(self):
+        pass
+
+    async def translate(self, prompt: str, md: str) -> Translation:
+        response = await self.http.post(
+            f"{self.endpoint}/v1/chat/completions",
+            json={
+                "model": self.model_name,
+                "messages": [
+                    {"role": "system", "content": prompt},
+                    {"role": "user", "content": md},
+                ],
+                "temperature": 0,
+            },
+        )
+        response.raise_for_status()
+        body = response.json()
+        choice = body["choices"][0]
+        usage = body.get("usage") or {}
+        return Translation(
+            choice["message"]["content"],
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            choice.get("finish_reason") == "length",
+        )
+
+
+class BackendStats:
+    """
+    バックエンドの直近の処理時間とエラー率
+
+    Args:
+        window (int): 統計に使う直近の呼び出し回数
+    """
+    def __init__(self, window: int=20):
+        # 入力1000文字あたりの処理時間 (秒)
+        self.latencies = deque(maxlen=window)
+        # 成功ならTrue
+        self.outcomes = deque(maxlen=window)
+        self.cooldown_until = 0.0
+
+    def record_success(self, seconds: float, n_chars: int):
+        self.latencies.append(seconds / max(1.0, n_chars / 1000))
+        self.outcomes.append(True)
+
+    def record_cancelled(self, seconds: float, n_chars: int):
+        """
+        ヘッジで他のバックエンドが先に返り、取り消された呼び出しの経過時間を記録する。
+        実際の処理時間はこれ以上なので、記録しないと遅いバックエンドの処理時間が古いまま残る (打ち切られた標本)。
+        """
+        self.latencies.append(seconds / max(1.0, n_chars / 1000))
+
+    def record_error(self, cooldown: float=0.0):
+        self.outcomes.append(False)
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + cooldown)
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def latency(self, quantile: float=0.5):
+        """
+        入力1000文字あたりの処理時間の分位点。記録がなければNone。
+        """
+        if not self.latencies:
+            return None
+        if len(self.latencies) == 1:
+            return self.latencies[0]
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[int(quantile * 100) - 1]
+
+
+class BackendRouter:
+    """
+    チャンクを直近で最も速く、エラーの少ないバックエンドに送るクラス
+    呼び出しはAsyncIOCoreのイベントループで行い、統計もイベントループのスレッドだけで更新する。
+    同時実行数の制限とリトライはAsyncIOCoreのバックエンド名のサービスに従う。
+    - 記録のないバックエンドは設定順に試し、以降は処理時間(中央値)とエラー率で選ぶ。
+    - エラー率が max_error_rate を超えたバックエンドと、429の待機中のバックエンドは後回しにする。
+    - 処理時間が普段(p95)の hedge_factor 倍を超えたチャンクは、次のバックエンドにも送り、先に返った結果を使う。
+    - リトライしても失敗したチャンクは、次のバックエンドで翻訳し直す。
+
+    Args:
+        backends (list): バックエンドのリスト (先頭ほど優先)
+        io (AsyncIOCore): 翻訳を実行するイベントループ
+        hedge_factor (float): ヘッジするまでの時間の、普段の処理時間に対する倍率 (0以下ならヘッジしない)
+        min_hedge_delay (float): ヘッジするまでの最短の時間 (秒)
+        max_error_rate (float): これを超えるエラー率のバックエンドは後回しにする
+        window (int): 統計に使う直近の呼び出し回数
+    """
+    def __init__(self, backends: list, io: AsyncIOCore, hedge_factor: float=2.0, min_hedge_delay: float=5.0, max_error_rate: float=0.5, window: int=20):
+        assert backends, "At least one translation backend is required."
+        self.backends = backends
+        self.io = io
+        self.hedge_factor = hedge_factor
+        self.min_hedge_delay = min_hedge_delay
+        self.max_error_rate = max_error_rate
+        self.stats = {backend.name: BackendStats(window) for backend in backends}
+        # キャッシュ、翻訳メモリ、チェックポイントのキーに含めるバックエンドとモデルの組み合わせ
+        # (他のバックエンドの翻訳結果を、別の設定で使い回さないようにする)
+        self.model_key = ",".join(f"{backend.name}:{backend.model_name}" for backend in backends)
+
+    def rank(self) -> list:
+        """
+        バックエンドを優先する順に並べる。
+        """
+        now = time.monotonic()
+
+        def key(item):
+            order, backend = item
+            stats = self.stats[backend.name]
+            healthy = stats.cooldown_until <= now and stats.error_rate() <= self.max_error_rate
+            latency = stats.latency()
+            # 記録がなければ0として一度は試す
+            score = 0.0 if latency is None else latency * (1 + 2 * stats.error_rate())
+            return (not healthy, score, order)
+
+        return [backend for _, backend in sorted(enumerate(self.backends), key=key)]
+
+    def get_hedge_delay(self, backend, n_chars: int):
+        """
+        チャンクを次のバックエンドにも送るまでの時間 (秒)。記録がなければヘッジしない(None)。
+        """
+        latency = self.stats[backend.name].latency(0.95)
+        if self.hedge_factor <= 0 or latency is None:
+            return None
+        return max(self.min_hedge_delay, self.hedge_factor * latency * max(1.0, n_chars / 1000))
+
+    def translate(self, prompt: str, md: str, metrics: Metrics=None, span: dict=None) -> Translation:
+        """
+        mdを翻訳する。リトライ回数はspanに加算する。
+        """
+        future = asyncio.run_coroutine_threadsafe(self.translate_async(prompt, md, metrics or Metrics(), span if span is not None else {}), self.io.loop)
+        return future.result()
+
+    async def translate_async(self, prompt: str, md: str, metrics: Metrics, span: dict) -> Translation:
+        remaining = self.rank()
+        tasks = {}
+        last_error = None
+        hedged = False
+
+        def launch():
+            backend = remaining.pop(0)
+            tasks[asyncio.ensure_future(self.call(backend, prompt, md, metrics, span))] = backend
+
+        launch()
+        try:
+            while tasks:
+                # 1つ目のバックエンドだけが実行中の間は、遅ければ次のバックエンドにも送る
+                timeout = None
+                if remaining and not hedged and len(tasks) == 1:
+                    timeout = self.get_hedge_delay(next(iter(tasks.values())), len(md))
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    metrics.count("translate.hedge")
+                    launch()
+                    continue
+                for task in done:
+                    backend = tasks.pop(task)
+                    if task.exception() is None:
+                        translation = task.result()
+                        translation.backend = backend.name
+                        return translation
+                    last_error = task.exception()
+                    print(f"Translation with {backend.name} failed ({last_error}).")
+                if not tasks and remaining:
+                    metrics.count("translate.fallback")
+                    launch()
+            raise last_error
+        finally:
+            # 先に返った結果を使い、残りは取り消す
+            for task in tasks:
+                task.cancel()
+
+    async def call(self, backend, prompt: str, md: str, metrics: Metrics, span: dict) -> Translation:
+        stats = self.stats[backend.name]
+
+        async def attempt():
+            start = time.perf_counter()
+            try:
+                translation = await backend.translate(prompt, md)
+            except asyncio.CancelledError:
+                # CancelledErrorはExceptionではないため、下のrecord_errorでは記録されない
+                stats.record_cancelled(time.perf_counter() - start, len(md))
+                raise
+            stats.record_success(time.perf_counter() - start, len(md))
+            return translation
+
+        def on_retry(e: Exception, delay: float):
+            stats.record_error(delay if self.io.policy.get_status(e) == 429 else 0.0)
+            span["retries"] = span.get("retries", 0) + 1
+            metrics.count(f"{backend.name}.retry")
+            print(f"Translation failed ({e}). Retrying in {delay} seconds...")
+
+        try:
+            return await self.io.policy.call(
+                attempt,
+                limit=self.io.get_semaphore(backend.name),
+                before_attempt=backend.before_attempt,
+                on_retry=on_retry,
+            )
+        except Exception:
+            stats.record_error()
+            raise
@@ -0,0 +1,195 @@
+import json
+import time
+import asyncio
+import threading
+
+from notion_client import AsyncClient
+
+from metrics import Metrics
+from aio import AsyncIOCore, RetryPolicy
+
+# Notion APIの1リクエストあたりの上限
+MAX_CHILDREN = 100 # children配列の要素数
+MAX_BLOCK_ELEMENTS = 1000 # 入れ子を含むブロックの総数
+MAX_PAYLOAD_BYTES = 450 * 1024 # ペイロードのサイズ (上限は500KBだが余裕を持たせる)
+# pack_blocksに渡すと、上限に達していなくてもそこまでのブロックを1バッチにする
+FLUSH = object()
+
+
+def count_block_elements(block: dict) -> int:
+    """
+    入れ子の子ブロック(テーブルの行など)を含めたブロック数を数える。
+    """
+    body = block.get(block.get("type"), {})
+    children = body.get("children", []) if isinstance(body, dict) else []
+    return 1 + sum(count_block_elements(child) for child in children)
+
+
+def pack_blocks(blocks):
+    """
+    ブロックを、1リクエストの要素数とサイズの上限に収まるバッチに分けて1つずつ返すジェネレータ。
+    blocksの途中にFLUSHがあれば、そこまでのブロックをすぐに返す (チャンクの区切りなど)。
+    """
+    current, current_elements, current_bytes = [], 0, 0
+    for block in blocks:
+        if block is FLUSH:
+            if current:
+                yield current
+                current, current_elements, current_bytes = [], 0, 0
+            continue
+        n_elements = count_block_elements(block)
+        n_bytes = len(json.dumps(block, ensure_ascii=False).encode("utf-8"))
+        if current and (
+            len(current) >= MAX_CHILDREN
+            or current_elements + n_elements > MAX_BLOCK_ELEMENTS
+            or current_bytes + n_bytes > MAX_PAYLOAD_BYTES
+        ):
+            yield current
+            current, current_elements, current_bytes = [], 0, 0
+        current.append(block)
+        current_elements += n_elements
+        current_bytes += n_bytes
+    if current:
+        yield current
+
+
+class AdaptiveThrottle:
+    """
+    リクエストの間隔を調整するクラス
+    429が返ってきたら間隔を広げ、成功が続けば上限(requests_per_second)まで間隔を戻す。
+
+    Args:
+        requests_per_second (float): 1秒あたりの最大リクエスト数
+        max_interval (float): リクエスト間隔の最大値 (秒)
+    """
+    def __init__(self, requests_per_second: float, max_interval: float=10.0):
+        self.min_interval = 1.0 / requests_per_second
+        self.max_interval = max_interval
+        self.interval = self.min_interval
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def wait_async(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def reserve(self) -> float:
+        """
+        次のリクエストの時刻を予約し、それまでの待ち時間を返す。
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        return wait
+
+    def on_success(self):
+        with self.lock:
+            self.interval = max(self.min_interval, self.interval * 0.9)
+
+    def on_rate_limited(self, retry_after: float):
+        with self.lock:
+            self.interval = min(self.max_interval, self.interval * 2)
+            self.next_time = max(self.next_time, time.monotonic() + retry_after)
+
+
+class BlockAppendError(Exception):
+    """
+    ブロックの追加に失敗したときの例外
+    appended_batchesまでは追加済みなので、start_batchに指定して再開できる。
+    """
+    def __init__(self, message: str, appended_batches: int):
+        super().__init__(message)
+        self.appended_batches = appended_batches
+
+
+class BlockAppender:
+    """
+    Notionのページにブロックを追加・削除するクラス
+    ブロックを要素数とサイズの上限まで詰めて送り、429と一時的なエラーはリトライする。
+
+    Args:
+        notion (AsyncClient): Notionのクライアント
+        throttle (AdaptiveThrottle): リクエスト間隔の調整 (複数のBlockAppenderで共有できる)
+        io (AsyncIOCore): Notion APIを呼び出すイベントループ (リトライの方針もこれに従う)
+        start_batch (int): このバッチ数までは追加済みとしてスキップする (失敗からの再開用)
+        metrics (Metrics): 処理時間とリトライ回数の記録先 (Noneなら記録しない)
+        on_batch_appended (callable): バッチを追加するたびに追加済みのバッチ数を渡して呼び出す (処理状態の保存用)
+
+    Attributes:
+        appended_batches (int): これまでに追加した(スキップしたものを含む)バッチ数
+    """
+    def __init__(self, notion: AsyncClient, throttle: AdaptiveThrottle, io: AsyncIOCore, start_batch: int=0, metrics: Metrics=None, on_batch_appended=None):
+        self.notion = notion
+        self.throttle = throttle
+        self.io = io
+        self.start_batch = start_batch
+        self.appended_batches = 0
+        self.metrics = metrics or Metrics()
+        self.on_batch_appended = on_batch_appended
+
+    def append(self, page_id: str, blocks, after: str=None):
+        """
+        ページにブロックを追加する。
+        afterを指定した場合、そのブロックの直後に挿入する (バッチが複数あれば順に続けて挿入する)。
+        """
+        for batch in pack_blocks(blocks):
+            if self.appended_batches < self.start_batch:
+                # 前回の実行で追加済み
+                self.appended_batches += 1
+                continue
+            results = self.append_batch(page_id, batch, after)
+            if after and results:
+                after = results[-1]["id"]
+            self.appended_batches += 1
+            if self.on_batch_appended:
+                self.on_batch_appended(self.appended_batches)
+
+    def append_batch(self, page_id: str, batch: list, after: str=None) -> list:
+        """
+        1バッチを追加し、作成されたブロックを返す。
+        """
+        with self.metrics.span("notion_append", n_blocks=len(batch), batch_index=self.appended_batches) as span:
+            kwargs = {"after": after} if after else {}
+            try:
+                response, span["retries"] = self.request(self.notion.blocks.children.append, block_id=page_id, children=batch, **kwargs)
+            except Exception as e:
+                raise BlockAppendError(f"Failed to append blocks ({e}).", self.appended_batches) from e
+            return response.get("results", [])
+
+    def delete_blocks(self, block_ids: list):
+        """
+        ブロックを1つずつ削除する (Notion APIに一括削除はない)。
+        """
+        for block_id in block_ids:
+            with self.metrics.span("notion_delete") as span:
+                _, span["retries"] = self.request(self.notion.blocks.delete, block_id=block_id)
+
+    def request(self, func, **kwargs) -> tuple:
+        """
+        リクエスト間隔を調整しながらNotion APIを呼び出す。429と一時的なエラーはRetryPolicyに従ってリトライする。
+        (レスポンス, リトライ回数) を返す。
+        """
+        retries = 0
+
+        def on_retry(e: Exception, delay: float):
+            nonlocal retries
+            retries += 1
+            status = RetryPolicy.get_status(e)
+            self.metrics.count("notion.retry", status=status)
+            if status == 429:
+                self.throttle.on_rate_limited(delay)
+                print(f"Rate limited by Notion. Retrying in {delay} seconds...")
+            else:
+                print(f"Notion request failed ({e}). Retrying in {delay} seconds...")
+
+        response = self.io.run("notion", func, before_attempt=self.throttle.wait_async, on_retry=on_retry, **kwargs)
+        # 成功したらリクエスト間隔を少しずつ元に戻す
+        self.throttle.on_success()
+        return response, retries
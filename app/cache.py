@@ -0,0 +1,120 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+# 上限を超えたら、上限のこの割合まで削除する (上限付近で保存のたびにディレクトリを走査しないように余裕を持たせる)
+EVICT_TARGET_RATIO = 0.9
+
+
+class DiskCache:
+    """
+    内容のハッシュをキーとしてJSONをディスクに保存するキャッシュ
+    合計サイズが上限を超えた場合、最も長く参照されていないものから削除する (LRU)。
+    合計サイズは起動時に1度だけ数え、以降は保存と削除のたびに増減させる (上限を超えたときだけディレクトリを走査する)。
+
+    Args:
+        cache_dir (str): キャッシュを保存するディレクトリ
+        max_bytes (int): キャッシュの合計サイズの上限 (バイト)
+    """
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self.scan())
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        キーの構成要素からsha256のキーを作成する。
+        """
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str):
+        """
+        キャッシュを取得する。存在しない場合はNoneを返す。
+        """
+        path = self.get_path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # 参照時刻を更新 (LRUの順序に使う)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def set(self, key: str, value):
+        """
+        キャッシュを保存し、上限を超えていれば古いものを削除する。
+        """
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 上書きする場合は古いファイルの分を合計サイズから除く
+        try:
+            old_size = os.path.getsize(path)
+        except FileNotFoundError:
+            old_size = 0
+        # 書き込み途中のファイルを読まないように一時ファイル経由で保存
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        new_size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        self.add_bytes(new_size - old_size)
+
+    def add_bytes(self, n_bytes: int):
+        """
+        ディレクトリに保存したファイルのサイズを合計サイズに加え、上限を超えていれば古いものを削除する。
+        (ImageSpoolが同じディレクトリに画像を書き出したときにも呼ぶ)
+        """
+        with self.lock:
+            self.total_bytes += n_bytes
+            if self.total_bytes <= self.max_bytes:
+                return
+            self.evict()
+
+    def scan(self) -> list:
+        """
+        ディレクトリ内のファイルの (参照時刻, サイズ, パス) を返す。
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                # 書き込み途中のファイルは除く (ImageSpoolの画像もキャッシュとして数える)
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        合計サイズが上限のEVICT_TARGET_RATIO以下になるまで、参照時刻の古いものから削除する。(self.lockを取得した状態で呼ぶ)
+        走査したときに合計サイズを実際の値に合わせ直す (他のプロセスが書き込んだ分などのずれを直す)。
+        """
+        entries = self.scan()
+        self.total_bytes = sum(size for _, size, _ in entries)
+        if self.total_bytes <= self.max_bytes:
+            return
+        target_bytes = self.max_bytes * EVICT_TARGET_RATIO
+        for _, size, path in sorted(entries):
+            if self.total_bytes <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.total_bytes -= size
@@ -4,5 +4,37 @@ class CFG:
     prompt = "以下のマークダウンファイルを翻訳してください。翻訳内容以外の文章は決して出力しないでください。数式と画像、テーブルは絶対に変更しないでください。インライン数式は$で、ブロック数式は$$で囲われています。画像は!で始まり、テーブルは'|'で囲われています。科学的専門用語は無理に訳さず英語表記でおねがいします。入力された文章を日本語で意訳しなさい。"
     output_dir = "../output/"
     gyazo_endpoint = "https://upload.gyazo.com/api/upload"
-    max_input_words = 4096 # geminiの出力トークン数の上限が8192で、出力トークン数は入力単語数の約2倍になるため、入力単語数は4096以下にする
+    max_output_tokens = 8192 # geminiの出力トークン数の上限 (入力はこれに収まるようにトークン数を推定して分割する)
+    max_workers = 4 # 翻訳チャンクの並列数
+    requests_per_minute = 15 # Gemini APIの1分あたりの最大リクエスト数 (gemini-2.0-flashの無料枠は15RPM)
+    max_retries = 3 # 外部API(Mistral, Gemini, Gyazo, Notion)の呼び出しに失敗したときの最大リトライ回数
+    request_timeout = 300 # 外部APIの1回の呼び出しのタイムアウト (秒)
+    service_concurrency = {"mistral": 2, "gemini": 8, "mistral_chat": 4, "local": 1, "gyazo": 8, "notion": 3} # 外部APIごとの同時リクエスト数 (同時に処理する全論文で共有)
+    translation_backends = ["gemini"] # 翻訳に使うバックエンド ("gemini", "mistral_chat", "local")。直近で速くエラーの少ないものに送る (先頭ほど優先)
+    mistral_chat_model_name = "mistral-large-latest" # mistral_chatで翻訳するモデル
+    local_model_name = "qwen2.5:14b" # localで翻訳するモデル
+    local_endpoint = "http://localhost:11434" # localのOpenAI互換APIのURL (Ollamaなど)
+    hedge_factor = 2.0 # 普段の処理時間のこの倍数を超えたチャンクは次のバックエンドにも送る (0以下なら送らない)
+    cache_dir = "../output/cache/" # OCR結果と翻訳結果のキャッシュの保存先
+    cache_max_bytes = 1024 ** 3 # キャッシュの合計サイズの上限 (1GB)
+    max_page_workers = 2 # 同時に処理する論文(ページ)の数
+    stream_to_notion = True # 翻訳できたチャンクから順にNotionに追加する
+    notion_requests_per_second = 3 # Notion APIの1秒あたりの最大リクエスト数
+    metrics_path = "../output/metrics.jsonl" # 処理時間とAPI使用量の記録先 (JSON Lines)
+    checkpoint_dir = "../output/checkpoints/" # ページごとの処理状態の保存先 (途中で落ちた場合に再開する)
+    image_spool_dir = "../output/cache/images/" # OCR結果の画像の書き出し先 (キャッシュと合わせてサイズの上限で削除される)
+    use_local_pdf_extraction = True # PDFのテキスト層から抽出し、品質の低いページのみOCRする (PyMuPDFが必要)
+    min_text_quality = 0.8 # テキスト層の品質(0~1)がこれ未満のページはOCRする
+    ocr_range_pages = 20 # OCRするページがこの数を超える場合、このページ数ごとの範囲に分けて並列にOCRし、済んだ範囲から翻訳を始める (0なら1回でOCRする)
+    ocr_range_workers = 4 # 1つのPDFで並列にOCRするページ範囲の数 (Mistral全体の同時リクエスト数はservice_concurrencyに従う)
+    incremental_translation = True # 改訂された論文は前回の翻訳結果と比較し、変更のあったセクションだけを翻訳して子ページを更新する
+    revision_dir = "../output/revisions/" # 前回の翻訳結果の保存先 (差分翻訳に使う)
+    page_index_path = "../output/page_index.sqlite3" # Notionのデータベースのページと処理状態の保存先 (Noneなら毎回Notionに問い合わせる)
+    translation_memory_path = "../output/translation_memory.sqlite3" # 段落単位の翻訳結果の保存先 (Noneなら使わない)
+    preprocess_images = True # アップロード前に画像を縮小、再圧縮し、小さすぎる画像を除く (Pillowが必要)
+    image_max_dimension = 1600 # 縮小後の画像の長辺の最大ピクセル数
+    image_min_dimension = 48 # 長辺がこれ未満の画像(装飾の断片など)はアップロードしない
+    image_quality = 85 # 再圧縮するJPEGの品質
+    mask_untranslatable = True # 数式、コード、画像、テーブルの数値をプレースホルダに置き換えてから翻訳する (トークン数の削減)
+    mask_references = True # 参考文献の本文も翻訳しない (mask_untranslatableがTrueの場合)
 cfg = CFG()
\ No newline at end of file
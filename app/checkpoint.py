@@ -0,0 +1,115 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+
+
+class CheckpointStore(ABC):
+    """
+    ページごとの処理状態を保存するストアのインターフェース
+    ステージ(ocr, chunks, images, notion)ごとにJSONにできる値を保存する。
+    """
+    @abstractmethod
+    def load(self, page_id: str, stage: str):
+        """
+        保存した値を返す。保存されていなければNone。
+        """
+
+    @abstractmethod
+    def save(self, page_id: str, stage: str, value):
+        """
+        値を保存する。同じステージの値は上書きする。
+        """
+
+    @abstractmethod
+    def delete(self, page_id: str):
+        """
+        ページの全てのステージの値を削除する。
+        """
+
+
+class FileCheckpointStore(CheckpointStore):
+    """
+    処理状態を {checkpoint_dir}/{page_id}/{stage}.json に保存するストア
+
+    Args:
+        checkpoint_dir (str): 保存先のディレクトリ
+    """
+    def __init__(self, checkpoint_dir: str):
+        self.checkpoint_dir = checkpoint_dir
+
+    def get_path(self, page_id: str, stage: str) -> str:
+        return os.path.join(self.checkpoint_dir, page_id, f"{stage}.json")
+
+    def load(self, page_id: str, stage: str):
+        try:
+            with open(self.get_path(page_id, stage), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, page_id: str, stage: str, value):
+        path = self.get_path(page_id, stage)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 途中で落ちても壊れたファイルが残らないように一時ファイル経由で保存
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def delete(self, page_id: str):
+        shutil.rmtree(os.path.join(self.checkpoint_dir, page_id), ignore_errors=True)
+
+
+class PageCheckpoint:
+    """
+    1ページ分の処理状態を読み書きするクラス (スレッドセーフ)
+
+    Args:
+        store (CheckpointStore): 保存先のストア
+        page_id (str): NotionのページID
+
+    保存するステージ:
+        ocr: {"markdown": OCR結果のmarkdown, "images": {画像名: ImageSpoolに書き出した画像のパス}}
+        chunks: {チャンク番号: {"hash": 翻訳前のチャンクのハッシュ, "text": 翻訳結果}}
+        images: {画像名: GyazoのURL}
+        notion: {"child_page_id": 子ページのID, "appended_batches": 追加済みのバッチ数}
+    """
+    def __init__(self, store: CheckpointStore, page_id: str):
+        self.store = store
+        self.page_id = page_id
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def get(self, stage: str, default=None):
+        with self.lock:
+            if stage not in self.states:
+                self.states[stage] = self.store.load(self.page_id, stage)
+            value = self.states[stage]
+        return default if value is None else value
+
+    def set(self, stage: str, value):
+        with self.lock:
+            self.states[stage] = value
+            self.store.save(self.page_id, stage, value)
+
+    def update(self, stage: str, key: str, value):
+        """
+        dictのステージの1項目を更新する。
+        """
+        # 保存済みの状態を読み込んでから更新する
+        self.get(stage)
+        with self.lock:
+            state = {**(self.states.get(stage) or {}), key: value}
+            self.states[stage] = state
+            self.store.save(self.page_id, stage, state)
+
+    def clear(self):
+        """
+        ページの処理が完了したら処理状態を削除する。
+        """
+        with self.lock:
+            self.states = {}
+            self.store.delete(self.page_id)
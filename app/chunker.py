@@ -0,0 +1,202 @@
+import re
+
+# 日本語・中国語・韓国語の文字 (1文字あたり約1トークン)
+CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+# LaTeXのコマンドと記号 (細かいトークンに分割されやすい)
+LATEX_PATTERN = re.compile(r'\\[a-zA-Z]+|[{}^_$&\\]')
+HEADER_PATTERN = re.compile(r'#+')
+
+# 英語から日本語に翻訳したときの出力トークン数 / 入力トークン数
+OUTPUT_TOKEN_RATIO = 1.5
+# 推定誤差を考慮して出力上限に対して残す余裕
+SAFETY_MARGIN = 0.85
+
+
+def find_headers(lines) -> list:
+    """
+    見出し行の番号のリストを返す。
+    コードブロック(``` ... ```)と複数行のブロック数式($$ ... $$)の中の'#'で始まる行(コメントなど)は見出しとみなさない。
+    """
+    headers = []
+    fence_flag = block_math_flag = False
+    for n, line in enumerate(lines):
+        stripped = line.strip()
+        if not block_math_flag and stripped.startswith("```"):
+            fence_flag = not fence_flag
+        elif not fence_flag and (block_math_flag or stripped.startswith("$$")) and line.count("$$") % 2 == 1:
+            block_math_flag = not block_math_flag
+        elif not fence_flag and not block_math_flag and HEADER_PATTERN.match(line):
+            headers.append(n)
+    return headers
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    テキストのトークン数をローカルで推定する。
+    英語は約4文字で1トークン、CJK文字は1文字1トークン、LaTeXのコマンドと記号は1つ1トークンとして数える。
+    """
+    n_cjk = len(CJK_PATTERN.findall(text))
+    latex_tokens = LATEX_PATTERN.findall(text)
+    n_latex_chars = sum(len(token) for token in latex_tokens)
+    n_other_chars = len(text) - n_cjk - n_latex_chars
+    return n_cjk + len(latex_tokens) + (n_other_chars + 3) // 4
+
+
+class ChunkPlanner:
+    """
+    markdownを翻訳用のチャンクに分割するクラス
+    出力トークン数が上限に収まる範囲で、ヘッダー単位のセクションをできるだけ大きくまとめる。
+    1セクションが上限を超える場合は段落単位、それでも超える場合は行単位で分割する。
+
+    Args:
+        max_output_tokens (int): モデルの出力トークン数の上限
+        count_tokens (callable): トークン数を数える関数 (Noneならestimate_tokensを使う)
+            ex. lambda text: model.count_tokens(text).total_tokens
+        output_token_ratio (float): 出力トークン数 / 入力トークン数
+    """
+    def __init__(self, max_output_tokens: int, count_tokens=None, output_token_ratio: float=OUTPUT_TOKEN_RATIO):
+        self.count_tokens = count_tokens or estimate_tokens
+        self.max_input_tokens = int(max_output_tokens * SAFETY_MARGIN / output_token_ratio)
+
+    def plan(self, md: str) -> list:
+        """
+        markdownをチャンクのリストに分割する。チャンクを'\\n'で結合すると元のmarkdownに戻る。
+        """
+        return list(self.plan_stream([md]))
+
+    def plan_stream(self, mds):
+        """
+        順に届くmarkdown(見出しの直前で区切ったもの)をチャンクに分割し、確定したチャンクから1つずつ返すジェネレータ。
+        最後のチャンクは次のmarkdownの先頭とまとめられるため、次のmarkdownが届くか終わるまで返さない。
+        mdsを'\\n'で結合してplanに渡した場合と同じチャンクになる。
+        """
+        def iter_lines():
+            previous = None
+            for md in mds:
+                if previous is not None:
+                    # 改行で終わる(または空の)markdownは、次と結合すると末尾に空行が残る
+                    yield previous.splitlines() + ([""] if previous.endswith("\n") or not previous else [])
+                previous = md
+            if previous is not None:
+                yield previous.splitlines()
+
+        def iter_units():
+            for lines in iter_lines():
+                for section in self.split_sections(lines):
+                    yield from self.fit(section, [self.split_paragraphs, self.split_lines])
+
+        for lines in self.iter_pack(iter_units()):
+            yield '\n'.join(lines)
+
+    def plan_sections(self, sections: list) -> list:
+        """
+        セクション(行のリスト)のリストをチャンクに分割する。
+        各チャンクは (セクション番号, 行のリスト) のリストで、同じセクションの行は1つにまとめる。
+        """
+        return list(self.plan_sections_stream(sections))
+
+    def plan_sections_stream(self, sections):
+        """
+        plan_sectionsと同じまとめ方で、チャンクが確定するたびに返すジェネレータ。sectionsは順に届くジェネレータでもよい。
+        """
+        def iter_units():
+            for i, section in enumerate(sections):
+                for lines in self.fit(section, [self.split_paragraphs, self.split_lines]):
+                    yield [(i, lines)]
+
+        for chunk in self.iter_pack(iter_units(), count=lambda parts: self.count([line for _, lines in parts for line in lines])):
+            parts = []
+            for i, lines in chunk:
+                if parts and parts[-1][0] == i:
+                    parts[-1] = (i, parts[-1][1] + lines)
+                else:
+                    parts.append((i, lines))
+            yield parts
+
+    def count(self, lines: list) -> int:
+        return self.count_tokens('\n'.join(lines))
+
+    def fit(self, lines: list, splitters: list) -> list:
+        """
+        上限を超える行のまとまりを、splittersの順に細かく分割する。
+        """
+        if len(lines) <= 1 or not splitters or self.count(lines) <= self.max_input_tokens:
+            return [lines]
+        units = []
+        for part in splitters[0](lines):
+            units.extend(self.fit(part, splitters[1:]))
+        return units
+
+    def pack(self, units: list, count=None) -> list:
+        """
+        連続する行のまとまりを、入力トークン数の上限まで詰めて1チャンクにする。
+        """
+        return list(self.iter_pack(units, count))
+
+    def iter_pack(self, units, count=None):
+        """
+        packと同じ詰め方で、チャンクが確定するたびに返すジェネレータ。unitsはジェネレータでもよい。
+        """
+        count = count or self.count
+        current, current_tokens = [], 0
+        for unit in units:
+            n_tokens = count(unit)
+            if current and current_tokens + n_tokens > self.max_input_tokens:
+                yield current
+                current, current_tokens = [], 0
+            current = current + unit
+            current_tokens += n_tokens
+        if current:
+            yield current
+
+    @staticmethod
+    def split_sections(lines: list) -> list:
+        """
+        ヘッダー行の直前で分割する。コードブロックとブロック数式の中では分割しない。
+        """
+        bounds = [n for n in find_headers(lines) if n > 0]
+        return [lines[start:end] for start, end in zip([0] + bounds, bounds + [len(lines)]) if start < end]
+
+    @staticmethod
+    def split_sections_stream(mds):
+        """
+        順に届くmarkdown(OCRが済んだページなど。'\\n\\n'で結合すると全体になる)を見出し単位のセクションに分割し、
+        確定したセクションのリストを返すジェネレータ。最後のセクションは次の見出しが届くまで返さない。
+        返したセクションを順に並べると、全体をsplit_sectionsで分割した場合と同じになる。
+        """
+        rest = None
+        for md in mds:
+            buffer = md if rest is None else rest + "\n\n" + md
+            # 最後の見出し行の位置で、確定したセクションと続きのあるセクションに分ける
+            lines = buffer.splitlines(keepends=True)
+            headers = [n for n in find_headers(lines) if n > 0]
+            last_header = sum(len(line) for line in lines[:headers[-1]]) if headers else 0
+            rest = buffer[last_header:]
+            if last_header > 0:
+                yield ['\n'.join(lines) for lines in ChunkPlanner.split_sections(buffer[:last_header].splitlines())]
+        if rest is not None:
+            yield ['\n'.join(lines) for lines in ChunkPlanner.split_sections(rest.splitlines())]
+
+    @staticmethod
+    def split_paragraphs(lines: list) -> list:
+        """
+        空行の直後で分割する。ブロック数式($$ ... $$)の途中では分割しない。
+        """
+        paragraphs = []
+        current = []
+        block_math_flag = False
+        for line in lines:
+            current.append(line)
+            # 1行で開閉しているブロック数式($$ ... $$)は除く
+            if line.count("$$") % 2 == 1:
+                block_math_flag = not block_math_flag
+            if not line.strip() and not block_math_flag:
+                paragraphs.append(current)
+                current = []
+        if current:
+            paragraphs.append(current)
+        return paragraphs
+
+    @staticmethod
+    def split_lines(lines: list) -> list:
+        return [[line] for line in lines]
@@ -0,0 +1,91 @@
+import os
+import threading
+from concurrent.futures import Future
+
+from aio import AsyncIOCore
+from metrics import Metrics
+from image_processor import ImageProcessor
+
+
+class GyazoUploader:
+    """
+    画像をGyazoに並列アップロードするクラス
+    アップロードはAsyncIOCoreのイベントループで行い、同時実行数は "gyazo" のセマフォで制限する。
+    processorがあれば、アップロードの前に画像を縮小、再圧縮し、小さすぎる画像はアップロードしない。
+
+    Args:
+        access_token (str): Gyazoアクセストークン
+        endpoint (str): GyazoのアップロードAPIのエンドポイント
+        io (AsyncIOCore): アップロードを実行するイベントループ
+        metrics (Metrics): 処理時間の記録先 (Noneなら記録しない)
+        processor (ImageProcessor): アップロード前の画像の処理 (Noneまたは使えない場合は元の画像をアップロードする)
+
+    Attributes:
+        http (httpx.AsyncClient): keep-aliveで使い回すHTTPクライアント (AsyncIOCoreと共有)
+        futures (dict):
+            アップロード結果
+            (key: 画像ファイルのパス, value: URLを返すFuture。アップロードしない画像はNoneを返す)
+    """
+    def __init__(self, access_token: str, endpoint: str, io: AsyncIOCore, metrics: Metrics=None, processor: ImageProcessor=None):
+        self.access_token = access_token
+        self.endpoint = endpoint
+        self.io = io
+        self.http = io.http
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.metrics = metrics or Metrics()
+        self.processor = processor if processor and processor.is_available() else None
+
+    def submit(self, image_path: str) -> Future:
+        """
+        画像ファイルのアップロードを開始し、URLを返すFutureを返す。
+        同じ内容の画像(ImageSpoolでは同じパスになる)はアップロードせず、既存のFutureを返す。
+        """
+        with self.lock:
+            if image_path not in self.futures:
+                self.futures[image_path] = self.io.submit("gyazo", self.upload, image_path)
+            return self.futures[image_path]
+
+    async def upload(self, image_path: str) -> str:
+        """
+        画像ファイルをGyazoにアップロードし、URLを返す。アップロードしない画像はNoneを返す。
+        """
+        img_binary = await self.prepare(image_path)
+        if img_binary is None:
+            return None
+        with self.metrics.span("image_upload", n_bytes=len(img_binary)):
+            response = await self.http.post(
+                self.endpoint,
+                files={'imagedata': img_binary},
+                data={'access_token': self.access_token}
+            )
+            response.raise_for_status()
+        return response.json()['url']
+
+    async def prepare(self, image_path: str) -> bytes:
+        """
+        アップロードする画像のバイト列を返す。processorがあれば処理した画像を返し、小さすぎる画像はNoneを返す。
+        """
+        if self.processor:
+            original_bytes = os.path.getsize(image_path)
+            try:
+                img_binary = await self.processor.process(image_path)
+            except Exception as e:
+                print(f"Failed to preprocess image ({e}). Uploading the original.")
+            else:
+                if img_binary is None:
+                    self.metrics.count("image.dropped")
+                    return None
+                self.metrics.count("image.bytes_saved", original_bytes - len(img_binary))
+                return img_binary
+        with open(image_path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        """
+        アップロード中の画像を待つ。(HTTPクライアントはAsyncIOCoreが閉じる)
+        """
+        with self.lock:
+            futures = list(self.futures.values())
+        for future in futures:
+            future.exception()
@@ -0,0 +1,87 @@
+import io
+import os
+import asyncio
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+
+def preprocess_image(image_path: str, max_dimension: int, min_dimension: int, quality: int):
+    """
+    画像ファイルを縮小してJPEGに再圧縮し、アップロードするバイト列を返す (スレッドプールで実行する)。
+    小さすぎる画像(装飾の断片など)はNoneを返す。再圧縮しても小さくならない場合は元のバイト列を返す。
+    """
+    from PIL import Image
+
+    with open(image_path, "rb") as f:
+        original = f.read()
+    with Image.open(io.BytesIO(original)) as image:
+        if max(image.size) < min_dimension:
+            return None
+        if max(image.size) <= max_dimension and image.format == "JPEG":
+            return original
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        if image.mode in ("RGBA", "LA", "P"):
+            # 透過部分は白で塗りつぶす
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    processed = buffer.getvalue()
+    return processed if len(processed) < len(original) else original
+
+
+class ImageProcessor:
+    """
+    アップロード前に画像を縮小、再圧縮し、小さすぎる画像を除くクラス
+    画像のデコードとエンコードはイベントループを止めないようにスレッドプールで行う (PillowはデコードとエンコードでGILを解放する)。
+    プロセスプールは、子プロセスがメインのモジュール(pipelineのシングルトンやSlackのApp)を作り直すため使わない。
+    Pillowがインストールされていない場合は使えない。
+
+    Args:
+        max_dimension (int): 縮小後の長辺の最大ピクセル数
+        min_dimension (int): 長辺がこれ未満の画像はアップロードしない
+        quality (int): JPEGの品質 (1~95)
+        max_workers (int): スレッドの数 (Noneならコア数)
+    """
+    def __init__(self, max_dimension: int=1600, min_dimension: int=48, quality: int=85, max_workers: int=None):
+        self.max_dimension = max_dimension
+        self.min_dimension = min_dimension
+        self.quality = quality
+        self.max_workers = max_workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_available() -> bool:
+        return importlib.util.find_spec("PIL") is not None
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        # 使うときに初めてスレッドプールを作る
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers or os.cpu_count(), thread_name_prefix="image")
+            return self.executor
+
+    async def process(self, image_path: str):
+        """
+        画像ファイルを処理し、アップロードするバイト列を返す。アップロードしない画像はNone。
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.get_executor(),
+            preprocess_image,
+            image_path,
+            self.max_dimension,
+            self.min_dimension,
+            self.quality,
+        )
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
@@ -0,0 +1,54 @@
+import os
+import re
+import base64
+import hashlib
+import tempfile
+
+from cache import DiskCache
+
+# data URL のヘッダー ex. "data:image/jpeg;base64,"
+DATA_URL_PATTERN = re.compile(r"^data:image/([a-zA-Z0-9.+-]+);base64,")
+
+
+class ImageSpool:
+    """
+    base64の画像をデコードしてファイルに書き出すクラス
+    画像をメモリに持ち続けないように、OCR結果を受け取ったらすぐにファイルに退避する。
+    ファイル名は画像の内容のsha256なので、同じ内容の画像は1つのファイルになる。
+
+    Args:
+        spool_dir (str): 書き出し先のディレクトリ (Noneなら一時ディレクトリ)
+        cache (DiskCache): spool_dirを含むキャッシュ (書き出した画像のサイズを合計サイズに加える。Noneなら加えない)
+    """
+    def __init__(self, spool_dir: str=None, cache: DiskCache=None):
+        self.spool_dir = spool_dir or tempfile.mkdtemp(prefix="images_")
+        self.cache = cache
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def spool(self, img_base64: str) -> str:
+        """
+        base64の画像(data URL)をファイルに書き出し、そのパスを返す。
+        """
+        match = DATA_URL_PATTERN.match(img_base64)
+        ext = match.group(1) if match else "jpeg"
+        img_binary = base64.b64decode(img_base64[match.end():] if match else img_base64.split(',')[-1])
+        path = os.path.join(self.spool_dir, f"{hashlib.sha256(img_binary).hexdigest()}.{ext}")
+        if not os.path.exists(path):
+            # 書き込み途中のファイルを読まないように一時ファイル経由で保存
+            fd, tmp_path = tempfile.mkstemp(dir=self.spool_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(img_binary)
+            os.replace(tmp_path, path)
+            if self.cache is not None:
+                self.cache.add_bytes(len(img_binary))
+        else:
+            # LRUで削除されないように参照時刻を更新
+            os.utime(path)
+        return path
+
+    @staticmethod
+    def exists(images_dict: dict) -> bool:
+        """
+        images_dictの画像ファイルが全て残っているかを返す。
+        """
+        return all(os.path.exists(path) for path in images_dict.values())
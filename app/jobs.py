@@ -0,0 +1,47 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class JobQueue:
+    """
+    バックグラウンドでジョブを実行するキュー
+    同じ冪等キー(NotionのページIDなど)のジョブが実行中または待機中の場合は、新たに投入しない。
+
+    Args:
+        max_workers (int): 同時に実行するジョブの数
+    """
+    def __init__(self, max_workers: int):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.in_flight = set()
+        self.lock = threading.Lock()
+
+    def submit(self, key: str, func, *args, **kwargs) -> Future:
+        """
+        ジョブを投入する。同じキーのジョブが既にある場合はNoneを返す。
+        """
+        with self.lock:
+            if key in self.in_flight:
+                return None
+            self.in_flight.add(key)
+        try:
+            return self.executor.submit(self.run, key, func, *args, **kwargs)
+        except Exception:
+            self.release(key)
+            raise
+
+    def run(self, key: str, func, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.release(key)
+
+    def release(self, key: str):
+        with self.lock:
+            self.in_flight.discard(key)
+
+    def is_in_flight(self, key: str) -> bool:
+        with self.lock:
+            return key in self.in_flight
+
+    def shutdown(self, wait: bool=True):
+        self.executor.shutdown(wait=wait)
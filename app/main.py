@@ -1,12 +1,13 @@
 import os
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 
-from translate import Translator
 from notion import NotionWriter
+from pipeline import translate_page, get_untranslated_pages, warm_up, io_core, notion_throttle
+from jobs import JobQueue
 from cfg import cfg
 
 # .env ファイルから環境変数を読み込みます
@@ -15,47 +16,57 @@ load_dotenv()
 # ボットトークンと署名シークレットを使ってアプリを初期化します
 app = App(token=os.environ.get("SLACK_BOT_TOKEN"))
 
+# 論文の処理はリスナーの外のワーカーで行い、同じページを重複して処理しないようにページIDをキーにします
+job_queue = JobQueue(cfg.max_page_workers)
+# 未翻訳ページの問い合わせもリスナーをブロックしないようにバックグラウンドで行います
+dispatcher = ThreadPoolExecutor(max_workers=1)
+
+
+def post(say, text: str):
+    say(
+        blocks=[
+            {
+                "type": "section",
+                "text": {"type": "mrkdwn", "text": text}
+            }
+        ],
+        text=text
+    )
+
+
+def process_page(page: dict, say):
+    try:
+        translate_page(page, progress=lambda text: post(say, text))
+    except Exception as e:
+        post(say, f"PDFファイルの処理に失敗しました: {e}")
+        raise
+
+
+def dispatch_untranslated_pages(say):
+    """
+    未翻訳ページを全て取得し、処理中でないページをジョブとして投入します
+    """
+    try:
+        pages = get_untranslated_pages(NotionWriter(notion_throttle, io=io_core), progress=lambda text: post(say, text))
+    except Exception as e:
+        post(say, f"未翻訳ページの取得に失敗しました: {e}")
+        raise
+    for page in pages:
+        if job_queue.submit(page["id"], process_page, page, say) is not None:
+            title = page["properties"]["タイトル"]["title"][0]["plain_text"]
+            post(say, f"「{title}」を処理中です...")
+
+
 # Notionからのメッセージをリッスンします
 @app.message()
 def message_hello(message, say):
-    use_id = message['user']
-    # Notionからメッセージを受信したとき
+    use_id = message.get('user')
+    # Notionからメッセージを受信したとき、ジョブを投入してすぐに戻ります
     if use_id == os.environ.get("NOTION_USER_ID"):
-        # イベントがトリガーされたチャンネルへ say() でメッセージを送信します
-        say(
-            blocks=[
-                {
-                    "type": "section",
-                    "text": {"type": "mrkdwn", "text": "PDFファイルを処理中です..."}
-                }
-            ],
-            text="PDFファイルを処理中です..."
-        )
-        # 未翻訳ページの取得
-        notion = NotionWriter()
-        notion.get_untranslated_page()
-        title, url = notion.get_title_and_url()
-
-        # # PDFの翻訳
-        translator = Translator(cfg.model_name, cfg.mistral_model_name)
-        md = translator.pdf_to_markdown(url)
-        md_jp = translator.translate_markdown(cfg.prompt, md, cfg.max_input_words, cfg.gyazo_endpoint)
-
-        # Notion にページを作成
-        notion.make_nest_page(md_jp)
-        notion.input_translated_completed()
-        say(
-            blocks=[
-                {
-                    "type": "section",
-                    "text": {"type": "mrkdwn", "text": "PDFファイルの処理が完了しました！"}
-                }
-            ],
-            text="PDFファイルの処理が完了しました！"
-        )
-    else:
-        pass
+        dispatcher.submit(dispatch_untranslated_pages, say)
 
 # アプリを起動します
 if __name__ == "__main__":
+    # 最初のメッセージを待つ間に翻訳に使うSDKをimportしておきます
+    warm_up()
     SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"]).start()
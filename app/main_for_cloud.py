@@ -1,18 +1,26 @@
-from translate import Translator
+import os
+import sys
+
 from notion import NotionWriter
+from pipeline import translate_pages, get_untranslated_pages, warm_up, io_core, notion_throttle
 from cfg import cfg
 
 if __name__ == "__main__":
-    # 未翻訳ページの取得
-    notion = NotionWriter()
-    notion.get_untranslated_page()
-    _, url = notion.get_title_and_url()
+    notion = NotionWriter(notion_throttle, io=io_core)
+    page_ids = [page_id for page_id in os.getenv("PAGE_IDS", "").split(",") if page_id]
+    # 未翻訳ページがなければ、翻訳に使うSDKをimportせずに終了
+    if not page_ids and not notion.has_pending_pages():
+        print("Found 0 untranslated pages.")
+        sys.exit(0)
+    warm_up()
 
-    # # PDFの翻訳
-    translator = Translator(cfg.model_name, cfg.mistral_model_name)
-    md = translator.pdf_to_markdown(url)
-    md_jp = translator.translate_markdown(cfg.prompt, md, cfg.max_input_words, cfg.gyazo_endpoint)
+    # Cloud Functionが処理するページを指定した場合はそのページのみ、なければ(データベースのページがなければ)未翻訳ページを全て取得
+    pages = notion.get_untranslated_pages_by_id(page_ids) if page_ids else None
+    if pages is None:
+        pages = get_untranslated_pages(notion)
+    print(f"Found {len(pages)} untranslated pages.")
 
-    # Notion にページを作成
-    notion.make_nest_page(md_jp)
-    notion.input_translated_completed()
+    # 翻訳して Notion にページを作成
+    failed_page_ids = translate_pages(pages, cfg.max_page_workers)
+    if failed_page_ids:
+        sys.exit(f"Failed to translate pages: {failed_page_ids}")
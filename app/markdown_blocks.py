@@ -0,0 +1,169 @@
+import re
+
+# インライン数式 ($...$)
+INLINE_MATH_PATTERN = re.compile(r"\$(.+?)\$")
+# テーブルの区切り行のセル (---や:---:など)
+SEPARATOR_PATTERN = re.compile(r"^\s*:?-{3,}:?\s*$")
+
+# 行頭の記号(最初の空白より前)ごとのブロックの種類
+PREFIX_BLOCK_TYPES = {
+    "#": "heading_1",
+    "##": "heading_2",
+    "###": "heading_3",
+    "-": "bulleted_list_item",
+    "1.": "numbered_list_item",
+}
+
+
+def iter_notion_blocks(markdown_text: str, chunk_size: int=2000):
+    """
+    Markdown形式のテキストを1回の走査でNotionのブロックに変換し、1つずつ返すジェネレータ。
+    テーブル( | col1 | col2 | ... ) や数式($$ ... $$)、見出し等を処理する。
+    """
+    block_math_flag = False
+    lines = markdown_text.splitlines()
+    n_lines = len(lines)
+    i = 0
+    while i < n_lines:
+        raw_line = lines[i]
+        # テーブル行は連続する行をまとめて1つのテーブルにする
+        if is_table_line(raw_line):
+            table_lines = []
+            while i < n_lines and is_table_line(lines[i]):
+                table_lines.append(lines[i].strip())
+                i += 1
+            table_data = parse_markdown_table(table_lines)
+            if table_data:
+                yield build_table_block(table_data)
+            continue
+
+        # chunk_size ごとに切り出して処理
+        for chunk_start in range(0, len(raw_line), chunk_size):
+            line = raw_line[chunk_start:chunk_start+chunk_size].strip()
+            if not line:
+                continue
+            if line.startswith("$$"):
+                # ブロック数式の開始/終了フラグをトグル
+                block_math_flag = not block_math_flag
+            elif block_math_flag:
+                yield {
+                    "object": "block",
+                    "type": "equation",
+                    "equation": {"expression": line}
+                }
+            else:
+                yield build_line_block(line)
+        i += 1
+
+
+def build_line_block(line: str) -> dict:
+    """
+    テーブルと数式以外の1行をブロックに変換する。
+    """
+    prefix, sep, rest = line.partition(" ")
+    block_type = PREFIX_BLOCK_TYPES.get(prefix) if sep else None
+    if block_type is not None:
+        # 見出し、箇条書き、番号付きリスト
+        return {
+            "object": "block",
+            "type": block_type,
+            block_type: {
+                "rich_text": [{
+                    "type": "text",
+                    "text": {"content": rest.strip()}
+                }]
+            }
+        }
+    if line.startswith("https://") and line.endswith(".jpg"):
+        # 画像ブロック
+        return {
+            "object": "block",
+            "type": "image",
+            "image": {
+                "type": "external",
+                "external": {"url": line}
+            }
+        }
+    # Paragraph (インライン数式を含む処理)
+    return {
+        "object": "block",
+        "type": "paragraph",
+        "paragraph": {"rich_text": get_inline_equation_text(line)}
+    }
+
+
+def is_table_line(line: str) -> bool:
+    """
+    行頭が'|'で始まり行末が'|'で終わる場合はテーブル行とみなす。
+    """
+    stripped = line.strip()
+    return bool(stripped) and stripped[0] == "|" and stripped[-1] == "|"
+
+
+def parse_markdown_table(table_lines: list) -> list:
+    """
+    Markdown形式の表の行リストを2次元配列にして返す。区切り行(---など)は除外。
+    """
+    parsed_data = []
+    for line in table_lines:
+        cells = [c.strip() for c in line.strip('|').split('|')]
+        # すべてのセルが区切りパターンとみなせる行はスキップ
+        if all(SEPARATOR_PATTERN.match(cell.replace(':', '-')) for cell in cells):
+            continue
+        parsed_data.append(cells)
+    return parsed_data
+
+
+def build_table_block(table_data: list, has_column_header: bool=True, has_row_header: bool=False) -> dict:
+    """
+    2次元配列(table_data)からNotionの table ブロックを構成するJSONを返す。
+    """
+    if not table_data:
+        return None
+    return {
+        "object": "block",
+        "type": "table",
+        "table": {
+            "table_width": max(len(row) for row in table_data),
+            "has_column_header": has_column_header,
+            "has_row_header": has_row_header,
+            "children": [
+                {
+                    "object": "block",
+                    "type": "table_row",
+                    "table_row": {
+                        "cells": [get_inline_equation_text(cell_value) for cell_value in row]
+                    }
+                }
+                for row in table_data
+            ]
+        }
+    }
+
+
+def get_inline_equation_text(line: str) -> list:
+    """
+    インライン数式を含むテキストをリッチテキストのリストに変換する。
+    """
+    if "$" not in line:
+        return [{"type": "text", "text": {"content": line}}] if line else []
+    rich_text = []
+    cursor = 0
+    for match in INLINE_MATH_PATTERN.finditer(line):
+        start, end = match.span()
+        if start > cursor:
+            rich_text.append({
+                "type": "text",
+                "text": {"content": line[cursor:start]}
+            })
+        rich_text.append({
+            "type": "equation",
+            "equation": {"expression": match.group(1)}
+        })
+        cursor = end
+    if cursor < len(line):
+        rich_text.append({
+            "type": "text",
+            "text": {"content": line[cursor:]}
+        })
+    return rich_text
@@ -0,0 +1,138 @@
+import re
+
+from chunker import HEADER_PATTERN
+from markdown_blocks import is_table_line, SEPARATOR_PATTERN
+
+# 翻訳しない部分を置き換えるプレースホルダ ex. [[M12]]
+PLACEHOLDER_PATTERN = re.compile(r"\[\[M(\d+)\]\]")
+# 参考文献の見出し ex. "# References", "## 7 Bibliography"
+REFERENCES_PATTERN = re.compile(r"^#+\s*(\d+\.?\s*)?(references|bibliography|参考文献)\s*$", re.IGNORECASE)
+# 画像 ex. ![img-0.jpeg](img-0.jpeg)
+IMAGE_LINK_PATTERN = re.compile(r"!\[[^\]]*\]\([^)\s]*\)")
+# インラインコード ex. `torch.nn`
+INLINE_CODE_PATTERN = re.compile(r"`[^`\n]+`")
+# 数値のセル ex. "91.2", "**93.4**", "-0.5 ± 0.1", "12%"
+NUMERIC_CELL_PATTERN = re.compile(r"^(\*\*)?[-+±~<>]?\s*\d[\d.,]*\s*(%|x|×)?(\s*(±|\\pm)\s*\d[\d.,]*)?(\*\*)?$")
+
+
+class Masker:
+    """
+    翻訳不要な部分をプレースホルダに置き換えてからGeminiに送り、翻訳後に元に戻すクラス
+    入出力のトークン数を減らし、LaTeXや数値が翻訳で壊れるのを防ぐ。
+    置き換えるのは、ブロック数式($$ ... $$)、コードブロックとインラインコード、画像、テーブルの区切り行と数値のセル、
+    (mask_referencesがTrueなら)参考文献の本文。
+
+    Args:
+        mask_references (bool): 参考文献の本文を翻訳しない
+    """
+    def __init__(self, mask_references: bool=True):
+        self.mask_references = mask_references
+
+    def mask(self, md: str, placeholders: dict) -> str:
+        """
+        mdの翻訳不要な部分をプレースホルダに置き換える。
+        placeholdersに {プレースホルダ: 元の文字列} を追加する (複数のmdで共有すると番号が重ならない)。
+        複数行の部分は1行のプレースホルダになるため、見出しと段落の構造は保たれる。
+        """
+        lines = md.split("\n")
+        masked = []
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            stripped = line.strip()
+            if stripped.startswith("```"):
+                # コードブロック
+                end = self.find_end(lines, i, lambda l: l.strip().startswith("```"))
+                masked.append(self.add(placeholders, '\n'.join(lines[i:end + 1])))
+                i = end + 1
+            elif stripped.startswith("$$") and line.count("$$") % 2 == 1:
+                # 複数行のブロック数式
+                end = self.find_end(lines, i, lambda l: l.count("$$") % 2 == 1)
+                masked.append(self.add(placeholders, '\n'.join(lines[i:end + 1])))
+                i = end + 1
+            elif stripped.startswith("$$") and stripped.endswith("$$") and len(stripped) > 4:
+                # 1行のブロック数式
+                masked.append(self.add(placeholders, line))
+                i += 1
+            elif self.mask_references and REFERENCES_PATTERN.match(stripped):
+                # 参考文献の見出しは翻訳し、次の見出しまでの本文(前後の空行を除く)を置き換える
+                end = i + 1
+                while end < len(lines) and not HEADER_PATTERN.match(lines[end]):
+                    end += 1
+                first, last = i + 1, end
+                while first < last and not lines[first].strip():
+                    first += 1
+                while last > first and not lines[last - 1].strip():
+                    last -= 1
+                masked.extend(lines[i:first])
+                if last > first:
+                    masked.append(self.add(placeholders, '\n'.join(lines[first:last])))
+                masked.extend(lines[last:end])
+                i = end
+            elif is_table_line(line):
+                masked.append(self.mask_table_line(line, placeholders))
+                i += 1
+            else:
+                masked.append(self.mask_inline(line, placeholders))
+                i += 1
+        return '\n'.join(masked)
+
+    @staticmethod
+    def find_end(lines: list, start: int, is_end) -> int:
+        """
+        start行目から始まる部分の終わりの行を返す。閉じていない場合は最後の行。
+        """
+        for end in range(start + 1, len(lines)):
+            if is_end(lines[end]):
+                return end
+        return len(lines) - 1
+
+    def mask_inline(self, line: str, placeholders: dict) -> str:
+        line = IMAGE_LINK_PATTERN.sub(lambda match: self.add(placeholders, match.group(0)), line)
+        return INLINE_CODE_PATTERN.sub(lambda match: self.add(placeholders, match.group(0)), line)
+
+    def mask_table_line(self, line: str, placeholders: dict) -> str:
+        """
+        テーブルの区切り行は行ごと、それ以外の行は連続する数値のセルをまとめて置き換える。
+        """
+        cells = line.strip()[1:-1].split("|")
+        if all(SEPARATOR_PATTERN.match(cell) for cell in cells):
+            return self.add(placeholders, line)
+        masked_cells = []
+        run = []
+        for cell in cells + [None]:
+            if cell is not None and NUMERIC_CELL_PATTERN.match(cell.strip()):
+                run.append(cell)
+                continue
+            if run:
+                # セルの前後の空白はそのまま残す
+                text = "|".join(run)
+                stripped = text.strip()
+                start = text.index(stripped)
+                masked_cells.append(text[:start] + self.add(placeholders, stripped) + text[start + len(stripped):])
+                run = []
+            if cell is not None:
+                masked_cells.append(self.mask_inline(cell, placeholders))
+        return "|" + "|".join(masked_cells) + "|"
+
+    @staticmethod
+    def add(placeholders: dict, text: str) -> str:
+        placeholder = f"[[M{len(placeholders)}]]"
+        placeholders[placeholder] = text
+        return placeholder
+
+    @staticmethod
+    def unmask(md: str, placeholders: dict) -> str:
+        """
+        プレースホルダを元の文字列に戻す。
+        """
+        if not placeholders:
+            return md
+        return PLACEHOLDER_PATTERN.sub(lambda match: placeholders.get(match.group(0), match.group(0)), md)
+
+    @staticmethod
+    def find_missing(md: str, md_jp: str) -> list:
+        """
+        翻訳前のmdにあって翻訳結果にないプレースホルダを返す。
+        """
+        return sorted(set(PLACEHOLDER_PATTERN.findall(md)) - set(PLACEHOLDER_PATTERN.findall(md_jp)), key=int)
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    処理時間とAPI使用量を記録するクラス
+    スパン(処理時間)とカウンタをJSON Lines形式でファイルに書き出す。
+    OpenTelemetryのトレーサーを渡した場合は、スパンをOpenTelemetryにも送る。
+
+    Args:
+        path (str): 書き出し先のファイル (Noneなら書き出さない)
+        tracer (opentelemetry.trace.Tracer): OpenTelemetryのトレーサー (Noneなら送らない)
+        attributes (dict): 全ての記録に付ける属性 ex. {"page_id": "..."}
+    """
+    def __init__(self, path: str=None, tracer=None, attributes: dict=None, lock: threading.Lock=None):
+        self.path = path
+        self.tracer = tracer
+        self.attributes = attributes or {}
+        self.lock = lock or threading.Lock()
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+    def bind(self, **attributes) -> "Metrics":
+        """
+        属性を追加したMetricsを返す。書き出し先は共有する。
+        """
+        return Metrics(self.path, self.tracer, {**self.attributes, **attributes}, self.lock)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        with ブロックの処理時間を記録する。
+        yieldしたdictに値を入れると、スパンの属性として記録される。
+            ex. with metrics.span("translate_chunk") as span:
+                    span["prompt_token_count"] = 100
+        """
+        attributes = {**self.attributes, **attributes}
+        otel_span = self.tracer.start_as_current_span(name) if self.tracer else None
+        current = otel_span.__enter__() if otel_span else None
+        start = time.time()
+        start_perf = time.perf_counter()
+        status = "ok"
+        try:
+            yield attributes
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - start_perf) * 1000
+            self.write({
+                "type": "span",
+                "name": name,
+                "start": start,
+                "duration_ms": duration_ms,
+                "status": status,
+                **attributes,
+            })
+            if otel_span:
+                for key, value in attributes.items():
+                    if isinstance(value, (str, bool, int, float)):
+                        current.set_attribute(key, value)
+                current.set_attribute("error", status == "error")
+                otel_span.__exit__(None, None, None)
+
+    def record_span(self, name: str, start: float, duration_ms: float, status: str="ok", **attributes):
+        """
+        処理時間を測り終えたスパンを記録する。withで囲めない処理に使う。
+            ex. ジェネレータで、yieldして呼び出し側が処理している間を除いた時間
+        start: 開始時刻 (time.time())
+        """
+        attributes = {**self.attributes, **attributes}
+        self.write({
+            "type": "span",
+            "name": name,
+            "start": start,
+            "duration_ms": duration_ms,
+            "status": status,
+            **attributes,
+        })
+        if self.tracer:
+            otel_span = self.tracer.start_span(name, start_time=int(start * 1e9))
+            for key, value in attributes.items():
+                if isinstance(value, (str, bool, int, float)):
+                    otel_span.set_attribute(key, value)
+            otel_span.set_attribute("error", status == "error")
+            otel_span.end(end_time=int((start + duration_ms / 1000) * 1e9))
+
+    def count(self, name: str, value: int=1, **attributes):
+        """
+        カウンタ(トークン数やリトライ回数など)を記録する。
+        """
+        self.write({
+            "type": "counter",
+            "name": name,
+            "time": time.time(),
+            "value": value,
+            **self.attributes,
+            **attributes,
+        })
+
+    def write(self, record: dict):
+        if not self.path:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+def get_tracer():
+    """
+    OTEL_EXPORTER_OTLP_ENDPOINT が設定されていて、opentelemetryがインストールされている場合にトレーサーを返す。
+    """
+    if not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return None
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        print("opentelemetry is not installed. Spans are written to the metrics file only.")
+        return None
+    provider = TracerProvider(resource=Resource.create({"service.name": "paper-translation-in-notion"}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    return trace.get_tracer(__name__)
@@ -1,35 +1,160 @@
 import os
-import re
 
 from dotenv import load_dotenv
-from notion_client import Client
+from notion_client import AsyncClient, APIResponseError
+
+from aio import AsyncIOCore
+from block_appender import AdaptiveThrottle, BlockAppender, FLUSH
+from metrics import Metrics
+from checkpoint import PageCheckpoint
+from markdown_blocks import iter_notion_blocks, is_table_line, parse_markdown_table, build_table_block, get_inline_equation_text
 
 
 class NotionWriter:
-    def __init__(self):
+    """
+    Notionのデータベースから未翻訳のページを取得し、翻訳結果を書き込むクラス
+
+    Args:
+        throttle (AdaptiveThrottle): Notion APIへのリクエスト間隔の調整 (Noneなら3リクエスト/秒で作成)
+        start_batch (int): ブロック追加を再開するバッチ数 (前回の実行で追加済みのバッチはスキップする)
+        metrics (Metrics): 処理時間とAPI使用量の記録先 (Noneなら記録しない)
+        checkpoint (PageCheckpoint): 処理状態の保存先 (作成途中の子ページがあれば追記を再開する)
+        io (AsyncIOCore): Notion APIを呼び出すイベントループ (Noneなら作成。複数のNotionWriterで共有すると接続も共有する)
+    """
+    def __init__(self, throttle: AdaptiveThrottle=None, start_batch: int=0, metrics: Metrics=None, checkpoint: PageCheckpoint=None, io: AsyncIOCore=None):
         load_dotenv()
         self.notion_api_token = os.getenv("NOTION_TOKEN")
         assert self.notion_api_token, "You need to set the NOTION_TOKEN environment variable."
         self.database_id = os.getenv("NOTION_DATABASE_ID")
         assert self.database_id, "You need to set the NOTION_DATABASE_ID environment variable."
-        self.notion = Client(auth=self.notion_api_token)
+        self.io = io or AsyncIOCore()
+        self.notion = self.io.get_client("notion", lambda: AsyncClient(auth=self.notion_api_token, client=self.io.make_http_client()))
+        self.checkpoint = checkpoint
+        self.child_page_id = None
+        self.appender = BlockAppender(
+            self.notion,
+            throttle or AdaptiveThrottle(3.0),
+            self.io,
+            start_batch=start_batch,
+            metrics=metrics,
+            on_batch_appended=self.save_appended_batches if checkpoint else None,
+        )
         self.untranslated_page = None
 
-    def get_untranslated_page(self):
+    def request(self, func, **kwargs):
         """
-        未翻訳のページを取得する。
+        Notion APIを呼び出す。リクエスト間隔の調整とリトライは全ての呼び出しで共通。
+        """
+        response, _ = self.appender.request(func, **kwargs)
+        return response
+
+    def query_database(self, **query):
         """
-        response = self.notion.databases.query(
-            self.database_id,
+        データベースのページをカーソルでページングしながら全件取得するジェネレータ。
+        """
+        start_cursor = None
+        while True:
+            kwargs = {"start_cursor": start_cursor} if start_cursor else {}
+            response = self.request(
+                self.notion.databases.query,
+                database_id=self.database_id,
+                **query,
+                **kwargs
+            )
+            yield from response.get("results", [])
+            if not response.get("has_more"):
+                break
+            start_cursor = response.get("next_cursor")
+
+    def query_untranslated_pages(self):
+        """
+        未翻訳のページを全件取得するジェネレータ。
+        """
+        yield from self.query_database(
             filter={
                 "property": "Translate Completed",
                 "checkbox": {"equals": False}
             }
         )
-        untranslated_pages = response.get("results", [])
+
+    def query_pages_edited_since(self, last_edited_time: str=None):
+        """
+        last_edited_time以降に編集されたページ(Noneなら全ページ)を最終更新日時の古い順に取得するジェネレータ。
+        """
+        query = {"sorts": [{"timestamp": "last_edited_time", "direction": "ascending"}]}
+        if last_edited_time:
+            # Notionの最終更新日時は分単位に丸められるため、同じ時刻のページも含める
+            query["filter"] = {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": last_edited_time}}
+        yield from self.query_database(**query)
+
+    def has_pending_pages(self) -> bool:
+        """
+        未翻訳のページがあるかを返す。(1件だけ問い合わせる)
+        """
+        response = self.request(
+            self.notion.databases.query,
+            database_id=self.database_id,
+            filter={
+                "property": "Translate Completed",
+                "checkbox": {"equals": False}
+            },
+            page_size=1,
+        )
+        return bool(response.get("results"))
+
+    def get_untranslated_pages(self) -> list:
+        """
+        未翻訳のページを全て取得する。
+        """
+        return list(self.query_untranslated_pages())
+
+    def get_untranslated_pages_by_id(self, page_ids: list) -> list:
+        """
+        指定したIDのページのうち、未翻訳のものを取得する。
+        IDはSlackのメッセージから取り出したものなので、インテグレーションと共有されていないページ(404)と
+        データベース外のページは除く。データベースのページが1つもなければNoneを返す。
+        """
+        pages = []
+        for page_id in page_ids:
+            try:
+                page = self.request(self.notion.pages.retrieve, page_id=page_id)
+            except APIResponseError as e:
+                if e.status not in (400, 404):
+                    raise
+                print(f"Skipped page {page_id} ({e}).")
+                continue
+            if not self.is_database_page(page):
+                print(f"Skipped page {page_id} (not in the database).")
+                continue
+            pages.append(page)
+        if not pages:
+            return None
+        return [
+            page for page in pages
+            if not page.get("archived") and not page["properties"]["Translate Completed"]["checkbox"]
+        ]
+
+    def is_database_page(self, page: dict) -> bool:
+        """
+        ページがこのデータベースのページかを返す。(IDはハイフンの有無を区別しない)
+        """
+        database_id = page.get("parent", {}).get("database_id") or ""
+        return database_id.replace("-", "").lower() == self.database_id.replace("-", "").lower()
+
+    def get_untranslated_page(self):
+        """
+        未翻訳のページを取得する。
+        """
+        untranslated_pages = self.get_untranslated_pages()
         assert len(untranslated_pages) == 1, "There should be only one untranslated page." 
         self.untranslated_page = untranslated_pages[0]
 
+    def set_untranslated_page(self, page: dict):
+        """
+        処理対象の未翻訳ページを設定する。(バッチ処理で使用)
+        """
+        self.untranslated_page = page
+
     def get_title_and_url(self):
         """
         未翻訳のページからタイトルとURLを取得する。
@@ -44,285 +169,32 @@ class NotionWriter:
         Markdown形式のテキストをNotionのブロック形式に変換し、listで返す。
         テーブル( | col1 | col2 | ... ) や数式($$ ... $$)、見出し等を処理する。
         """
-        # --- 前準備 ---
-        block_math_flag = False
-        blocks = []
-
-        # 改行区切りで処理しやすいように行のリストにする
-        lines = markdown_text.splitlines()
-
-        # インデックスを手動で動かしながら、テーブル行かどうかを判定
-        i = 0
-        while i < len(lines):
-            raw_line = lines[i]
-            # chunk_size を考慮するために一度 chunk 分割
-            #   → ただしテーブル行の場合はまとめてパースするので先に判定する
-            if self.is_table_line(raw_line):
-                # テーブルの開始行とみなし、連続するテーブル行をまとめてパースする
-                table_data, used_lines = self.collect_and_parse_table(lines, start_index=i)
-                i += used_lines  # テーブル行を一気に消費
-
-                if table_data:
-                    # テーブルの Notionブロックを生成して追加
-                    table_block = self.build_table_block(table_data)
-                    blocks.append(table_block)
-                continue
-            else:
-                # テーブル行じゃない場合、元のロジックでチャンクを切り出して処理
-                for chunk_start in range(0, len(raw_line), chunk_size):
-                    line = raw_line[chunk_start:chunk_start+chunk_size].strip()
-                    if not line:
-                        continue
-
-                    if line.startswith("$$"):
-                        # ブロック数式の開始/終了フラグをトグル
-                        block_math_flag = not block_math_flag
-                    elif block_math_flag:
-                        # ブロック数式モード中
-                        blocks.append({
-                            "object": "block",
-                            "type": "equation",
-                            "equation": {
-                                "expression": line
-                            }
-                        })
-                    elif line.startswith("# "):
-                        # Heading 1
-                        blocks.append({
-                            "object": "block",
-                            "type": "heading_1",
-                            "heading_1": {
-                                "rich_text": [{
-                                    "type": "text",
-                                    "text": {"content": line[2:].strip()}
-                                }]
-                            }
-                        })
-                    elif line.startswith("## "):
-                        # Heading 2
-                        blocks.append({
-                            "object": "block",
-                            "type": "heading_2",
-                            "heading_2": {
-                                "rich_text": [{
-                                    "type": "text",
-                                    "text": {"content": line[3:].strip()}
-                                }]
-                            }
-                        })
-                    elif line.startswith("### "):
-                        # Heading 3
-                        blocks.append({
-                            "object": "block",
-                            "type": "heading_3",
-                            "heading_3": {
-                                "rich_text": [{
-                                    "type": "text",
-                                    "text": {"content": line[4:].strip()}
-                                }]
-                            }
-                        })
-                    elif line.startswith("https://") and line.endswith(".jpg"):
-                        # 画像ブロック
-                        blocks.append({
-                            "object": "block",
-                            "type": "image",
-                            "image": {
-                                "type": "external",
-                                "external": {
-                                    "url": line
-                                }
-                            }
-                        })
-                    elif line.startswith("- "):
-                        # Bulleted List
-                        blocks.append({
-                            "object": "block",
-                            "type": "bulleted_list_item",
-                            "bulleted_list_item": {
-                                "rich_text": [{
-                                    "type": "text",
-                                    "text": {"content": line[2:].strip()}
-                                }]
-                            }
-                        })
-                    elif line.startswith("1. "):
-                        # Numbered List
-                        blocks.append({
-                            "object": "block",
-                            "type": "numbered_list_item",
-                            "numbered_list_item": {
-                                "rich_text": [{
-                                    "type": "text",
-                                    "text": {"content": line[3:].strip()}
-                                }]
-                            }
-                        })
-                    else:
-                        # Paragraph (インライン数式を含む処理)
-                        rich_text = self.get_inline_equation_text(line)
-
-                        blocks.append({
-                            "object": "block",
-                            "type": "paragraph",
-                            "paragraph": {
-                                "rich_text": rich_text
-                            }
-                        })
-
-                # 1行進める
-                i += 1
-
-        return blocks
+        return list(iter_notion_blocks(markdown_text, chunk_size))
 
-    def is_table_line(self, line: str) -> bool:
+    def iter_notion_blocks(self, markdown_text: str, chunk_size: int=2000):
         """
-        シンプルに「テーブルっぽい行」かどうかを判定する。
-        例: "| col1 | col2 |"や"| --- | --- |"のように
-        行頭が'|'で始まり行末が'|'で終わる場合はテーブル行とみなす。
+        Markdown形式のテキストをNotionのブロック形式に変換し、1つずつ返すジェネレータ。
         """
-        stripped = line.strip()
-        # 空行は除外
-        if not stripped:
-            return False
-        return (stripped.startswith("|") and stripped.endswith("|"))
-
-    def collect_and_parse_table(self, lines, start_index: int):
-        """
-        lines[start_index] がテーブル行とみなし、
-        連続するテーブル行をすべて読み取って
-        2次元リストとして返す。
-        戻り値: (table_data, used_line_count)
-          - table_data: [["Column 1", "Column 2"], ["Foo", "Bar"], ...]
-          - used_line_count: 何行分テーブルを消費したか
-        """
-        table_lines = []
-        idx = start_index
-        while idx < len(lines):
-            if self.is_table_line(lines[idx]):
-                table_lines.append(lines[idx].strip())
-                idx += 1
-            else:
-                break
+        return iter_notion_blocks(markdown_text, chunk_size)
 
-        used_line_count = len(table_lines)
-        if not table_lines:
-            return [], 0
-
-        # 実際に table_lines をパースして2次元リスト化する
-        table_data = self.parse_markdown_table(table_lines)
-        return table_data, used_line_count
+    def is_table_line(self, line: str) -> bool:
+        return is_table_line(line)
 
     def parse_markdown_table(self, table_lines):
-        """
-        Markdown形式の表の行リストを受け取り、2次元配列にして返す。
-        区切り行(---など)は除外。
-        例:
-          ["| Column 1 | Column 2 |",
-           "|----------|----------|",
-           "| Foo      | Bar      |"]
-          →
-          [
-            ["Column 1", "Column 2"],
-            ["Foo",      "Bar"]
-          ]
-        """
-        # 区切り行の判定用正規表現(---や:---:など)
-        separator_pattern = re.compile(r"^\s*:?-{3,}:?\s*$")
-
-        parsed_data = []
-        for line in table_lines:
-            # 先頭・末尾の '|' を取り除き、内側を分割
-            # 例: "| Foo | Bar |" → ["Foo", "Bar"]
-            cells = [c.strip() for c in line.strip('|').split('|')]
-
-            # 区切り行(---, ---|---など)はスキップ
-            # すべてのセルが区切りパターンとみなせる場合は除外
-            if all(separator_pattern.match(cell.replace(':', '-')) for cell in cells):
-                continue
-
-            parsed_data.append(cells)
-
-        return parsed_data
+        return parse_markdown_table(table_lines)
 
     def build_table_block(self, table_data, has_column_header=True, has_row_header=False):
-        """
-        2次元配列(table_data)を受け取り、Notionの table ブロックを構成するJSONを返す。
-        :param table_data: [["Column 1", "Column 2"], ["Foo", "Bar"], ...]
-        :param has_column_header: 一行目をカラムヘッダ表示させるか
-        :param has_row_header: 一列目を行ヘッダ表示させるか
-        """
-        if not table_data:
-            return None
-        
-        row_count = len(table_data)
-        col_count = max(len(row) for row in table_data)
-
-        # 子ブロック(=テーブルの行)を作る
-        table_row_blocks = []
-        for row in table_data:
-            # rowは["Column 1", "Column 2", ...]
-            cells = []
-            for cell_value in row:
-                # Notionのリッチテキスト
-                cell_text = self.get_inline_equation_text(cell_value)
-                cells.append(cell_text)
-            table_row_blocks.append({
-                "object": "block",
-                "type": "table_row",
-                "table_row": {
-                    "cells": cells
-                }
-            })
+        return build_table_block(table_data, has_column_header, has_row_header)
 
-        table_block = {
-            "object": "block",
-            "type": "table",
-            "table": {
-                "table_width": col_count,
-                "has_column_header": has_column_header,
-                "has_row_header": has_row_header,
-                "children": table_row_blocks
-            }
-        }
-        return table_block
-    
     def get_inline_equation_text(self, line: str) -> list:
-        """
-        インライン数式ブロックを構築する。
-        """
-        # Paragraph (インライン数式を含む処理)
-        inline_math_pattern = re.compile(r"\$(.+?)\$")
-        rich_text = []
-        cursor = 0
-        for match in inline_math_pattern.finditer(line):
-            start, end = match.span()
-            if start > cursor:
-                rich_text.append({
-                    "type": "text",
-                    "text": {"content": line[cursor:start]}
-                })
-            # 数式部分
-            equation_expr = match.group(1)
-            rich_text.append({
-                "type": "equation",
-                "equation": {"expression": equation_expr}
-            })
-            cursor = end
-        if cursor < len(line):
-            # 残りのテキスト
-            rich_text.append({
-                "type": "text",
-                "text": {"content": line[cursor:]}
-            })
-
-        return rich_text
+        return get_inline_equation_text(line)
 
-    def create_child_page(self, parent_page_id: str, child_content: str):
+    def create_empty_child_page(self, parent_page_id: str):
         """
-        指定した親ページに子ページを作成する。
+        指定した親ページに空の子ページを作成する。
         """
-        child_page =  self.notion.pages.create(
+        child_page = self.request(
+            self.notion.pages.create,
             parent={"type": "page_id", "page_id": parent_page_id},
             properties={
                 "title": [
@@ -335,13 +207,116 @@ class NotionWriter:
                 ]
             }
         )
+        return child_page
+
+    def get_or_create_child_page(self, parent_page_id: str):
+        """
+        前回の実行で作成途中の子ページがあればそれを返し、追加済みのバッチから再開する。
+        なければ空の子ページを作成する。
+        """
+        saved = self.checkpoint.get("notion") if self.checkpoint else None
+        if saved is not None:
+            self.appender.start_batch = saved["appended_batches"]
+            child_page = {"id": saved["child_page_id"]}
+        else:
+            child_page = self.create_empty_child_page(parent_page_id)
+        self.child_page_id = child_page["id"]
+        self.save_appended_batches(self.appender.start_batch)
+        return child_page
 
+    def save_appended_batches(self, appended_batches: int):
+        if self.checkpoint and self.child_page_id:
+            self.checkpoint.set("notion", {"child_page_id": self.child_page_id, "appended_batches": appended_batches})
+
+    def append_blocks(self, page_id: str, blocks: list):
+        """
+        ページにブロックを追加する。ブロック数とサイズの上限に合わせてまとめて送る。
+        """
+        self.appender.append(page_id, blocks)
+
+    def create_child_page(self, parent_page_id: str, child_content: str):
+        """
+        指定した親ページに子ページを作成する。
+        """
+        child_page = self.get_or_create_child_page(parent_page_id)
         # 子ページにブロックを追加
         blocks = self.markdown_to_notion_blocks(child_content)
-        for i in range(0, len(blocks), 100):
-            self.notion.blocks.children.append(block_id=child_page["id"], children=blocks[i:i+100])
+        self.append_blocks(child_page["id"], blocks)
+        return child_page
+
+    def create_child_page_stream(self, parent_page_id: str, child_contents):
+        """
+        指定した親ページに子ページを作成し、markdownのチャンクが届くたびにブロックに変換して追加する。
+        チャンクの中のブロックは上限まで詰めて送り、チャンクの終わりで残りを送る (次のチャンクの翻訳を待たない)。
+        """
+        child_page = self.get_or_create_child_page(parent_page_id)
+
+        def iter_blocks():
+            for child_content in child_contents:
+                yield from self.iter_notion_blocks(child_content)
+                yield FLUSH
+
+        self.append_blocks(child_page["id"], iter_blocks())
         return child_page
 
+    def list_child_block_ids(self, page_id: str) -> list:
+        """
+        ページ直下のブロックのIDをカーソルでページングしながら全件取得する。
+        """
+        block_ids = []
+        start_cursor = None
+        while True:
+            kwargs = {"start_cursor": start_cursor} if start_cursor else {}
+            response = self.request(self.notion.blocks.children.list, block_id=page_id, page_size=100, **kwargs)
+            block_ids.extend(block["id"] for block in response.get("results", []))
+            if not response.get("has_more"):
+                return block_ids
+            start_cursor = response.get("next_cursor")
+
+    def update_child_page(self, child_page_id: str, old_contents: list, opcodes: list, new_contents: list) -> bool:
+        """
+        前回作成した子ページのうち、変更のあったセクションのブロックだけを置き換える。
+        old_contents, new_contents はセクションごとの翻訳済みmarkdown、opcodes はそれらの対応 (PaperRevision.diff)。
+        子ページのブロックが前回の記録と合わない(手で編集された、削除された)場合や、
+        先頭への挿入(直前のブロックがないため位置を指定できない)が必要な場合は何もせずFalseを返す。
+        """
+        try:
+            block_ids = self.list_child_block_ids(child_page_id)
+        except Exception as e:
+            print(f"Failed to list blocks of the child page ({e}).")
+            return False
+        # セクションごとのブロック数は、翻訳結果から同じ変換をして求める
+        counts = [sum(1 for _ in self.iter_notion_blocks(content)) for content in old_contents]
+        if sum(counts) != len(block_ids):
+            print("The child page does not match the previous translation.")
+            return False
+        section_block_ids = []
+        for count in counts:
+            section_block_ids.append(block_ids[:count])
+            block_ids = block_ids[count:]
+
+        # 先に全ての挿入位置を決めてから変更する
+        kept = {i for tag, i1, i2, _, _ in opcodes if tag == "equal" for i in range(i1, i2)}
+        updates = []
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == "equal":
+                continue
+            old_ids = [block_id for ids in section_block_ids[i1:i2] for block_id in ids]
+            # 置き換えるブロックの直後、なければ直前の残すセクションの末尾に挿入する
+            previous_ids = [block_id for i in range(i1) if i in kept for block_id in section_block_ids[i]]
+            after = old_ids[-1] if old_ids else (previous_ids[-1] if previous_ids else None)
+            if after is None and j2 > j1:
+                return False
+            updates.append((after, old_ids, new_contents[j1:j2]))
+        for after, old_ids, contents in updates:
+            if contents:
+                self.appender.append(child_page_id, (block for content in contents for block in self.iter_notion_blocks(content)), after=after)
+            self.appender.delete_blocks(old_ids)
+        return True
+
+    def archive_page(self, page_id: str):
+        self.request(self.notion.pages.update, page_id=page_id, archived=True)
+
     def make_nest_page(self, child_page_content: str):
         assert self.untranslated_page is not None, "Untranslated page not loaded. Please run get_untranslated_page() first."
         # 未翻訳のページからIDを取得
@@ -350,12 +325,38 @@ class NotionWriter:
         child_page = self.create_child_page(page_id,  child_page_content)
         print("Created child page with title")
 
+    def make_nest_page_stream(self, child_page_contents):
+        """
+        翻訳済みのチャンクを順に受け取りながら子ページを作成する。
+        """
+        assert self.untranslated_page is not None, "Untranslated page not loaded. Please run get_untranslated_page() first."
+        page_id = self.untranslated_page["id"]
+        child_page = self.create_child_page_stream(page_id, child_page_contents)
+        print("Created child page with title")
+
+    def mark_duplicate(self, page_id: str, original_page_id: str):
+        """
+        同じPDFの翻訳済みページがあるページに、元のページへのリンクを追加して翻訳完了フラグを立てる。
+        """
+        self.request(self.notion.blocks.children.append, block_id=page_id, children=[{
+            "object": "block",
+            "type": "paragraph",
+            "paragraph": {
+                "rich_text": [
+                    {"type": "text", "text": {"content": "同じPDFの翻訳: "}},
+                    {"type": "mention", "mention": {"type": "page", "page": {"id": original_page_id}}},
+                ]
+            }
+        }])
+        self.request(self.notion.pages.update, page_id=page_id, properties={"Translate Completed": {"checkbox": True}})
+
     def input_translated_completed(self):
         """
         翻訳完了フラグを立てる。
         """
         assert self.untranslated_page is not None, "Untranslated page not loaded. Please run get_untranslated_page() first."
-        self.notion.pages.update(
+        self.request(
+            self.notion.pages.update,
             page_id=self.untranslated_page["id"],
             properties={
                 "Translate Completed": {
@@ -363,3 +364,6 @@ class NotionWriter:
                 }
             }
         )
+        # 完了したので処理状態は不要
+        if self.checkpoint:
+            self.checkpoint.clear()
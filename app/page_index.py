@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+# ページの処理状態
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+DUPLICATE = "duplicate"
+
+
+class PageIndex:
+    """
+    Notionのデータベースのページ(ID、タイトル、URL、最終更新日時、処理状態)をSQLiteに保存するクラス (スレッドセーフ)
+    前回の更新以降に編集されたページだけをNotionに問い合わせて差分を反映する。
+    未翻訳ページの一覧、同じPDFのURLを持つページの重複の除去、処理状態の確認はNotionに問い合わせずに行う。
+
+    Args:
+        path (str): SQLiteのファイル
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pages (
+                    page_id TEXT PRIMARY KEY,
+                    title TEXT,
+                    url TEXT,
+                    last_edited_time TEXT NOT NULL,
+                    translate_completed INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    duplicate_of TEXT,
+                    page TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS pages_url ON pages (url)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS pages_status ON pages (status)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            # 前回のプロセスが処理中に落ちたページは未翻訳に戻す (チェックポイントから再開する)
+            self.connection.execute("UPDATE pages SET status = ? WHERE status = ?", (PENDING, PROCESSING))
+
+    @staticmethod
+    def get_title_and_url(page: dict) -> tuple:
+        properties = page.get("properties", {})
+        title = "".join(text.get("plain_text", "") for text in properties.get("タイトル", {}).get("title") or [])
+        url = properties.get("リンク", {}).get("url")
+        return title, url
+
+    def get_cursor(self) -> str:
+        """
+        反映済みのページの最終更新日時の最大値 (未取得ならNone)
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'last_edited_time'").fetchone()
+        return row[0] if row else None
+
+    def refresh(self, notion) -> int:
+        """
+        前回の更新以降に編集されたページをNotionから取得して反映し、反映したページ数を返す。
+        初回(Cloud Run Jobsではファイルが残らないため毎回)は全ページではなく未翻訳のページだけを取得し、
+        取得を始めた時刻(分単位に丸められるため1分前)以降を次回の差分とする。
+        そのため、初回より前に翻訳済みのページとの重複は検出しない。
+        NotionのWebhookなどは使わないため、削除(アーカイブ)されたページは反映されない。
+        """
+        cursor = self.get_cursor()
+        if cursor is None:
+            cursor = (datetime.now(timezone.utc) - timedelta(minutes=1)).strftime("%Y-%m-%dT%H:%M:00.000Z")
+            pages = notion.query_untranslated_pages()
+        else:
+            pages = notion.query_pages_edited_since(cursor)
+        n_pages = 0
+        for page in pages:
+            self.upsert(page)
+            n_pages += 1
+            cursor = max(cursor, page["last_edited_time"])
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO meta (key, value) VALUES ('last_edited_time', ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (cursor,),
+            )
+        return n_pages
+
+    def upsert(self, page: dict):
+        """
+        Notionのページを反映する。翻訳済みならDONE、未翻訳なら処理中のものを除いてPENDINGにする。
+        """
+        title, url = self.get_title_and_url(page)
+        completed = bool(page.get("properties", {}).get("Translate Completed", {}).get("checkbox"))
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT status FROM pages WHERE page_id = ?", (page["id"],)).fetchone()
+            if completed:
+                status = DONE
+            elif row and row[0] == PROCESSING:
+                status = PROCESSING
+            else:
+                status = PENDING
+            self.connection.execute(
+                """
+                INSERT INTO pages (page_id, title, url, last_edited_time, translate_completed, status, duplicate_of, page, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, NULL, ?, ?)
+                ON CONFLICT (page_id) DO UPDATE SET
+                    title = excluded.title, url = excluded.url, last_edited_time = excluded.last_edited_time,
+                    translate_completed = excluded.translate_completed, status = excluded.status, duplicate_of = NULL,
+                    page = excluded.page, updated_at = excluded.updated_at
+                """,
+                (page["id"], title, url, page["last_edited_time"], int(completed), status, json.dumps(page, ensure_ascii=False), time.time()),
+            )
+
+    def get_untranslated_pages(self) -> list:
+        """
+        未翻訳のページ(PENDINGとFAILED)を最終更新日時の古い順に返す。
+        翻訳済みまたは先に処理するページと同じPDFのURLを持つページは、DUPLICATEにして除く。
+        """
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                "SELECT page_id, url, page FROM pages WHERE status IN (?, ?, ?) ORDER BY last_edited_time, page_id",
+                (PENDING, FAILED, DUPLICATE),
+            ).fetchall()
+            translated = dict(self.connection.execute(
+                "SELECT url, page_id FROM pages WHERE url IS NOT NULL AND status IN (?, ?)",
+                (DONE, PROCESSING),
+            ).fetchall())
+            pages = []
+            for page_id, url, page in rows:
+                duplicate_of = translated.get(url) if url else None
+                if duplicate_of and duplicate_of != page_id:
+                    self.connection.execute("UPDATE pages SET status = ?, duplicate_of = ? WHERE page_id = ?", (DUPLICATE, duplicate_of, page_id))
+                    continue
+                if url:
+                    translated[url] = page_id
+                pages.append(json.loads(page))
+        return pages
+
+    def get_finished_duplicates(self) -> list:
+        """
+        翻訳済み(DONE)のページの重複になっているページを (ページID, タイトル, 元のページID, 元のタイトル) のリストで返す。
+        元のページが処理中または失敗したページの重複は、元のページが翻訳されるまで返さない。
+        """
+        with self.lock:
+            return self.connection.execute(
+                """
+                SELECT pages.page_id, pages.title, original.page_id, original.title
+                FROM pages JOIN pages AS original ON pages.duplicate_of = original.page_id
+                WHERE pages.status = ? AND original.status = ?
+                ORDER BY pages.last_edited_time
+                """,
+                (DUPLICATE, DONE),
+            ).fetchall()
+
+    def set_status(self, page_id: str, status: str):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE pages SET status = ?, translate_completed = ?, updated_at = ? WHERE page_id = ?",
+                (status, int(status == DONE), time.time(), page_id),
+            )
+
+    def get_status(self, page_id: str) -> str:
+        """
+        ページの処理状態を返す。インデックスにないページはNone。
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT status FROM pages WHERE page_id = ?", (page_id,)).fetchone()
+        return row[0] if row else None
+
+    def find_by_url(self, url: str) -> list:
+        """
+        PDFのURLが一致するページを (ページID, タイトル, 処理状態) のリストで返す。
+        """
+        with self.lock:
+            return self.connection.execute("SELECT page_id, title, status FROM pages WHERE url = ? ORDER BY last_edited_time", (url,)).fetchall()
+
+    def count_by_status(self) -> dict:
+        with self.lock:
+            return dict(self.connection.execute("SELECT status, COUNT(*) FROM pages GROUP BY status").fetchall())
@@ -0,0 +1,208 @@
+import re
+import base64
+from collections import Counter
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+
+# PyMuPDFは使うときに初めてimportする (起動時間を短くするため)
+pymupdf = None
+
+# 数式用フォント (テキスト層では数式の構造が失われるため、これらの文字が多いページはOCRに回す)
+MATH_FONT_PATTERN = re.compile(r"CMMI|CMSY|CMEX|MSBM|MSAM|Math|STIX|Symbol|rsfs", re.IGNORECASE)
+# 文字化けしたグリフ (置換文字、私用領域、(cid:123))
+BROKEN_GLYPH_PATTERN = re.compile(r"[\ufffd\ue000-\uf8ff]|\(cid:\d+\)")
+# 番号付きの節見出し ex. "3.1 Model Architecture"
+NUMBERED_HEADING_PATTERN = re.compile(r"^(\d+(?:\.\d+)*)\.?\s+[A-Z]")
+BOLD_FLAG = 16
+
+
+@dataclass
+class LocalPage:
+    """
+    PDFのテキスト層から抽出した1ページ
+    OCR結果のページ(OCRPageObject)と同じ属性(index, markdown, images)を持つ。
+    """
+    index: int
+    markdown: str
+    images: list = field(default_factory=list)
+    quality: float = 1.0
+
+
+class LocalPdfExtractor:
+    """
+    PDFのテキスト層からOCR結果と同じ形式のmarkdownを抽出するクラス
+    見出し(フォントサイズ)、テーブル、画像を検出する。
+    ページごとにテキストの品質を評価し、品質の低いページ(スキャン、数式が多い、文字化け)はOCRに回す。
+    PyMuPDFがインストールされていない場合は使えない。
+
+    Args:
+        min_quality (float): この品質未満のページはOCRに回す (0~1)
+        min_chars (int): テキストがこの文字数未満のページはスキャン画像とみなしてOCRに回す
+        min_image_size (float): この大きさ(pt)未満の画像は装飾とみなして無視する
+    """
+    def __init__(self, min_quality: float=0.8, min_chars: int=200, min_image_size: float=50.0):
+        self.min_quality = min_quality
+        self.min_chars = min_chars
+        self.min_image_size = min_image_size
+
+    @staticmethod
+    def is_available() -> bool:
+        """
+        PyMuPDFが使えるかを返す。初めて呼ばれたときにimportする。
+        """
+        global pymupdf
+        if pymupdf is None:
+            try:
+                import pymupdf
+            except ImportError:
+                return False
+        return True
+
+    def extract(self, pdf_bytes: bytes) -> list:
+        """
+        PDFの全ページを抽出し、LocalPageのリストを返す。
+        """
+        with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+            page_dicts = [page.get_text("dict") for page in doc]
+            body_size = self.get_body_font_size(page_dicts)
+            return [
+                self.extract_page(doc, page, page_dict, body_size)
+                for page, page_dict in zip(doc, page_dicts)
+            ]
+
+    @staticmethod
+    def count_pages(pdf_bytes: bytes) -> int:
+        """
+        PDFのページ数を返す (ページの内容は読まない)。PDFとして読めない場合はNone。
+        """
+        with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+            # PyMuPDFはPDFでないデータもテキストとして開くため、ページ数を信用しない
+            return doc.page_count if doc.is_pdf else None
+
+    def is_good(self, page: LocalPage) -> bool:
+        return page.quality >= self.min_quality
+
+    @staticmethod
+    def get_body_font_size(page_dicts: list) -> float:
+        """
+        本文のフォントサイズ(文字数で重み付けした最頻値)を返す。
+        """
+        sizes = Counter()
+        for page_dict in page_dicts:
+            for block in page_dict["blocks"]:
+                if block["type"] != 0:
+                    continue
+                for line in block["lines"]:
+                    for span in line["spans"]:
+                        sizes[round(span["size"], 1)] += len(span["text"].strip())
+        return sizes.most_common(1)[0][0] if sizes else 10.0
+
+    def extract_page(self, doc, page, page_dict: dict, body_size: float) -> LocalPage:
+        # テーブル
+        tables = page.find_tables().tables
+        items = [(table.bbox, table.to_markdown().strip()) for table in tables]
+        table_rects = [pymupdf.Rect(table.bbox) for table in tables]
+
+        # 画像
+        images = []
+        for xref, *_ in page.get_images(full=True):
+            rects = [rect for rect in page.get_image_rects(xref) if rect.width >= self.min_image_size and rect.height >= self.min_image_size]
+            if not rects:
+                continue
+            extracted = doc.extract_image(xref)
+            image_id = f"img-p{page.number}-{len(images)}.{extracted['ext']}"
+            images.append(SimpleNamespace(
+                id=image_id,
+                image_base64=f"data:image/{extracted['ext']};base64," + base64.b64encode(extracted["image"]).decode("ascii"),
+            ))
+            items.append((tuple(rects[0]), f"![{image_id}]({image_id})"))
+
+        # テキスト (テーブル内の文字はテーブルとして出力済みなので除く)
+        paragraphs = []
+        n_chars = n_bad = n_math = 0
+        for block in page_dict["blocks"]:
+            if block["type"] != 0:
+                continue
+            rect = pymupdf.Rect(block["bbox"])
+            if any(table_rect.contains(rect.tl + (rect.br - rect.tl) * 0.5) for table_rect in table_rects):
+                continue
+            text, max_size, bold = self.get_block_text(block)
+            if not text:
+                continue
+            n_chars += len(text)
+            n_bad += len(BROKEN_GLYPH_PATTERN.findall(text))
+            n_math += sum(
+                len(span["text"].strip())
+                for line in block["lines"] for span in line["spans"]
+                if MATH_FONT_PATTERN.search(span["font"])
+            )
+            paragraphs.append((block["bbox"], self.format_paragraph(text, max_size, bold, body_size)))
+
+        markdown = "\n\n".join(self.merge_items(paragraphs, items))
+        if n_chars < self.min_chars and not tables:
+            quality = 0.0
+        else:
+            # 文字化けと数式用フォントの文字は強く減点する
+            quality = max(0.0, 1.0 - (n_bad * 5 + n_math * 4) / max(n_chars, 1))
+        return LocalPage(index=page.number, markdown=markdown, images=images, quality=quality)
+
+    @staticmethod
+    def get_block_text(block: dict) -> tuple:
+        """
+        テキストブロックの文字列、最大のフォントサイズ、全て太字かどうかを返す。
+        行末のハイフンで分割された単語はつなげる。
+        """
+        text = ""
+        max_size = 0.0
+        bold = True
+        for line in block["lines"]:
+            line_text = "".join(span["text"] for span in line["spans"]).strip()
+            if not line_text:
+                continue
+            for span in line["spans"]:
+                if span["text"].strip():
+                    max_size = max(max_size, span["size"])
+                    bold &= bool(span["flags"] & BOLD_FLAG)
+            if text.endswith("-"):
+                text = text[:-1] + line_text
+            else:
+                text = f"{text} {line_text}" if text else line_text
+        return text, max_size, bold
+
+    @staticmethod
+    def format_paragraph(text: str, max_size: float, bold: bool, body_size: float) -> str:
+        """
+        フォントサイズと太字から見出しを判定し、markdownの見出しにする。
+        """
+        if len(text) > 120:
+            return text
+        if max_size >= body_size * 1.6:
+            return f"# {text}"
+        if max_size >= body_size * 1.3:
+            return f"## {text}"
+        match = NUMBERED_HEADING_PATTERN.match(text)
+        if max_size >= body_size * 1.1 or (bold and match):
+            depth = match.group(1).count(".") if match else 0
+            return f"{'#' * min(depth + 2, 3)} {text}"
+        return text
+
+    @staticmethod
+    def merge_items(paragraphs: list, items: list) -> list:
+        """
+        テーブルと画像を、読み順(ブロックの出現順)の段落の間に位置で差し込む。
+        同じ段組み(横方向に重なる)で、上端が自分より下にある最初の段落の直前に入れる。
+        """
+        merged = [text for _, text in paragraphs]
+        positions = []
+        for bbox, text in sorted(items, key=lambda item: item[0][1]):
+            x0, y0, x1, _ = bbox
+            index = len(paragraphs)
+            for i, (p_bbox, _) in enumerate(paragraphs):
+                if p_bbox[1] >= y0 and p_bbox[0] < x1 and p_bbox[2] > x0:
+                    index = i
+                    break
+            positions.append((index, text))
+        # 後ろから差し込んで位置がずれないようにする
+        for index, _, text in sorted(((index, order, text) for order, (index, text) in enumerate(positions)), reverse=True):
+            merged.insert(index, text)
+        return merged
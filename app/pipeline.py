@@ -0,0 +1,243 @@
+import threading
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+from aio import AsyncIOCore, RetryPolicy
+from translate import Translator
+from notion import NotionWriter
+from cache import DiskCache
+from rate_limit import RateLimiter
+from block_appender import AdaptiveThrottle
+from metrics import Metrics, get_tracer
+from checkpoint import FileCheckpointStore, PageCheckpoint
+from image_spool import ImageSpool
+from pdf_extract import LocalPdfExtractor
+from revision import PaperRevision
+from chunker import ChunkPlanner
+from translation_memory import TranslationMemory
+from masking import Masker
+from image_processor import ImageProcessor
+from page_index import PageIndex, PROCESSING, DONE, FAILED
+from backends import BackendRouter, GeminiBackend, MistralChatBackend, LocalBackend
+from cfg import cfg
+
+# 外部APIの呼び出しは全ページで1つのイベントループにまとめ、接続と同時リクエスト数の制限を共有する
+io_core = AsyncIOCore(cfg.service_concurrency, RetryPolicy(cfg.request_timeout, cfg.max_retries))
+# 並列に処理する全ページでGemini APIのリクエスト上限を共有する
+rate_limiter = RateLimiter(cfg.requests_per_minute)
+# 翻訳のバックエンドの処理時間とエラー率の統計は全ページで共有する
+TRANSLATION_BACKENDS = {
+    "gemini": lambda: GeminiBackend(cfg.model_name, rate_limiter),
+    "mistral_chat": lambda: MistralChatBackend(cfg.mistral_chat_model_name, io_core),
+    "local": lambda: LocalBackend(cfg.local_model_name, cfg.local_endpoint, io_core),
+}
+translation_router = BackendRouter([TRANSLATION_BACKENDS[name]() for name in cfg.translation_backends], io_core, cfg.hedge_factor)
+# 画像の縮小と再圧縮のスレッドプールは全ページで共有する
+image_processor = ImageProcessor(cfg.image_max_dimension, cfg.image_min_dimension, cfg.image_quality) if cfg.preprocess_images else None
+# Notion APIのリクエスト上限も全ページで共有する
+notion_throttle = AdaptiveThrottle(cfg.notion_requests_per_second)
+# 処理時間とAPI使用量の記録先
+metrics = Metrics(cfg.metrics_path, get_tracer())
+# 途中で落ちたページを再開するための処理状態の保存先
+checkpoint_store = FileCheckpointStore(cfg.checkpoint_dir)
+# 段落単位の翻訳結果は全ページで共有する (論文間で繰り返し出てくる段落は翻訳しない)
+translation_memory = TranslationMemory(cfg.translation_memory_path) if cfg.translation_memory_path else None
+# OCR結果と翻訳結果のキャッシュは全ページで共有する (合計サイズを1か所で数える)
+cache = DiskCache(cfg.cache_dir, cfg.cache_max_bytes)
+# Notionのデータベースのページと処理状態 (前回以降に編集されたページだけを問い合わせる)
+page_index = PageIndex(cfg.page_index_path) if cfg.page_index_path else None
+# 改訂された論文の差分翻訳に使う、前回の翻訳結果の保存先 (翻訳完了後も残す)
+revision_store = FileCheckpointStore(cfg.revision_dir)
+
+
+# 起動を速くするため、翻訳に使うSDKは最初に使うときまでimportしない
+HEAVY_MODULES = ["google.generativeai", "mistralai"]
+
+
+def warm_up() -> threading.Thread:
+    """
+    翻訳に使うSDKのimportをバックグラウンドで始める。(処理するページがあると分かった時点で呼び、ページの取得と並行してimportする)
+    """
+    def run():
+        for name in HEAVY_MODULES:
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                print(f"Failed to import {name} ({e}).")
+        LocalPdfExtractor.is_available()
+
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_untranslated_pages(notion: NotionWriter, progress=None) -> list:
+    """
+    未翻訳のページを全て取得する。
+    page_indexがあれば前回以降に編集されたページだけを問い合わせて反映し、同じPDFのURLのページを除いて返す。
+    除いたページのうち元のページが翻訳済みのものは、Notionで翻訳完了にする (resolve_duplicates)。
+    """
+    if page_index is None:
+        return notion.get_untranslated_pages()
+    page_index.refresh(notion)
+    pages = page_index.get_untranslated_pages()
+    resolve_duplicates(notion, progress)
+    return pages
+
+
+def resolve_duplicates(notion: NotionWriter, progress=None):
+    """
+    翻訳済みのページと同じPDFのページに元のページへのリンクを追加し、翻訳完了フラグを立てる。
+    フラグを立てないと、未翻訳ページとして残り続ける (has_pending_pagesが常にTrueになる)。
+    progressを指定した場合、ページごとにメッセージを渡して呼び出す。
+    """
+    progress = progress or (lambda message: None)
+    for page_id, title, original_page_id, original_title in page_index.get_finished_duplicates():
+        notion.mark_duplicate(page_id, original_page_id)
+        page_index.set_status(page_id, DONE)
+        progress(f"「{title}」は「{original_title}」と同じPDFのため翻訳をスキップしました。")
+
+
+def translate_page(page: dict, progress=None):
+    """
+    1つの未翻訳ページを翻訳し、Notionに子ページを作成する。
+    progressを指定した場合、各ステージの完了時にメッセージを渡して呼び出す。
+    """
+    if page_index is None:
+        return run_translate_page(page, progress)
+    page_index.set_status(page["id"], PROCESSING)
+    try:
+        run_translate_page(page, progress)
+    except BaseException:
+        page_index.set_status(page["id"], FAILED)
+        raise
+    page_index.set_status(page["id"], DONE)
+    # このページの翻訳を待っていた重複ページを完了にする
+    resolve_duplicates(NotionWriter(notion_throttle, io=io_core), progress)
+
+
+def run_translate_page(page: dict, progress=None):
+    progress = progress or (lambda message: None)
+    page_metrics = metrics.bind(page_id=page["id"])
+    checkpoint = PageCheckpoint(checkpoint_store, page["id"])
+    with page_metrics.span("paper"):
+        notion = NotionWriter(notion_throttle, metrics=page_metrics, checkpoint=checkpoint, io=io_core)
+        notion.set_untranslated_page(page)
+        title, url = notion.get_title_and_url()
+
+        # PDFの翻訳
+        translator = Translator(
+            cfg.model_name,
+            cfg.mistral_model_name,
+            cfg.max_workers,
+            cfg.requests_per_minute,
+            cache,
+            rate_limiter,
+            page_metrics,
+            checkpoint,
+            ImageSpool(cfg.image_spool_dir, cache),
+            LocalPdfExtractor(cfg.min_text_quality) if cfg.use_local_pdf_extraction else None,
+            io_core,
+            translation_memory,
+            Masker(cfg.mask_references) if cfg.mask_untranslatable else None,
+            translation_router,
+            image_processor,
+            cfg.ocr_range_pages,
+            cfg.ocr_range_workers,
+        )
+        revision = PaperRevision(revision_store, page["id"], translation_router.model_key, cfg.prompt) if cfg.incremental_translation else None
+        previous = revision.load() if revision else None
+        if previous:
+            # 差分翻訳では変更のあったセクションの画像だけをアップロードする
+            md = translator.pdf_to_markdown(url, None)
+            progress(f"「{title}」のOCRが完了しました。翻訳中です...")
+            update_translated_page(notion, translator, revision, previous, md)
+        else:
+            # OCRが済んだページから順に翻訳を始める (大きなPDFはページ範囲ごとに並列にOCRする)
+            def notify_ocr_completed(md_pages):
+                yield from md_pages
+                progress(f"「{title}」のOCRが完了しました。翻訳中です...")
+
+            md_pages = notify_ocr_completed(translator.pdf_to_markdown_stream(url, cfg.gyazo_endpoint))
+            make_translated_page(notion, translator, revision, md_pages)
+        notion.input_translated_completed()
+        progress(f"「{title}」の翻訳をNotionに書き込みました！")
+
+
+def make_translated_page(notion: NotionWriter, translator: Translator, revision: PaperRevision, md_pages):
+    """
+    届いたページのmarkdownから順に翻訳し、子ページを作成する。
+    revisionがあれば、次に改訂されたときのためにセクションごとに翻訳して保存する。
+    """
+    if revision:
+        sections = []
+
+        def record_sections(batches):
+            for batch in batches:
+                sections.extend(batch)
+                yield batch
+
+        md_jp_sections = translator.translate_sections_stream(cfg.prompt, record_sections(ChunkPlanner.split_sections_stream(md_pages)), cfg.max_output_tokens, cfg.gyazo_endpoint)
+        if not cfg.stream_to_notion:
+            md_jp_sections = list(md_jp_sections)
+        texts = []
+
+        def record(md_jp_sections):
+            for text in md_jp_sections:
+                texts.append(text)
+                yield text
+
+        # 子ページのブロックとセクションを対応付けられるよう、セクションごとにブロックに変換して追加する
+        notion.make_nest_page_stream(record(md_jp_sections))
+        revision.save(notion.child_page_id, sections, texts)
+    elif cfg.stream_to_notion:
+        # 翻訳できたチャンクから順に Notion に追加
+        md_jp_chunks = translator.translate_markdown_stream(cfg.prompt, md_pages, cfg.max_output_tokens, cfg.gyazo_endpoint)
+        notion.make_nest_page_stream(md_jp_chunks)
+    else:
+        md_jp = translator.translate_markdown(cfg.prompt, md_pages, cfg.max_output_tokens, cfg.gyazo_endpoint)
+        # Notion にページを作成
+        notion.make_nest_page(md_jp)
+
+
+def update_translated_page(notion: NotionWriter, translator: Translator, revision: PaperRevision, previous: dict, md: str):
+    """
+    前回の翻訳結果とセクション単位で比較し、変更のあったセクションだけを翻訳して子ページのブロックを置き換える。
+    子ページをそのまま更新できない場合は、翻訳結果を使って子ページを作り直す。
+    """
+    sections = PaperRevision.split_sections(md)
+    with translator.metrics.span("revision") as span:
+        opcodes, texts, stats = revision.diff(previous, sections)
+        span.update(stats)
+        changed = [j for j, text in enumerate(texts) if text is None]
+        for j, text in zip(changed, translator.translate_sections(cfg.prompt, [sections[j] for j in changed], cfg.max_output_tokens, cfg.gyazo_endpoint)):
+            texts[j] = text
+        old_texts = [section["text"] for section in previous["sections"]]
+        child_page_id = previous["child_page_id"]
+        span["in_place"] = notion.update_child_page(child_page_id, old_texts, opcodes, texts)
+        if not span["in_place"]:
+            try:
+                notion.archive_page(child_page_id)
+            except Exception as e:
+                print(f"Failed to archive the previous child page ({e}).")
+            notion.make_nest_page_stream(texts)
+            child_page_id = notion.child_page_id
+    revision.save(child_page_id, sections, texts)
+
+
+def translate_pages(pages: list, max_workers: int) -> list:
+    """
+    複数の未翻訳ページを並列に処理する。
+    1ページの失敗で他のページの処理は止めず、失敗したページのIDを返す。
+    """
+    def run(page):
+        try:
+            translate_page(page)
+        except Exception as e:
+            print(f"Failed to translate page {page['id']} ({e}).")
+            return page["id"]
+        return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(run, pages))
+    return [page_id for page_id in results if page_id is not None]
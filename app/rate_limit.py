@@ -0,0 +1,49 @@
+import time
+import asyncio
+import threading
+from collections import deque
+
+
+class RateLimiter:
+    """
+    一定時間あたりのリクエスト数を制限するクラス (スレッドセーフ)
+
+    Args:
+        max_requests (int): period 秒あたりの最大リクエスト数 (0以下なら無制限)
+        period (float): 期間 (秒)
+    """
+    def __init__(self, max_requests: int, period: float=60.0):
+        self.max_requests = max_requests
+        self.period = period
+        self.timestamps = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        リクエスト枠が空くまで待機し、枠を1つ消費する。
+        """
+        while (wait := self.try_acquire()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """
+        acquireのasync版。待機中もイベントループを止めない。
+        """
+        while (wait := self.try_acquire()) > 0:
+            await asyncio.sleep(wait)
+
+    def try_acquire(self) -> float:
+        """
+        リクエスト枠が空いていれば1つ消費して0を返し、空いていなければ空くまでの秒数を返す。
+        """
+        if self.max_requests <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            # 期間外になったリクエストを捨てる
+            while self.timestamps and now - self.timestamps[0] >= self.period:
+                self.timestamps.popleft()
+            if len(self.timestamps) < self.max_requests:
+                self.timestamps.append(now)
+                return 0.0
+            return self.period - (now - self.timestamps[0])
@@ -0,0 +1,89 @@
+from difflib import SequenceMatcher
+
+from cache import DiskCache
+from checkpoint import CheckpointStore
+from chunker import ChunkPlanner, HEADER_PATTERN
+
+
+class PaperRevision:
+    """
+    前回翻訳したときのセクションごとの原文のハッシュと翻訳結果を保存し、新しいmarkdownと対応付けるクラス
+    論文が改訂された場合やプロンプトを変更した場合に、変更のあったセクションだけを翻訳し直すために使う。
+    翻訳完了後も残す必要があるため、処理状態(PageCheckpoint)とは別のストアに保存する。
+
+    Args:
+        store (CheckpointStore): 保存先のストア
+        page_id (str): NotionのページID
+        model_name (str): 翻訳に使うモデル名 (ハッシュに含める。BackendRouter.model_key)
+        prompt (str): 翻訳のプロンプト (ハッシュに含める)
+
+    保存する値:
+        {"child_page_id": 子ページのID, "sections": [{"header": 見出し行, "hash": 原文のハッシュ, "text": 翻訳結果}, ...]}
+    """
+    stage = "revision"
+
+    def __init__(self, store: CheckpointStore, page_id: str, model_name: str, prompt: str):
+        self.store = store
+        self.page_id = page_id
+        self.model_name = model_name
+        self.prompt = prompt
+
+    @staticmethod
+    def split_sections(md: str) -> list:
+        """
+        markdownを見出し単位のセクションに分割する。セクションを'\\n'で結合すると元のmarkdownに戻る。
+        """
+        return ['\n'.join(lines) for lines in ChunkPlanner.split_sections(md.splitlines())]
+
+    @staticmethod
+    def get_header(section: str) -> str:
+        first_line = section.split("\n", 1)[0]
+        return first_line if HEADER_PATTERN.match(first_line) else ""
+
+    def get_hash(self, section: str) -> str:
+        return DiskCache.make_key("section", self.model_name, self.prompt, section)
+
+    def load(self) -> dict:
+        return self.store.load(self.page_id, self.stage)
+
+    def save(self, child_page_id: str, sections: list, texts: list):
+        self.store.save(self.page_id, self.stage, {
+            "child_page_id": child_page_id,
+            "sections": [
+                {"header": self.get_header(section), "hash": self.get_hash(section), "text": text}
+                for section, text in zip(sections, texts)
+            ],
+        })
+
+    def diff(self, previous: dict, sections: list) -> tuple:
+        """
+        前回のセクションと新しいセクションを原文のハッシュで対応付ける。
+        (opcodes, texts, stats) を返す。
+        opcodes はdifflibと同じ (tag, i1, i2, j1, j2) のリストで、i は前回、j は新しいセクションの番号。
+        texts は新しいセクションごとの前回の翻訳結果で、翻訳し直す必要があるセクションはNone。
+        stats は見出しが同じで内容が変わったセクション(changed)、追加(added)、削除(removed)、再利用(reused)の数。
+        """
+        old_sections = previous["sections"]
+        old_hashes = [section["hash"] for section in old_sections]
+        new_hashes = [self.get_hash(section) for section in sections]
+        opcodes = SequenceMatcher(None, old_hashes, new_hashes, autojunk=False).get_opcodes()
+        texts = [None] * len(sections)
+        stats = {"reused": 0, "changed": 0, "added": 0, "removed": 0}
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == "equal":
+                for i, j in zip(range(i1, i2), range(j1, j2)):
+                    texts[j] = old_sections[i]["text"]
+                stats["reused"] += i2 - i1
+                continue
+            # 見出しが同じセクションは変更、それ以外は追加・削除とみなす
+            old_headers = [old_sections[i]["header"] for i in range(i1, i2)]
+            n_changed = 0
+            for j in range(j1, j2):
+                header = self.get_header(sections[j])
+                if header in old_headers:
+                    old_headers.remove(header)
+                    n_changed += 1
+            stats["changed"] += n_changed
+            stats["added"] += (j2 - j1) - n_changed
+            stats["removed"] += (i2 - i1) - n_changed
+        return opcodes, texts, stats
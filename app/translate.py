@@ -1,12 +1,34 @@
 import os
 import re
-import requests
+import time
+import hashlib
 from dotenv import load_dotenv
-import base64
+from collections import deque
+from typing import TYPE_CHECKING
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from mistralai import Mistral
-from mistralai.models import OCRResponse
-import google.generativeai as genai
+import httpx
+
+
+from aio import AsyncIOCore
+from rate_limit import RateLimiter
+from gyazo import GyazoUploader
+from cache import DiskCache
+from chunker import ChunkPlanner, HEADER_PATTERN, find_headers
+from metrics import Metrics
+from checkpoint import PageCheckpoint
+from image_spool import ImageSpool
+from translation_memory import TranslationMemory
+from masking import Masker
+from backends import BackendRouter, GeminiBackend
+from pdf_extract import LocalPdfExtractor
+from image_processor import ImageProcessor
+
+if TYPE_CHECKING:
+    from mistralai.models import OCRResponse
+
+# markdown中の画像 ex. ![img-0.jpeg](img-0.jpeg)
+IMAGE_PATTERN = re.compile(r"!\[([^\]]*)\]\(([^)\s]*)\)")
 
 
 class Translator:
@@ -15,126 +37,560 @@ class Translator:
 
     Args:
         gemini_model_name (str): モデル名
+        mistral_model_name (str): Mistralのモデル名
+        max_workers (int): 翻訳の並列数
+        requests_per_minute (int): Gemini APIへの1分あたりの最大リクエスト数 (0以下なら無制限)
+        cache (DiskCache): OCR結果と翻訳結果のキャッシュ (Noneならキャッシュしない)
+        rate_limiter (RateLimiter): 複数のTranslatorで共有するレートリミッタ (Noneならrequests_per_minuteから作成)
+        metrics (Metrics): 処理時間とAPI使用量の記録先 (Noneなら記録しない)
+        checkpoint (PageCheckpoint): 処理状態の保存先 (Noneなら保存しない)
+        image_spool (ImageSpool): OCR結果の画像の書き出し先 (Noneなら一時ディレクトリ)
+        pdf_extractor (LocalPdfExtractor): PDFのテキスト層からの抽出 (Noneまたは使えない場合は全ページをOCRする)
+        io (AsyncIOCore): 外部APIを呼び出すイベントループ (Noneなら作成。複数のTranslatorで共有すると接続と同時実行数の制限も共有する)
+        translation_memory (TranslationMemory): 段落単位の翻訳結果の保存先 (Noneなら使わない)
+        masker (Masker): 翻訳不要な部分のプレースホルダへの置き換え (Noneなら全てをGeminiに送る)
+        router (BackendRouter): 翻訳に使うバックエンドの選択 (NoneならGeminiのみ。複数のTranslatorで共有すると処理時間とエラー率の統計も共有する)
+        image_processor (ImageProcessor): アップロード前の画像の縮小と再圧縮 (Noneなら元の画像をアップロードする)
+        ocr_range_pages (int): OCRするページがこの数を超える場合、このページ数ごとの範囲に分けて並列にOCRする (0なら分けない)
+        ocr_range_workers (int): 並列にOCRするページ範囲の数 (Mistral全体の同時実行数はioの制限に従う)
 
     Attributes:
         genai_api_key (str): GenAI APIキー
-        model (genai.GenerativeModel): GenAIのモデル
+        gemini_model_name (str): Geminiのモデル名
         gyazo_access_token (str): Gyazoアクセストークン
         mistral_api_key (str): Mistral APIキー
         mistral (Mistral): MistralのAPI
         mistral_model_name (str): Mistralのモデル名
-        header_position (dict): 
-            ヘッダーの位置
-            (key: 何個目のヘッダーか, value: 何行目か)
-            ex. {0: 0, 1: 5, 2: 8, 3: 12}
-        header_n_words (dict):
-            各ヘッダーより前の単語数
-            (key: 何個目のヘッダーか, value: そのヘッダーより前の単語数)
-            ex. {0: 0, 1: 20, 2: 30, 3: 40}
+        max_workers (int): 翻訳の並列数
+        rate_limiter (RateLimiter): Gemini APIのリクエスト数を制限する
+        router (BackendRouter): チャンクごとに翻訳するバックエンド(Gemini, Mistralなど)を選び、遅いチャンクは別のバックエンドにも送る
+        io (AsyncIOCore): 外部APIを呼び出すイベントループ (リトライとタイムアウトもこれに従う)
+        translation_memory (TranslationMemory): 段落単位の翻訳結果の保存先 (翻訳済みの段落はAPIに送らない)
+        masker (Masker): 数式、コード、画像、テーブルの数値、参考文献をプレースホルダに置き換えてから翻訳する
+        gyazo_uploader (GyazoUploader): 画像のアップロードを行う (最初のアップロード時に作成)
+        image_processor (ImageProcessor): アップロード前に画像を縮小、再圧縮し、小さすぎる画像を除く
+        image_futures (dict):
+            アップロード中の画像
+            (key: 画像名, value: URLを返すFuture)
+        cache (DiskCache): OCR結果と翻訳結果のキャッシュ
+        metrics (Metrics): 処理時間とAPI使用量の記録先
+        checkpoint (PageCheckpoint): 処理状態の保存先 (途中で落ちた場合に完了済みのステージから再開する)
+        image_spool (ImageSpool): OCR結果の画像の書き出し先
+        pdf_extractor (LocalPdfExtractor): PDFのテキスト層からの抽出 (テキスト層の品質が低いページのみOCRする)
+        ocr_range_pages (int): 1回のOCRのリクエストに含めるページ数の上限 (大きなPDFはページ範囲ごとにOCRし、失敗した範囲だけをリトライする)
+        ocr_range_workers (int): 並列にOCRするページ範囲の数
         images_dict (dict):
             画像の辞書
-            (key: 画像名, value: 画像のbase64)
-            ex. {'img1': 'base64_str1', 'img2': 'base64_str2'}
+            (key: 画像名, value: 画像を書き出したファイルのパス)
+            ex. {'img1': '/tmp/images_xxx/3a7b....jpeg', 'img2': '/tmp/images_xxx/9c1d....jpeg'}
     """
-    def __init__(self, gemini_model_name: str, mistral_model_name: str):
+    def __init__(self, gemini_model_name: str, mistral_model_name: str, max_workers: int=1, requests_per_minute: int=0, cache: DiskCache=None, rate_limiter: RateLimiter=None, metrics: Metrics=None, checkpoint: PageCheckpoint=None, image_spool: ImageSpool=None, pdf_extractor: LocalPdfExtractor=None, io: AsyncIOCore=None, translation_memory: TranslationMemory=None, masker: Masker=None, router: BackendRouter=None, image_processor: ImageProcessor=None, ocr_range_pages: int=0, ocr_range_workers: int=4):
         load_dotenv()
         self.genai_api_key = os.getenv("GEMINI_API_KEY")
         assert self.genai_api_key, "You need to set the GEMINI_API_KEY environment variable."
-        genai.configure(api_key=self.genai_api_key)
-        self.model = genai.GenerativeModel(model_name=gemini_model_name)
+        self.gemini_model_name = gemini_model_name
         self.gyazo_access_token = os.getenv("GYAZO_ACCESS_TOKEN")
         assert self.gyazo_access_token, "You need to set the GYAZO_ACCESS_TOKEN environment variable."
         self.mistral_api_key = os.getenv("MISTRAL_API_KEY")
         assert self.mistral_api_key, "You need to set the MISTRAL_API_KEY environment variable."
-        self.mistral = Mistral(self.mistral_api_key)
+        self.io = io or AsyncIOCore()
+        self._mistral = None
         self.mistral_model_name = mistral_model_name
-        self.header_position = {}
-        self.header_n_words = {}
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter or RateLimiter(requests_per_minute)
+        self.router = router or BackendRouter([GeminiBackend(gemini_model_name, self.rate_limiter)], self.io)
+        self.gyazo_uploader = None
+        self.image_processor = image_processor
+        self.image_futures = {}
+        self.cache = cache
+        self.metrics = metrics or Metrics()
+        self.checkpoint = checkpoint
+        self.image_spool = image_spool or ImageSpool()
+        self.translation_memory = translation_memory
+        self.masker = masker
+        self.pdf_extractor = pdf_extractor if pdf_extractor and pdf_extractor.is_available() else None
+        self.ocr_range_pages = ocr_range_pages
+        self.ocr_range_workers = ocr_range_workers
         self.images_dict = {}
 
-    def pdf_to_markdown(self, pdf_url: str) -> str:
-        ocr_response = self.mistral.ocr.process(
-            model=self.mistral_model_name,
-            document={
-                "type": "document_url",
-                "document_url": pdf_url
-            },
-            include_image_base64=True,
-        )
-        # ページごとに分かれているOCR結果を結合
-        md = self.get_combined_markdown(ocr_response)
-        # ヘッダーの位置を取得
-        self.get_header_position(md)
-        return md
-
-    def get_combined_markdown(self, ocr_response: OCRResponse) -> str:
-        markdowns: list[str] = []
+    @property
+    def mistral(self):
+        """
+        MistralのAPI。mistralaiのimportとクライアントの作成は最初に使うときに行う。
+        """
+        if self._mistral is None:
+            from mistralai import Mistral
+            self._mistral = self.io.get_client("mistral", lambda: Mistral(self.mistral_api_key, async_client=self.io.make_http_client()))
+        return self._mistral
+
+    @mistral.setter
+    def mistral(self, client):
+        self._mistral = client
+
+    def pdf_to_markdown(self, pdf_url: str, gyazo_endpoint: str=None) -> str:
+        """
+        PDFをmarkdownに変換する。
+        pdf_extractorがあればテキスト層から抽出し、品質の低いページのみOCRする。
+        gyazo_endpointを指定した場合、翻訳を待たずに画像のアップロードを開始する。
+        """
+        return "\n\n".join(self.pdf_to_markdown_stream(pdf_url, gyazo_endpoint))
+
+    def pdf_to_markdown_stream(self, pdf_url: str, gyazo_endpoint: str=None):
+        """
+        PDFをmarkdownに変換し、ページのmarkdownをページ順に1つずつ返すジェネレータ ('\\n\\n'で結合するとpdf_to_markdownの結果になる)。
+        ページ範囲ごとにOCRする場合は、後の範囲のOCRを待たずに先頭の範囲のページから返すため、OCRと並行して翻訳を始められる。
+        キャッシュまたは前回の実行のOCR結果を使う場合は、全体を1つで返す。
+        """
+        # spanにはOCRを待っている時間だけを含める (yieldして翻訳側で処理している間と、その間の例外は含めない)
+        span = {"pdf_url": pdf_url}
+        start, elapsed, status = time.time(), 0.0, "ok"
+        resumed_at = time.perf_counter()
+        try:
+            # 前回の実行のOCR結果、またはキャッシュがあればOCRをスキップ (書き出した画像が残っている場合のみ)
+            cached = self.checkpoint.get("ocr") if self.checkpoint else None
+            if cached is not None and not ImageSpool.exists(cached["images"]):
+                cached = None
+            span["checkpoint_hit"] = cached is not None
+            pdf_bytes = None
+            if cached is None and (self.cache or self.pdf_extractor or (self.ocr_range_pages and LocalPdfExtractor.is_available())):
+                pdf_bytes = self.download_pdf(pdf_url)
+            cache_key = self.get_ocr_cache_key(pdf_url, pdf_bytes) if self.cache and pdf_bytes else None
+            if cache_key:
+                cached = self.cache.get(cache_key)
+                if cached is not None and not ImageSpool.exists(cached["images"]):
+                    cached = None
+                span["cache_hit"] = cached is not None
+            if cached is not None:
+                md = cached["markdown"]
+                self.images_dict = cached["images"]
+                page_markdowns = iter([md])
+            else:
+                pages = self.ocr_document(pdf_url, pdf_bytes, span)
+                del pdf_bytes
+                # ページごとに分かれているOCR結果を結合 (画像はページごとにファイルに書き出し、すぐにアップロードを始める)
+                self.images_dict = {}
+                page_markdowns = self.iter_page_markdowns(pages, gyazo_endpoint)
+            markdowns = []
+            for markdown in page_markdowns:
+                markdowns.append(markdown)
+                elapsed += time.perf_counter() - resumed_at
+                resumed_at = None
+                yield markdown
+                resumed_at = time.perf_counter()
+            md = "\n\n".join(markdowns)
+            del markdowns
+            if cache_key and not span.get("cache_hit"):
+                self.cache.set(cache_key, {"markdown": md, "images": self.images_dict})
+            if self.checkpoint and not span["checkpoint_hit"]:
+                self.checkpoint.set("ocr", {"markdown": md, "images": self.images_dict})
+            span["n_images"] = len(self.images_dict)
+        except BaseException:
+            if resumed_at is not None:
+                status = "error"
+            raise
+        finally:
+            if resumed_at is not None:
+                elapsed += time.perf_counter() - resumed_at
+            self.metrics.record_span("ocr", start, elapsed * 1000, status, **span)
+        # 翻訳と並行して画像をアップロード
+        if gyazo_endpoint:
+            self.start_image_upload(self.images_dict, gyazo_endpoint)
+
+    def ocr_document(self, pdf_url: str, pdf_bytes: bytes, span: dict):
+        """
+        PDFのページ(OCR結果のページと同じくindex, markdown, imagesを持つ)をページ順に1ページずつ返すジェネレータ。
+        テキスト層から抽出できたページはそのまま使い、品質の低いページだけをMistral OCRに送る。
+        """
+        local_pages = []
+        if self.pdf_extractor and pdf_bytes:
+            try:
+                local_pages = self.pdf_extractor.extract(pdf_bytes)
+            except Exception as e:
+                print(f"Failed to extract text from PDF ({e}). Falling back to OCR.")
+        if not local_pages:
+            n_pages = self.get_page_count(pdf_bytes) if self.ocr_range_pages else None
+            span["n_ocr_pages"] = n_pages or "all"
+            yield from self.ocr_pages(pdf_url, list(range(n_pages)) if n_pages else None, span)
+            return
+        poor_pages = [page.index for page in local_pages if not self.pdf_extractor.is_good(page)]
+        span["n_local_pages"] = len(local_pages) - len(poor_pages)
+        span["n_ocr_pages"] = len(poor_pages)
+        self.metrics.count("ocr.local_pages", len(local_pages) - len(poor_pages))
+        self.metrics.count("ocr.mistral_pages", len(poor_pages))
+        ocr_pages = self.ocr_pages(pdf_url, poor_pages, span) if poor_pages else iter(())
+        ocr_buffer = {}
+        for i in range(len(local_pages)):
+            page, local_pages[i] = local_pages[i], None
+            if self.pdf_extractor.is_good(page):
+                yield page
+                continue
+            # OCRしたページはページ順に返ってくる (OCR結果にないページはテキスト層の抽出結果を使う)
+            for ocr_page in ocr_pages:
+                ocr_buffer[ocr_page.index] = ocr_page
+                if ocr_page.index >= page.index:
+                    break
+            yield ocr_buffer.pop(page.index, page)
+
+    def get_page_count(self, pdf_bytes: bytes) -> int:
+        """
+        PDFのページ数を返す。PyMuPDFが使えないか、PDFを読めない場合はNone。
+        """
+        if not pdf_bytes or not LocalPdfExtractor.is_available():
+            return None
+        try:
+            return LocalPdfExtractor.count_pages(pdf_bytes)
+        except Exception as e:
+            print(f"Failed to count PDF pages ({e}).")
+            return None
+
+    def ocr_pages(self, pdf_url: str, page_indices: list, span: dict):
+        """
+        page_indicesのページ(Noneなら全ページ)をMistral OCRに送り、OCR結果のページをページ順に1ページずつ返すジェネレータ。
+        ocr_range_pagesを超える場合はページ範囲に分け、ocr_range_workers個の範囲まで並列にOCRする。
+        範囲ごとに別のリクエストにするため、失敗した範囲だけがリトライされる。
+        """
+        if page_indices is None or not self.ocr_range_pages or len(page_indices) <= self.ocr_range_pages:
+            page_ranges = [page_indices]
+        else:
+            page_ranges = [page_indices[i:i + self.ocr_range_pages] for i in range(0, len(page_indices), self.ocr_range_pages)]
+        span["n_ocr_ranges"] = len(page_ranges)
+        self.metrics.count("ocr.ranges", len(page_ranges))
+
+        def submit(pages: list):
+            return self.io.submit(
+                "mistral",
+                self.mistral.ocr.process_async,
+                model=self.mistral_model_name,
+                document={
+                    "type": "document_url",
+                    "document_url": pdf_url
+                },
+                include_image_base64=True,
+                on_retry=lambda e, delay: self.metrics.count("ocr.range_retries"),
+                **({} if pages is None else {"pages": pages}),
+            )
+
+        # 先頭の範囲から順に返す。OCR結果(base64の画像を含む)がメモリに溜まりすぎないよう、先行してOCRする範囲の数を制限する
+        pending = deque()
+        for pages in page_ranges:
+            pending.append(submit(pages))
+            if len(pending) >= max(1, self.ocr_range_workers):
+                yield from self.iter_ocr_pages(pending.popleft().result())
+        while pending:
+            yield from self.iter_ocr_pages(pending.popleft().result())
+
+    def download_pdf(self, pdf_url: str) -> bytes:
+        """
+        PDFをダウンロードする。取得できない場合はNoneを返す。
+        """
+        try:
+            response = self.io.run("pdf", self.io.http.get, pdf_url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"Failed to download PDF ({e}).")
+            return None
+        return response.content
+
+    def get_ocr_cache_key(self, pdf_url: str, pdf_bytes: bytes) -> str:
+        """
+        PDFのURLと内容のハッシュからOCR結果のキャッシュキーを作成する。
+        テキスト層から抽出した結果はOCRのみの結果と区別する。
+        """
+        pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
+        if self.pdf_extractor:
+            return DiskCache.make_key("ocr", self.mistral_model_name, pdf_url, pdf_hash, "local", self.pdf_extractor.min_quality)
+        return DiskCache.make_key("ocr", self.mistral_model_name, pdf_url, pdf_hash)
+
+    def get_combined_markdown(self, ocr_response: "OCRResponse", gyazo_endpoint: str=None) -> str:
+        """
+        ページごとに分かれているOCR結果を結合する。
+        画像はbase64のまま持たず、ファイルに書き出してimages_dictにパスを記録する。
+        gyazo_endpointを指定した場合、ページを処理するたびにその画像のアップロードを開始する。
+        """
         self.images_dict = {}
-        for page in ocr_response.pages:
+        return "\n\n".join(self.iter_page_markdowns(self.iter_ocr_pages(ocr_response), gyazo_endpoint))
+
+    def iter_page_markdowns(self, pages, gyazo_endpoint: str=None):
+        """
+        ページのmarkdownを1つずつ返すジェネレータ。画像はファイルに書き出してimages_dictに追加する。
+        別々にOCRしたページ範囲で画像名が重なった場合は、ページ番号を付けた名前に変えてmarkdown中の参照も置き換える。
+        """
+        for page in pages:
+            page_images = {}
+            renames = {}
             for image in page.images:
-                self.images_dict[image.id] = image.image_base64
-            markdowns.append(page.markdown)
-        return "\n\n".join(markdowns)
-        
-    def get_header_position(self, md: str):
-        # ヘッダー位置を抽出する正規表現
-        header_pattern = r'(#+)'
-        # ヘッダー位置、単語数を抽出
-        header_count = 0
-        total_n_words = 0
-        for i, line in enumerate(md.splitlines()):
-            header_match = re.match(header_pattern, line)
-            if header_match:
-                self.header_position[header_count] = i
-                self.header_n_words[header_count] = total_n_words
-                header_count += 1
-            n_words = line.count(' ') + 1 if line.strip() else 0
-            total_n_words += n_words
-
-    def translate_markdown(self, prompt: str, md: str, max_words: int, gyazo_endpoint: str) -> str:
-        # 単語数が上限を超えるヘッダーを取得
-        split_idx_list = []
-        for max_words_ in range(max_words, max(self.header_n_words.values()), max_words):
-            for k, v in self.header_n_words.items():
-                if v > max_words_:
-                    split_idx_list.append(k)
-                    break
-        # ヘッダーの開始行を取得
-        split_row_list = [self.header_position[i] for i in split_idx_list]
-        # mdを分割
-        split_md = md.splitlines()
-        split_md_list = [split_md[i:j] for i, j in zip([0]+split_row_list, split_row_list+[None])]
-        # 各分割したmdに対して翻訳
-        md_jp_list = []
-        for md in split_md_list:
-            md = '\n'.join(md)
-            result = self.model.generate_content(
-                [prompt, md], 
-                generation_config=genai.GenerationConfig(
-                    temperature=0
+                image_id = image.id
+                if image_id in self.images_dict or image_id in page_images:
+                    image_id = f"p{page.index}-{image.id}"
+                    renames[image.id] = image_id
+                page_images[image_id] = self.image_spool.spool(image.image_base64)
+                image.image_base64 = None
+            self.images_dict.update(page_images)
+            if gyazo_endpoint:
+                self.start_image_upload(page_images, gyazo_endpoint)
+            markdown = page.markdown
+            if renames:
+                markdown = IMAGE_PATTERN.sub(
+                    lambda match: f"![{renames[match.group(1)]}]({renames[match.group(1)]})" if match.group(1) == match.group(2) and match.group(1) in renames else match.group(0),
+                    markdown,
                 )
-            )
-            print(result.usage_metadata)
-            md_jp_list.append(result.text)
+            yield markdown
+
+    @staticmethod
+    def iter_ocr_pages(ocr_response: "OCRResponse"):
+        """
+        OCR結果のページをページ順に1つずつ返す。返したページはOCR結果から外し、処理が済めば解放されるようにする。
+        """
+        pages = sorted(ocr_response.pages, key=lambda page: page.index)
+        ocr_response.pages = []
+        for i in range(len(pages)):
+            page, pages[i] = pages[i], None
+            yield page
 
-        md_jp = '\n'.join(md_jp_list)
-        # 画像をgyazoから参照できるURLに置き換え
-        md_jp = self.replace_images_in_markdown(md_jp, self.images_dict, gyazo_endpoint)
+    def translate_markdown(self, prompt: str, md: str, max_output_tokens: int, gyazo_endpoint: str) -> str:
+        md_jp = '\n'.join(self.translate_markdown_stream(prompt, md, max_output_tokens, gyazo_endpoint))
         return md_jp
-    
+
+    def translate_markdown_stream(self, prompt: str, md, max_output_tokens: int, gyazo_endpoint: str):
+        """
+        mdをチャンクに分割して並列に翻訳し、翻訳済みのチャンクを元の順序で1つずつ返すジェネレータ。
+        先頭のチャンクは後続のチャンクの翻訳を待たずに返す。
+        mdにページのmarkdownのジェネレータ(pdf_to_markdown_streamなど)を渡すと、見出し単位のセクションが揃ったところから翻訳を始める。
+        """
+        if isinstance(md, str):
+            mds = [md]
+        else:
+            mds = ('\n'.join(sections) for sections in ChunkPlanner.split_sections_stream(md))
+        # 翻訳不要な部分をプレースホルダに置き換えてから、出力トークン数の上限に収まるようにmdを分割
+        placeholders = {}
+        if self.masker:
+            mds = (self.masker.mask(md_, placeholders) for md_ in mds)
+        split_md_list = ChunkPlanner(max_output_tokens).plan_stream(mds)
+        # 各分割したmdを並列に翻訳 (出力の順序は入力の順序を保つ)
+        # 未取得の結果がメモリに溜まりすぎないよう、先行して投入するチャンク数を制限する
+        max_pending = self.max_workers * 2
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for i, md_ in enumerate(split_md_list):
+                pending.append(executor.submit(self.translate_masked_chunk, prompt, i, md_, placeholders))
+                if len(pending) >= max_pending:
+                    yield self.replace_images_in_markdown(Masker.unmask(pending.popleft().result(), placeholders), self.images_dict, gyazo_endpoint)
+            while pending:
+                # プレースホルダを元に戻し、画像をgyazoから参照できるURLに置き換え
+                yield self.replace_images_in_markdown(Masker.unmask(pending.popleft().result(), placeholders), self.images_dict, gyazo_endpoint)
+
+    def translate_sections(self, prompt: str, sections: list, max_output_tokens: int, gyazo_endpoint: str) -> list:
+        return list(self.translate_sections_stream(prompt, sections, max_output_tokens, gyazo_endpoint))
+
+    def translate_sections_stream(self, prompt: str, sections, max_output_tokens: int, gyazo_endpoint: str):
+        """
+        見出し単位のセクションのリストを翻訳し、セクションごとの翻訳結果を元の順序で1つずつ返すジェネレータ。
+        チャンクへのまとめ方はtranslate_markdown_streamと同じで、翻訳結果は見出し行でセクションに分け直す。
+        sectionsにセクションのリストのジェネレータ(ChunkPlanner.split_sections_stream)を渡すと、届いたセクションから翻訳を始める。
+        """
+        batches = [sections] if isinstance(sections, list) else sections
+        # プレースホルダの番号が重ならないよう、全セクションで1つの辞書を使う
+        placeholders = {}
+        # セクションごとの翻訳結果 (届いたセクションの分だけ増える)
+        pieces = []
+
+        def iter_sections():
+            for batch in batches:
+                for section in batch:
+                    if self.masker:
+                        section = self.masker.mask(section, placeholders)
+                    pieces.append([])
+                    yield section.split("\n")
+
+        chunks = []
+        # セクションごとの最後のチャンクの番号 (そのチャンクが翻訳できたらセクションを返せる)
+        last_chunk = {}
+        # 全てのチャンクを投入済みのセクション数 (これより後のセクションは次のチャンクに続く可能性がある)
+        n_planned = 0
+        next_section = 0
+
+        def plan():
+            nonlocal n_planned
+            for parts in ChunkPlanner(max_output_tokens).plan_sections_stream(iter_sections()):
+                n_planned = parts[0][0]
+                for i, _ in parts:
+                    last_chunk[i] = len(chunks)
+                chunks.append(parts)
+                yield len(chunks) - 1, parts
+            n_planned = len(pieces)
+
+        def collect(c: int, md_jp: str):
+            nonlocal next_section
+            for (i, _), text in zip(chunks[c], self.split_translated_chunk(prompt, chunks[c], md_jp)):
+                pieces[i].append(text)
+            while next_section < n_planned and last_chunk.get(next_section, -1) <= c:
+                yield self.replace_images_in_markdown(Masker.unmask('\n'.join(pieces[next_section]), placeholders), self.images_dict, gyazo_endpoint)
+                pieces[next_section] = None
+                next_section += 1
+
+        max_pending = self.max_workers * 2
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for c, parts in plan():
+                md_ = '\n'.join(line for _, lines in parts for line in lines)
+                pending.append((c, executor.submit(self.translate_masked_chunk, prompt, c, md_, placeholders)))
+                if len(pending) >= max_pending:
+                    c_, future = pending.popleft()
+                    yield from collect(c_, future.result())
+            while pending:
+                c_, future = pending.popleft()
+                yield from collect(c_, future.result())
+
+    def split_translated_chunk(self, prompt: str, parts: list, md_jp: str) -> list:
+        """
+        複数のセクションをまとめて翻訳した結果を、見出し行でセクションごとに分け直す。
+        見出しの数が原文と合わない場合は、セクションごとに翻訳し直す。
+        """
+        if len(parts) == 1:
+            return [md_jp]
+        lines = md_jp.split("\n")
+        headers = find_headers(lines)
+        n_source_headers = sum(len(find_headers(part)) for _, part in parts)
+        # 2つ目以降のセクションは必ず見出し行から始まる
+        starts_with_header = bool(HEADER_PATTERN.match(parts[0][1][0]))
+        if len(headers) == n_source_headers and len(headers) - starts_with_header == len(parts) - 1:
+            bounds = [0] + headers[starts_with_header:] + [len(lines)]
+            return ['\n'.join(lines[bounds[k]:bounds[k + 1]]) for k in range(len(parts))]
+        self.metrics.count("translate.split_fallback")
+        return [self.translate_chunk(prompt, '\n'.join(part)) for _, part in parts]
+
+    def translate_masked_chunk(self, prompt: str, index: int, md: str, placeholders: dict) -> str:
+        """
+        プレースホルダに置き換えたチャンクを翻訳する。翻訳結果はプレースホルダを含んだまま返す。
+        翻訳でプレースホルダが欠けた場合は、元に戻したチャンクを翻訳し直す。
+        """
+        md_jp = self.translate_chunk_with_checkpoint(prompt, index, md)
+        if placeholders and Masker.find_missing(md, md_jp):
+            self.metrics.count("masking.fallback")
+            return self.translate_chunk(prompt, Masker.unmask(md, placeholders))
+        return md_jp
+
+    def translate_chunk_with_checkpoint(self, prompt: str, index: int, md: str) -> str:
+        """
+        前回の実行で翻訳済みのチャンクであれば保存した結果を返し、そうでなければ翻訳して保存する。
+        """
+        if self.checkpoint is None:
+            return self.translate_chunk(prompt, md)
+        chunk_hash = DiskCache.make_key(self.router.model_key, prompt, md)
+        saved = self.checkpoint.get("chunks", {}).get(str(index))
+        if saved is not None and saved["hash"] == chunk_hash:
+            return saved["text"]
+        md_jp = self.translate_chunk(prompt, md)
+        self.checkpoint.update("chunks", str(index), {"hash": chunk_hash, "text": md_jp})
+        return md_jp
+
+    def translate_chunk(self, prompt: str, md: str) -> str:
+        """
+        1チャンクを翻訳する。失敗した場合はRetryPolicyに従ってこのチャンクのみリトライする。
+        """
+        with self.metrics.span("translate_chunk", n_chars=len(md)) as span:
+            # キャッシュがあればAPIを呼ばない
+            cache_key = DiskCache.make_key("translation", self.router.model_key, prompt, md)
+            if self.cache:
+                cached = self.cache.get(cache_key)
+                span["cache_hit"] = cached is not None
+                if cached is not None:
+                    return cached
+            if self.translation_memory:
+                md_jp = self.translate_with_memory(prompt, md, span)
+            else:
+                md_jp = self.generate(prompt, md, span)
+            if self.cache:
+                self.cache.set(cache_key, md_jp)
+            return md_jp
+
+    def translate_with_memory(self, prompt: str, md: str, span: dict) -> str:
+        """
+        チャンクを段落単位のセグメントに分け、翻訳メモリにあるセグメントはその翻訳結果を使い、ないものだけを翻訳する。
+        翻訳しないセグメントは区切りのコメントを付けてまとめて1回で翻訳し、区切りが崩れた場合はチャンク全体を翻訳し直す。
+        翻訳メモリには、打ち切られておらずプレースホルダが欠けていない翻訳だけを保存する。
+        """
+        segments = self.translation_memory.split_segments(md)
+        contents = [content for content, _ in segments if content.strip()]
+        texts = dict(zip(contents, self.translation_memory.lookup(self.router.model_key, prompt, contents)))
+        misses = list(dict.fromkeys(content for content in contents if texts[content] is None))
+        span["tm_hits"] = sum(1 for content in contents if texts[content] is not None)
+        span["tm_misses"] = len(misses)
+        self.metrics.count("translation_memory.hits", span["tm_hits"])
+        self.metrics.count("translation_memory.misses", span["tm_misses"])
+        if len(misses) == 1:
+            texts[misses[0]] = self.generate(prompt, misses[0], span)
+        elif misses:
+            translated = self.translation_memory.split_marked(self.generate(prompt, self.translation_memory.mark_segments(misses), span), len(misses))
+            if translated is None:
+                self.metrics.count("translation_memory.split_fallback")
+                return self.generate(prompt, md, span)
+            texts.update(zip(misses, translated))
+        # 出力トークン数の上限で打ち切られた翻訳と、プレースホルダが欠けた翻訳は他のチャンクで使い回さない
+        if not span.get("truncated"):
+            self.translation_memory.store(self.router.model_key, prompt, [
+                (content, texts[content]) for content in misses if not Masker.find_missing(content, texts[content])
+            ])
+        return self.translation_memory.join_segments([texts.get(content, content) for content, _ in segments], segments)
+
+    def generate(self, prompt: str, md: str, span: dict) -> str:
+        """
+        routerが選んだバックエンドでmdを翻訳する。トークン数とリトライ回数はspanに加算する。
+        """
+        span.setdefault("retries", 0)
+        result = self.router.translate(prompt, md, self.metrics, span)
+        span["backend"] = result.backend
+        span["prompt_token_count"] = span.get("prompt_token_count", 0) + result.prompt_tokens
+        span["candidates_token_count"] = span.get("candidates_token_count", 0) + result.output_tokens
+        self.metrics.count(f"{result.backend}.prompt_tokens", result.prompt_tokens)
+        self.metrics.count(f"{result.backend}.candidates_tokens", result.output_tokens)
+        # 出力トークン数の上限で打ち切られた場合は警告する
+        if result.truncated:
+            span["truncated"] = True
+            print("Warning: translation was truncated at the output token limit.")
+        return result.text
+
+    def start_image_upload(self, images_dict: dict, gyazo_endpoint: str):
+        """
+        画像のアップロードをバックグラウンドで開始する。
+        """
+        if self.gyazo_uploader is None:
+            self.gyazo_uploader = GyazoUploader(self.gyazo_access_token, gyazo_endpoint, self.io, self.metrics, self.image_processor)
+        saved_urls = self.checkpoint.get("images", {}) if self.checkpoint else {}
+        for img_name, image_path in images_dict.items():
+            if img_name in self.image_futures:
+                continue
+            if img_name in saved_urls:
+                # 前回の実行でアップロード済み
+                future = Future()
+                future.set_result(saved_urls[img_name])
+            else:
+                future = self.gyazo_uploader.submit(image_path)
+                if self.checkpoint:
+                    future.add_done_callback(lambda f, img_name=img_name: self.save_image_url(img_name, f))
+            self.image_futures[img_name] = future
+
+    def save_image_url(self, img_name: str, future: Future):
+        if future.exception() is None:
+            self.checkpoint.update("images", img_name, future.result())
+
     def replace_images_in_markdown(self, markdown_str: str, images_dict: dict, gyazo_endpoint: str) -> str:
-        for img_name, base64_str in images_dict.items():
-            url = self.upload_img_to_gyazo(base64_str, gyazo_endpoint)
-            markdown_str = markdown_str.replace(
-                f"![{img_name}]({img_name})", url)
-        return markdown_str
-    
-    def upload_img_to_gyazo(self, img_base64: str, gyazo_endpoint: str):
-        img_binary = base64.b64decode(img_base64.split(',')[1])
-        response = requests.post(
-            gyazo_endpoint,
-            files={'imagedata': img_binary},
-            data={'access_token': self.gyazo_access_token}
-        )
-        url = response.json()['url']
-        return url
+        """
+        markdown中の画像をGyazoのURLに1回の走査で置き換える。
+        """
+        # このmarkdownに含まれる画像のうち、まだアップロードを開始していないものを開始し、それらだけを待つ
+        img_names = [
+            match.group(1) for match in IMAGE_PATTERN.finditer(markdown_str)
+            if match.group(1) == match.group(2) and match.group(1) in images_dict
+        ]
+        self.start_image_upload({img_name: images_dict[img_name] for img_name in img_names}, gyazo_endpoint)
+        urls = {img_name: self.image_futures[img_name].result() for img_name in img_names}
+
+        def replace(match):
+            if match.group(1) != match.group(2):
+                return match.group(0)
+            url = urls.get(match.group(1), match.group(0))
+            # アップロードしなかった(小さすぎる)画像は除く
+            return url if url is not None else ""
+
+        return IMAGE_PATTERN.sub(replace, markdown_str)
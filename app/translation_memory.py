@@ -0,0 +1,160 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+from cache import DiskCache
+from chunker import ChunkPlanner
+
+# まとめて翻訳するセグメントの区切り ex. <!-- segment 3 -->
+SEGMENT_MARKER_PATTERN = re.compile(r"^\s*<!--\s*segment\s+(\d+)\s*-->\s*$")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+class TranslationMemory:
+    """
+    段落(セグメント)単位の翻訳結果をSQLiteに保存し、同じ段落の翻訳に使い回すクラス (スレッドセーフ)
+    定型文、図表のキャプション、参考文献など、論文間で繰り返し出てくる段落の翻訳をAPIに送らずに済ませる。
+    原文が完全に一致するもの(exact)に加えて、空白の違いやUnicodeの表記揺れを正規化して一致するもの(normalized)も使う。
+    翻訳結果はモデル名とプロンプトごとに分けて保存する。
+
+    Args:
+        path (str): SQLiteのファイル
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS segments (
+                    scope TEXT NOT NULL,
+                    exact_key TEXT NOT NULL,
+                    normalized_key TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (scope, exact_key)
+                )
+                """
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS segments_normalized ON segments (scope, normalized_key)")
+
+    @staticmethod
+    def get_scope(model_name: str, prompt: str) -> str:
+        return DiskCache.make_key("translation_memory", model_name, prompt)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+    @staticmethod
+    def hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def split_segments(md: str) -> list:
+        """
+        markdownを段落単位のセグメントに分割し、(本文, 後ろに続く空行のリスト) のリストを返す。
+        ブロック数式($$ ... $$)の途中では分割しない。
+        """
+        segments = []
+        for lines in ChunkPlanner.split_paragraphs(md.split("\n")):
+            n_blank = 0
+            while n_blank < len(lines) and not lines[len(lines) - 1 - n_blank].strip():
+                n_blank += 1
+            segments.append(('\n'.join(lines[:len(lines) - n_blank]), lines[len(lines) - n_blank:]))
+        return segments
+
+    @staticmethod
+    def join_segments(texts: list, segments: list) -> str:
+        """
+        split_segmentsで分割したセグメントの(翻訳後の)本文と空行を元の順序で結合する。
+        """
+        lines = []
+        for text, (content, blank_lines) in zip(texts, segments):
+            if content:
+                lines.append(text)
+            lines.extend(blank_lines)
+        return '\n'.join(lines)
+
+    def lookup(self, model_name: str, prompt: str, texts: list) -> list:
+        """
+        セグメントの翻訳結果を返す。見つからないセグメントはNone。
+        原文が完全に一致するものを優先し、なければ正規化して一致するものを使う。
+        """
+        scope = self.get_scope(model_name, prompt)
+        exact_keys = [self.hash(text) for text in texts]
+        normalized_keys = [self.hash(self.normalize(text)) for text in texts]
+        unique_keys = list(dict.fromkeys(normalized_keys))
+        if not unique_keys:
+            return []
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT exact_key, normalized_key, translation FROM segments WHERE scope = ? AND normalized_key IN ({','.join('?' * len(unique_keys))})",
+                [scope, *unique_keys],
+            ).fetchall()
+        by_exact = {exact_key: translation for exact_key, _, translation in rows}
+        by_normalized = {normalized_key: translation for _, normalized_key, translation in rows}
+        results = [
+            by_exact.get(exact_key, by_normalized.get(normalized_key))
+            for exact_key, normalized_key in zip(exact_keys, normalized_keys)
+        ]
+        hit_keys = [exact_key for exact_key, result in zip(exact_keys, results) if result is not None and exact_key in by_exact]
+        if hit_keys:
+            with self.lock, self.connection:
+                self.connection.executemany("UPDATE segments SET hits = hits + 1 WHERE scope = ? AND exact_key = ?", [(scope, key) for key in hit_keys])
+        return results
+
+    def store(self, model_name: str, prompt: str, pairs: list):
+        """
+        (原文, 翻訳結果) のリストを保存する。
+        """
+        scope = self.get_scope(model_name, prompt)
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                """
+                INSERT INTO segments (scope, exact_key, normalized_key, translation, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (scope, exact_key) DO UPDATE SET translation = excluded.translation, updated_at = excluded.updated_at
+                """,
+                [(scope, self.hash(text), self.hash(self.normalize(text)), translation, now) for text, translation in pairs],
+            )
+
+    @staticmethod
+    def mark_segments(texts: list) -> str:
+        """
+        複数のセグメントを区切りのコメントを付けて1つのmarkdownにまとめる。
+        """
+        return '\n\n'.join(f"<!-- segment {i} -->\n{text}" for i, text in enumerate(texts))
+
+    @staticmethod
+    def split_marked(md: str, n_segments: int) -> list:
+        """
+        mark_segmentsでまとめて翻訳した結果をセグメントごとに分ける。
+        区切りが欠けたり順序が変わったりしている場合はNoneを返す。
+        """
+        texts = []
+        current = None
+        for line in md.split("\n"):
+            match = SEGMENT_MARKER_PATTERN.match(line)
+            if match:
+                if current is not None:
+                    texts.append('\n'.join(current).strip("\n"))
+                if int(match.group(1)) != len(texts):
+                    return None
+                current = []
+            elif current is not None:
+                current.append(line)
+            elif line.strip():
+                # 最初の区切りより前に文章がある
+                return None
+        if current is not None:
+            texts.append('\n'.join(current).strip("\n"))
+        return texts if len(texts) == n_segments else None
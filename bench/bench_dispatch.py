@@ -0,0 +1,152 @@
+"""
+Cloud Functionのディスパッチャ(cloud_functions/dispatcher.py)のベンチマーク
+ローカルにCloud Run APIの代替(FakeRunApi)を立て、Slackのイベントを同時に送って
+ジョブの実行回数、ジョブに渡したページID、重複として捨てたイベント数、応答時間を計測する。
+
+Usage:
+    cd bench
+    poetry run python bench_dispatch.py --events 50 --burst 10 --window 1.0 --retry-rate 0.2
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cloud_functions"))
+
+from dispatcher import CredentialCache, JobDispatcher, find_page_ids
+
+
+class FakeRunApi:
+    """
+    Cloud Run APIの代替。jobs/*:run へのPOSTを記録し、実行IDを返す。
+    """
+    def __init__(self, latency: float=0.0, failure_rate: float=0.0, seed: int=0):
+        self.executions = []
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                time.sleep(latency)
+                with api.lock:
+                    failed = api.random.random() < failure_rate
+                    if not failed:
+                        api.executions.append({"path": self.path, "body": body, "token": self.headers.get("Authorization")})
+                status = 500 if failed else 200
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(json.dumps({"name": f"execution-{len(api.executions)}"} if not failed else {"error": "internal"}).encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def close(self):
+        self.server.shutdown()
+
+
+class FakeCredentials:
+    """
+    google.auth の認証情報の代替。有効期限(lifetime 秒)ごとに更新され、更新回数を数える。
+    """
+    def __init__(self, lifetime: float=3600.0):
+        self.lifetime = lifetime
+        self.expiry = 0.0
+        self.token = None
+        self.refreshes = 0
+
+    @property
+    def valid(self) -> bool:
+        return self.token is not None and time.monotonic() < self.expiry
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = f"token-{self.refreshes}"
+        self.expiry = time.monotonic() + self.lifetime
+
+
+def make_event(i: int, n_pages: int) -> dict:
+    """
+    NotionからのSlack通知を模したイベント。ページのリンクを1つ含む。
+    """
+    page_id = f"{i % n_pages:032x}"
+    return {
+        "event_id": f"Ev{i:08d}",
+        "event": {"type": "message", "text": f"<https://www.notion.so/Paper-{page_id}|Paper {i}> was added"},
+    }
+
+
+def run(args) -> dict:
+    api = FakeRunApi(args.run_latency, args.failure_rate)
+    credentials = FakeCredentials()
+    dispatcher = JobDispatcher(f"{api.url}/v2/projects/p/locations/r/jobs/j:run", CredentialCache(credentials), args.window)
+    rng = random.Random(args.seed)
+    results = []
+    lock = threading.Lock()
+
+    def send(event: dict):
+        start = time.perf_counter()
+        result = dispatcher.dispatch(event["event_id"], find_page_ids(event["event"]))
+        with lock:
+            results.append((result["result"], time.perf_counter() - start))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.burst * 2) as executor:
+        for i in range(0, args.events, args.burst):
+            events = [make_event(j, args.pages) for j in range(i, min(i + args.burst, args.events))]
+            # Slackの再送を混ぜる (同じevent_id)
+            events += [event for event in events if rng.random() < args.retry_rate]
+            list(executor.map(send, events))
+            time.sleep(args.interval)
+    elapsed = time.perf_counter() - start
+    api.close()
+    page_ids = [
+        env["value"]
+        for execution in api.executions
+        for override in execution["body"].get("overrides", {}).get("containerOverrides", [])
+        for env in override.get("env", [])
+    ]
+    return {
+        "events": len(results),
+        "job_executions": len(api.executions),
+        "pages_in_jobs": sum(len(value.split(",")) for value in page_ids),
+        "results": {name: sum(1 for result, _ in results if result == name) for name in sorted({result for result, _ in results})},
+        "credential_refreshes": credentials.refreshes,
+        "max_response_seconds": max(seconds for _, seconds in results),
+        "elapsed_seconds": elapsed,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=50, help="送るイベントの数")
+    parser.add_argument("--burst", type=int, default=10, help="同時に送るイベントの数")
+    parser.add_argument("--interval", type=float, default=1.5, help="バーストの間隔 (秒)")
+    parser.add_argument("--pages", type=int, default=20, help="イベントが指すページの種類")
+    parser.add_argument("--window", type=float, default=1.0, help="イベントをまとめる時間 (秒)")
+    parser.add_argument("--retry-rate", type=float, default=0.2, help="Slackが再送するイベントの割合")
+    parser.add_argument("--run-latency", type=float, default=0.1, help="Cloud Run APIの遅延 (秒)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Cloud Run APIが失敗する割合")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    for key, value in run(parse_args()).items():
+        print(f"{key:<24}{value}")
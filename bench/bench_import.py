@@ -0,0 +1,78 @@
+"""
+コンテナのエントリーポイントのimport時間のベンチマーク
+新しいPythonプロセスで main_for_cloud (または指定したモジュール) をimportし、
+import時間の中央値と、累積のimport時間が長いモジュールを表示する。
+翻訳に使うSDK(pipeline.HEAVY_MODULES)は未翻訳ページがあるときだけimportされるため、別に計測する。
+
+Usage:
+    cd bench
+    poetry run python bench_import.py --repeat 5 --top 15
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "app"))
+
+
+def measure(module: str) -> tuple:
+    """
+    新しいプロセスでmoduleをimportし、(プロセスの実行時間, -X importtimeの出力) を返す。
+    """
+    env = {**os.environ, "PYTHONPATH": APP_DIR, "PYTHONDONTWRITEBYTECODE": "1"}
+    for key in ["GEMINI_API_KEY", "GYAZO_ACCESS_TOKEN", "MISTRAL_API_KEY", "NOTION_TOKEN", "NOTION_DATABASE_ID"]:
+        env.setdefault(key, "dummy")
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return time.perf_counter() - start, result.stderr
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    -X importtimeの出力から {モジュール名: 累積のimport時間(秒)} を返す。
+    """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def bench_module(module: str, repeat: int, top: int):
+    # 1回目はバイトコードのコンパイルなどを含むため捨てる
+    measure(module)
+    runs = [measure(module) for _ in range(repeat)]
+    import_seconds = [parse_importtime(stderr)[module] for _, stderr in runs]
+    print(f"\n== import {module} ==")
+    print(f"{'import (median)':<40}{statistics.median(import_seconds):>10.3f} s")
+    print(f"{'process (median)':<40}{statistics.median(seconds for seconds, _ in runs):>10.3f} s")
+    times = parse_importtime(runs[-1][1])
+    print(f"{'module':<40}{'cumulative':>10}")
+    for name, seconds in sorted(times.items(), key=lambda item: -item[1])[:top]:
+        print(f"{name:<40}{seconds:>10.3f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=["main_for_cloud", "google.generativeai", "mistralai"], help="計測するモジュール")
+    parser.add_argument("--repeat", type=int, default=5, help="計測の回数")
+    parser.add_argument("--top", type=int, default=15, help="表示するモジュールの数")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for module in args.modules:
+        bench_module(module, args.repeat, args.top)
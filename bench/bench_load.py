@@ -0,0 +1,294 @@
+"""
+複数の論文がまとめて投稿されたときの負荷試験
+Notionからの通知を模したSlackのイベントで main.message_hello を呼び出し、外部サービス(Mistral, Gemini, Gyazo, Notion)は
+遅延、エラー率、レート制限を設定できるローカルの代替(fakes.py)に置き換えて、
+スループット、イベントから翻訳の書き込みまでの時間(p50/p95/p99)、失敗数を計測する。
+同時実行数の設定(--max-page-workers, --max-workers, --concurrency)を変えて、本番の設定を決めるのに使う。
+
+Usage:
+    cd bench
+    poetry run python bench_load.py --bursts 3 --papers-per-burst 8 --burst-interval 30 --gemini-latency 3 --error-rate 0.02 --max-page-workers 2
+"""
+import os
+import sys
+import math
+import time
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+# 実際のAPIキーとトークンは使わない
+for key in ["GEMINI_API_KEY", "GYAZO_ACCESS_TOKEN", "MISTRAL_API_KEY", "NOTION_TOKEN", "NOTION_DATABASE_ID"]:
+    os.environ.setdefault(key, "dummy")
+os.environ["SLACK_BOT_TOKEN"] = "xoxb-load-test"
+os.environ["NOTION_USER_ID"] = "U0NOTION"
+
+from cfg import cfg
+
+from fakes import CallCounter, FaultInjector, FakeMistral, FakeGenerativeModel, FakeGyazoClient, FakeNotion, make_notion_page
+from fixtures import PAPER_SIZES, generate_fixture
+
+SERVICES = ["mistral", "gemini", "gyazo", "notion"]
+
+
+class FakeMistralByUrl:
+    """
+    論文ごとのFakeMistralをまとめたMistralクライアントの代替。OCRはPDFのURLで論文のfixtureを選ぶ。
+    """
+    def __init__(self, mistrals: dict, chat: FakeMistral):
+        self.mistrals = mistrals
+        self.ocr = SimpleNamespace(process_async=self.process_async)
+        self.chat = chat.chat
+
+    async def process_async(self, document: dict, **kwargs):
+        return await self.mistrals[document["document_url"]].process_async(document=document, **kwargs)
+
+
+class FakeHttpClient(FakeGyazoClient):
+    """
+    汎用のHTTPクライアント(io.http)の代替。POSTはGyazoへのアップロード、GETはPDFのダウンロードとして扱う。
+    """
+    def __init__(self, counter: CallCounter, latency: float=0.0, faults: FaultInjector=None, pdfs: dict=None):
+        super().__init__(counter, latency, faults)
+        self.pdfs = pdfs or {}
+
+    async def get(self, url: str, **kwargs):
+        self.counter.add("pdf.download")
+        return SimpleNamespace(status_code=200, raise_for_status=lambda: None, content=self.pdfs.get(url, b""))
+
+
+class FakeSay:
+    """
+    Slackのsayの代替。投稿されたメッセージを時刻とともに記録する。
+    """
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def __call__(self, blocks: list=None, text: str=""):
+        with self.lock:
+            self.messages.append((time.perf_counter(), text))
+
+    def count(self, keyword: str) -> int:
+        with self.lock:
+            return sum(1 for _, text in self.messages if keyword in text)
+
+
+def make_pdf(n_pages: int) -> bytes:
+    """
+    ページ数だけを持つ空のPDFを作成する (テキスト層がないため全ページがOCRに回る)。PyMuPDFがなければ空のバイト列。
+    """
+    try:
+        import pymupdf
+    except ImportError:
+        return b""
+    with pymupdf.open() as doc:
+        for _ in range(n_pages):
+            doc.new_page()
+        return doc.tobytes()
+
+
+def parse_concurrency(values: list) -> dict:
+    """
+    "gemini=8" の形式の指定を {サービス: 同時実行数} にする。
+    """
+    concurrency = {}
+    for value in values:
+        service, n = value.split("=")
+        concurrency[service] = int(n)
+    return concurrency
+
+
+def configure(args, work_dir: str):
+    """
+    main.pyをimportする前に、出力先を一時ディレクトリに、同時実行数を指定した値にする (パイプラインはimport時に設定を読む)。
+    """
+    cfg.output_dir = work_dir
+    cfg.cache_dir = os.path.join(work_dir, "cache")
+    cfg.image_spool_dir = os.path.join(work_dir, "cache", "images")
+    cfg.checkpoint_dir = os.path.join(work_dir, "checkpoints")
+    cfg.revision_dir = os.path.join(work_dir, "revisions")
+    cfg.metrics_path = os.path.join(work_dir, "metrics.jsonl")
+    cfg.page_index_path = os.path.join(work_dir, "page_index.sqlite3")
+    # 論文間で段落が重ならない負荷を見るため、翻訳メモリは指定した場合のみ使う
+    cfg.translation_memory_path = os.path.join(work_dir, "translation_memory.sqlite3") if args.translation_memory else None
+    # fixtureの画像はランダムなバイト列のため縮小しない
+    cfg.preprocess_images = False
+    cfg.max_page_workers = args.max_page_workers
+    cfg.max_workers = args.max_workers
+    cfg.requests_per_minute = args.requests_per_minute
+    cfg.translation_backends = args.backends
+    cfg.ocr_range_pages = args.ocr_range_pages
+    cfg.service_concurrency = {**cfg.service_concurrency, **parse_concurrency(args.concurrency)}
+
+
+def import_main():
+    """
+    main.pyをimportする。Slackのトークンの検証(auth.test)はローカルの応答に置き換える。
+    """
+    from slack_sdk import WebClient
+
+    auth_test = WebClient.auth_test
+    WebClient.auth_test = lambda self, **kwargs: {"ok": True, "user_id": "U0BOT", "bot_id": "B0BOT", "team_id": "T0LOAD"}
+    try:
+        import main
+    finally:
+        WebClient.auth_test = auth_test
+    return main
+
+
+def make_papers(args) -> list:
+    """
+    投稿する論文のfixtureを作成する。サイズは args.papers を順に使い、内容は論文ごとに変える。
+    """
+    n_papers = args.bursts * args.papers_per_burst
+    fixtures = []
+    for i in range(n_papers):
+        size = args.papers[i % len(args.papers)]
+        fixture = generate_fixture(f"{size}-{i}", PAPER_SIZES[size], seed=args.seed + i)
+        fixture["title"] = f"Load test paper {i} ({size})"
+        fixtures.append(fixture)
+    return fixtures
+
+
+def build_fakes(main, fixtures: list, counter: CallCounter, args) -> FakeNotion:
+    """
+    パイプラインの外部サービスのクライアントをfakeに置き換え、Notionのfakeを返す。
+    """
+    import pipeline
+
+    def faults(service: str, seed: int) -> FaultInjector:
+        return FaultInjector(counter, args.error_rate, getattr(args, f"{service}_rps_limit"), args.seed + seed)
+
+    mistral_faults = faults("mistral", 1)
+    mistrals = {
+        fixture["pdf_url"]: FakeMistral(fixture, counter, args.ocr_latency, args.mistral_chat_latency, args.ocr_page_latency, mistral_faults)
+        for fixture in fixtures
+    }
+    pipeline.io_core.clients["mistral"] = FakeMistralByUrl(mistrals, next(iter(mistrals.values())))
+    fake_notion = FakeNotion(counter, args.notion_latency, faults=faults("notion", 2))
+    pipeline.io_core.clients["notion"] = fake_notion
+    pdfs = {fixture["pdf_url"]: make_pdf(len(fixture["ocr_pages"])) for fixture in fixtures}
+    pipeline.io_core.http = FakeHttpClient(counter, args.gyazo_latency, faults("gyazo", 3), pdfs)
+    for backend in pipeline.translation_router.backends:
+        if backend.name == "gemini":
+            backend.model = FakeGenerativeModel({}, counter, args.gemini_latency, args.gemini_latency_per_1k_chars, seed=args.seed, faults=faults("gemini", 4))
+    return fake_notion
+
+
+def percentile(values: list, p: float) -> float:
+    """
+    最近傍順位法によるパーセンタイル
+    """
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def is_idle(main) -> bool:
+    with main.job_queue.lock:
+        return not main.job_queue.in_flight
+
+
+def run(args) -> dict:
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure(args, work_dir)
+        main = import_main()
+        counter = CallCounter()
+        fixtures = make_papers(args)
+        fake_notion = build_fakes(main, fixtures, counter, args)
+        say = FakeSay()
+        submitted_at = {}
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, args.papers_per_burst)) as executor:
+            for b in range(args.bursts):
+                burst = fixtures[b * args.papers_per_burst:(b + 1) * args.papers_per_burst]
+                events = []
+                for i, fixture in enumerate(burst, start=b * args.papers_per_burst):
+                    page = make_notion_page(f"{i:032x}", fixture["title"], fixture["pdf_url"])
+                    page["last_edited_time"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:00.000Z")
+                    fake_notion.database_pages.append(page)
+                    submitted_at[page["id"]] = time.perf_counter()
+                    # Notionの自動化はページごとにSlackに通知する
+                    events.append({"user": os.environ["NOTION_USER_ID"], "text": f"<https://www.notion.so/{page['id']}|{fixture['title']}> was added"})
+                list(executor.map(lambda message: main.message_hello(message, say), events))
+                if b < args.bursts - 1:
+                    time.sleep(args.burst_interval)
+
+        # 全ての論文が書き込まれるか、処理中のジョブがない状態が続くか、タイムアウトするまで待つ
+        deadline = time.perf_counter() + args.timeout
+        idle_since = None
+        while len(fake_notion.completed_at) < len(submitted_at) and time.perf_counter() < deadline:
+            if is_idle(main):
+                idle_since = idle_since or time.perf_counter()
+                if time.perf_counter() - idle_since >= args.settle:
+                    break
+            else:
+                idle_since = None
+            time.sleep(0.1)
+        elapsed = (max(fake_notion.completed_at.values()) if fake_notion.completed_at else time.perf_counter()) - start
+
+        main.job_queue.shutdown(wait=False)
+        main.dispatcher.shutdown(wait=False)
+        latencies = [fake_notion.completed_at[page_id] - submitted_at[page_id] for page_id in submitted_at if page_id in fake_notion.completed_at]
+        counts = dict(counter.counts)
+        return {
+            "papers": len(submitted_at),
+            "completed": len(latencies),
+            "not_completed": len(submitted_at) - len(latencies),
+            "failure_messages": say.count("失敗しました"),
+            "elapsed_seconds": round(elapsed, 2),
+            "throughput_per_minute": round(len(latencies) / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            "latency_p50_seconds": round(percentile(latencies, 50), 2),
+            "latency_p95_seconds": round(percentile(latencies, 95), 2),
+            "latency_p99_seconds": round(percentile(latencies, 99), 2),
+            "latency_max_seconds": round(max(latencies), 2) if latencies else float("nan"),
+            "rate_limited": sum(n for name, n in counts.items() if name.endswith(".rate_limited")),
+            "injected_errors": sum(n for name, n in counts.items() if name.endswith(".error")),
+            "calls": {name: n for name, n in sorted(counts.items()) if not name.endswith((".rate_limited", ".error"))},
+            "faults": {name: n for name, n in sorted(counts.items()) if name.endswith((".rate_limited", ".error"))},
+        }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--papers", nargs="+", default=["small"], choices=list(PAPER_SIZES), help="投稿する論文のサイズ (順に繰り返す)")
+    parser.add_argument("--bursts", type=int, default=2, help="まとめて投稿する回数")
+    parser.add_argument("--papers-per-burst", type=int, default=5, help="1回にまとめて投稿する論文の数")
+    parser.add_argument("--burst-interval", type=float, default=5.0, help="投稿の間隔 (秒)")
+    parser.add_argument("--timeout", type=float, default=600.0, help="全ての論文の書き込みを待つ時間の上限 (秒)")
+    parser.add_argument("--settle", type=float, default=3.0, help="処理中のジョブがない状態がこの秒数続いたら待つのをやめる")
+    # 同時実行数の設定
+    parser.add_argument("--max-page-workers", type=int, default=cfg.max_page_workers, help="同時に処理する論文の数")
+    parser.add_argument("--max-workers", type=int, default=cfg.max_workers, help="1つの論文の翻訳チャンクの並列数")
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="Gemini APIの1分あたりの最大リクエスト数 (0なら無制限。本番はcfg.requests_per_minute)")
+    parser.add_argument("--concurrency", nargs="*", default=[], help="外部APIごとの同時リクエスト数 ex. gemini=8 notion=3")
+    parser.add_argument("--backends", nargs="+", default=cfg.translation_backends, choices=["gemini", "mistral_chat"], help="翻訳に使うバックエンド")
+    parser.add_argument("--ocr-range-pages", type=int, default=cfg.ocr_range_pages, help="このページ数ごとの範囲に分けて並列にOCRする (0なら1回でOCRする)")
+    parser.add_argument("--translation-memory", action="store_true", help="翻訳メモリを使う")
+    # 外部サービスの遅延、エラー率、レート制限
+    parser.add_argument("--ocr-latency", type=float, default=0.0, help="Mistral OCRの遅延 (秒)")
+    parser.add_argument("--ocr-page-latency", type=float, default=0.0, help="Mistral OCRの1ページあたりの遅延 (秒)")
+    parser.add_argument("--gemini-latency", type=float, default=0.0, help="Geminiの1リクエストあたりの遅延 (秒)")
+    parser.add_argument("--gemini-latency-per-1k-chars", type=float, default=0.0, help="Geminiの出力1000文字あたりの遅延 (秒)")
+    parser.add_argument("--mistral-chat-latency", type=float, default=0.0, help="Mistralのチャットの1リクエストあたりの遅延 (秒)")
+    parser.add_argument("--gyazo-latency", type=float, default=0.0, help="Gyazoの1アップロードあたりの遅延 (秒)")
+    parser.add_argument("--notion-latency", type=float, default=0.0, help="Notionの1リクエストあたりの遅延 (秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="全ての外部APIで503を返す割合")
+    for service in SERVICES:
+        parser.add_argument(f"--{service}-rps-limit", type=float, default=0.0, help=f"{service}が1秒あたりに受け付けるリクエスト数 (超えると429。0なら無制限)")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    for key, value in run(parse_args()).items():
+        print(f"{key:<24}{value}")
+    # 処理が残っていても終了する (ジョブのスレッドを待たない)
+    os._exit(0)
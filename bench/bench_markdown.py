@@ -0,0 +1,78 @@
+"""
+Markdown→Notionブロック変換のマイクロベンチマーク
+1. golden/ のコーパスについて、期待される出力(書き換え前の変換器の出力)と一致することを確認する。
+2. 生成した論文について、書き換え前の変換器(legacy_markdown.py)と出力が一致することを確認する。
+3. 両者の変換時間を比較する。
+
+Usage:
+    cd bench
+    poetry run python bench_markdown.py --papers medium huge --repeat 5
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from markdown_blocks import iter_notion_blocks
+
+from legacy_markdown import LegacyConverter
+from fixtures import PAPER_SIZES, load_fixture
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden")
+
+
+def convert(markdown_text: str) -> list:
+    return list(iter_notion_blocks(markdown_text))
+
+
+def check_golden() -> bool:
+    ok = True
+    for md_path in sorted(glob.glob(os.path.join(GOLDEN_DIR, "*.md"))):
+        with open(md_path, encoding="utf-8") as f:
+            md = f.read()
+        with open(md_path[:-3] + ".json", encoding="utf-8") as f:
+            expected = json.load(f)
+        matched = convert(md) == expected
+        ok &= matched
+        print(f"golden {os.path.basename(md_path)}: {'OK' if matched else 'MISMATCH'}")
+    return ok
+
+
+def best_time(func, md: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(md)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_paper(name: str, repeat: int) -> bool:
+    fixture = load_fixture(name)
+    md = "\n\n".join(page["markdown"] for page in fixture["ocr_pages"])
+    legacy = LegacyConverter()
+    matched = convert(md) == legacy.markdown_to_notion_blocks(md)
+    legacy_time = best_time(legacy.markdown_to_notion_blocks, md, repeat)
+    new_time = best_time(convert, md, repeat)
+    print(
+        f"{name:<8} lines={md.count(chr(10)) + 1:<7} "
+        f"legacy={legacy_time * 1000:8.2f}ms  new={new_time * 1000:8.2f}ms  "
+        f"speedup={legacy_time / new_time:5.2f}x  output={'OK' if matched else 'MISMATCH'}"
+    )
+    return matched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--papers", nargs="+", default=list(PAPER_SIZES), help="fixtureの名前")
+    parser.add_argument("--repeat", type=int, default=5, help="計測の繰り返し回数 (最速の結果を使う)")
+    args = parser.parse_args()
+
+    ok = check_golden()
+    for name in args.papers:
+        ok &= bench_paper(name, args.repeat)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,138 @@
+"""
+パイプラインの各ステージのベンチマーク
+外部サービスをローカルの代替(fakes.py)に置き換え、fixtureを再生して
+ステージごとの実行時間、API呼び出し回数、ピークメモリを計測する。
+
+Usage:
+    cd bench
+    poetry run python bench_pipeline.py --papers small medium huge --gemini-latency 2.0
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+# 実際のAPIキーは使わない
+for key in ["GEMINI_API_KEY", "GYAZO_ACCESS_TOKEN", "MISTRAL_API_KEY", "NOTION_TOKEN", "NOTION_DATABASE_ID"]:
+    os.environ.setdefault(key, "dummy")
+
+from aio import AsyncIOCore, RetryPolicy
+from translate import Translator
+from notion import NotionWriter
+from gyazo import GyazoUploader
+from block_appender import AdaptiveThrottle
+from backends import BackendRouter, GeminiBackend, MistralChatBackend
+from pdf_extract import LocalPdfExtractor
+from cfg import cfg
+
+from fakes import CallCounter, FakeMistral, FakeGenerativeModel, FakeGyazoClient, FakeNotion, make_notion_page
+from fixtures import PAPER_SIZES, load_fixture
+
+
+def build_fakes(fixture: dict, counter: CallCounter, args) -> tuple:
+    """
+    外部サービスをfakeに置き換えたTranslatorとNotionWriterを作成する。
+    """
+    io = AsyncIOCore({**cfg.service_concurrency, "gyazo": args.max_upload_workers}, RetryPolicy(cfg.request_timeout, cfg.max_retries))
+    fake_mistral = FakeMistral(fixture, counter, args.ocr_latency, args.mistral_chat_latency, args.ocr_page_latency)
+    backends = {"gemini": GeminiBackend(cfg.model_name), "mistral_chat": MistralChatBackend(cfg.mistral_chat_model_name, io)}
+    backends["gemini"].model = FakeGenerativeModel(fixture, counter, args.gemini_latency, args.gemini_latency_per_1k_chars, args.gemini_straggler_rate)
+    backends["mistral_chat"].client = fake_mistral
+    router = BackendRouter([backends[name] for name in args.backends], io, args.hedge_factor, args.min_hedge_delay)
+    translator = Translator(cfg.model_name, cfg.mistral_model_name, args.max_workers, 0, io=io, router=router, ocr_range_pages=args.ocr_range_pages, ocr_range_workers=args.ocr_range_workers)
+    translator.mistral = fake_mistral
+    # fixtureにはPDFがないため、ページ数はOCR結果から取る
+    translator.download_pdf = lambda pdf_url: None
+    translator.get_page_count = lambda pdf_bytes: len(fixture["ocr_pages"])
+    # パイプラインのwarm_upと同じく、PyMuPDFのimportは計測の前に済ませる
+    LocalPdfExtractor.is_available()
+    translator.gyazo_uploader = GyazoUploader(translator.gyazo_access_token, cfg.gyazo_endpoint, io)
+    translator.gyazo_uploader.http = FakeGyazoClient(counter, args.gyazo_latency)
+
+    page = make_notion_page("bench-page", fixture["name"], fixture["pdf_url"])
+    fake_notion = FakeNotion(counter, args.notion_latency, [page])
+    notion = NotionWriter(AdaptiveThrottle(args.notion_rps), io=io)
+    notion.notion = fake_notion
+    notion.appender.notion = fake_notion
+    notion.set_untranslated_page(page)
+    return translator, notion
+
+
+def run_stage(results: list, name: str, counter: CallCounter, func, *args):
+    """
+    1ステージを実行し、実行時間、API呼び出し回数、ピークメモリを記録する。
+    """
+    counter.reset()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    output = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    results.append({
+        "stage": name,
+        "seconds": elapsed,
+        "calls": dict(counter.counts),
+        "peak_mb": peak / 1024 ** 2,
+    })
+    return output
+
+
+def bench_paper(name: str, args) -> list:
+    fixture = load_fixture(name)
+    counter = CallCounter()
+    translator, notion = build_fakes(fixture, counter, args)
+    results = []
+    if args.overlap_ocr:
+        # OCRが済んだページから翻訳を始める (パイプラインと同じ)
+        md_pages = translator.pdf_to_markdown_stream(fixture["pdf_url"])
+        md_jp = run_stage(results, "ocr_and_translate", counter, translator.translate_markdown, cfg.prompt, md_pages, cfg.max_output_tokens, cfg.gyazo_endpoint)
+    else:
+        md = run_stage(results, "pdf_to_markdown", counter, translator.pdf_to_markdown, fixture["pdf_url"])
+        md_jp = run_stage(results, "translate_markdown", counter, translator.translate_markdown, cfg.prompt, md, cfg.max_output_tokens, cfg.gyazo_endpoint)
+    blocks = run_stage(results, "markdown_to_notion_blocks", counter, notion.markdown_to_notion_blocks, md_jp)
+    child_page = run_stage(results, "create_empty_child_page", counter, notion.create_empty_child_page, "bench-page")
+    run_stage(results, "append_blocks", counter, notion.append_blocks, child_page["id"], blocks)
+    translator.gyazo_uploader.close()
+    translator.io.close()
+    return results
+
+
+def print_results(name: str, results: list):
+    print(f"\n== {name} ==")
+    print(f"{'stage':<28}{'seconds':>10}{'peak MB':>10}  calls")
+    for r in results:
+        calls = ", ".join(f"{k}={v}" for k, v in sorted(r["calls"].items()))
+        print(f"{r['stage']:<28}{r['seconds']:>10.3f}{r['peak_mb']:>10.1f}  {calls}")
+    print(f"{'total':<28}{sum(r['seconds'] for r in results):>10.3f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--papers", nargs="+", default=list(PAPER_SIZES), help="fixtureの名前")
+    parser.add_argument("--ocr-latency", type=float, default=0.0, help="Mistral OCRの遅延 (秒)")
+    parser.add_argument("--ocr-page-latency", type=float, default=0.0, help="Mistral OCRの1ページあたりの遅延 (秒)")
+    parser.add_argument("--ocr-range-pages", type=int, default=0, help="このページ数ごとの範囲に分けて並列にOCRする (0なら1回でOCRする)")
+    parser.add_argument("--ocr-range-workers", type=int, default=cfg.ocr_range_workers, help="並列にOCRするページ範囲の数")
+    parser.add_argument("--overlap-ocr", action="store_true", help="OCRが済んだページから翻訳を始める")
+    parser.add_argument("--gemini-latency", type=float, default=0.0, help="Geminiの1リクエストあたりの遅延 (秒)")
+    parser.add_argument("--gemini-latency-per-1k-chars", type=float, default=0.0, help="Geminiの出力1000文字あたりの遅延 (秒)")
+    parser.add_argument("--gemini-straggler-rate", type=float, default=0.0, help="Geminiの遅延が10倍になるリクエストの割合")
+    parser.add_argument("--mistral-chat-latency", type=float, default=0.0, help="Mistralのチャットの1リクエストあたりの遅延 (秒)")
+    parser.add_argument("--backends", nargs="+", default=["gemini"], choices=["gemini", "mistral_chat"], help="翻訳に使うバックエンド")
+    parser.add_argument("--hedge-factor", type=float, default=cfg.hedge_factor, help="普段の処理時間のこの倍数を超えたチャンクは次のバックエンドにも送る")
+    parser.add_argument("--min-hedge-delay", type=float, default=5.0, help="次のバックエンドに送るまでの最短の時間 (秒)")
+    parser.add_argument("--gyazo-latency", type=float, default=0.0, help="Gyazoの1アップロードあたりの遅延 (秒)")
+    parser.add_argument("--notion-latency", type=float, default=0.0, help="Notionの1リクエストあたりの遅延 (秒)")
+    parser.add_argument("--notion-rps", type=float, default=cfg.notion_requests_per_second, help="Notionの1秒あたりの最大リクエスト数")
+    parser.add_argument("--max-workers", type=int, default=cfg.max_workers, help="翻訳の並列数")
+    parser.add_argument("--max-upload-workers", type=int, default=cfg.service_concurrency["gyazo"], help="画像アップロードの並列数")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    tracemalloc.start()
+    for name in args.papers:
+        print_results(name, bench_paper(name, args))
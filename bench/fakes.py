@@ -0,0 +1,307 @@
+"""
+ベンチマーク用の外部サービス(Mistral, Gemini, Gyazo, Notion)のローカル代替
+各サービスは指定した遅延の後、fixtureの内容を返す。呼び出し回数はCallCounterに記録する。
+FaultInjectorを渡すと、呼び出しの一部を失敗(503)させ、レート制限(429)を加える。
+"""
+import os
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import httpx
+
+
+class CallCounter:
+    """
+    サービスごとのAPI呼び出し回数を数えるクラス (スレッドセーフ)
+    """
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+
+def make_api_error(name: str, status: int, retry_after: float=None) -> Exception:
+    """
+    サービスのSDKが送出するのと同じ形のエラー応答を作る (nameは "mistral.ocr" などの呼び出し名)。
+    Retry-Afterヘッダーは応答(httpx.Response)に含める。
+    """
+    headers = {} if retry_after is None else {"retry-after": f"{retry_after:.3f}"}
+    request = httpx.Request("POST", f"https://fake/{name}")
+    response = httpx.Response(status, headers=headers, request=request, text="fake error")
+    message = f"Fake API error ({status})"
+    service = name.split(".")[0]
+    if service == "mistral":
+        from mistralai.models import SDKError
+        return SDKError(message, status, response.text, response)
+    if service == "notion":
+        from notion_client import APIResponseError
+        return APIResponseError(response, message, {429: "rate_limited", 404: "object_not_found"}.get(status, "service_unavailable"))
+    if service == "gemini":
+        from google.api_core import exceptions
+        return exceptions.from_http_status(status, message, response=response)
+    return httpx.HTTPStatusError(message, request=request, response=response)
+
+
+class FaultInjector:
+    """
+    fakeの呼び出しに失敗とレート制限を加えるクラス (スレッドセーフ)
+    error_rate の割合の呼び出しは503で失敗する。
+    1秒あたり requests_per_second を超えた呼び出しは429で失敗する (Retry-Afterは次に呼び出せるまでの秒数)。
+    失敗した回数はCallCounterに "{サービス}.error" と "{サービス}.rate_limited" として記録する。
+    """
+    def __init__(self, counter: CallCounter, error_rate: float=0.0, requests_per_second: float=0.0, seed: int=0):
+        self.counter = counter
+        self.error_rate = error_rate
+        self.requests_per_second = requests_per_second
+        self.capacity = max(1.0, requests_per_second)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def check(self, name: str):
+        """
+        呼び出しを失敗させる場合は、そのサービスのSDKと同じ形のエラー(make_api_error)を送出する。
+        """
+        with self.lock:
+            if self.requests_per_second > 0:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.requests_per_second)
+                self.updated_at = now
+                if self.tokens < 1:
+                    self.counter.add(f"{name}.rate_limited")
+                    raise make_api_error(name, 429, (1 - self.tokens) / self.requests_per_second)
+                self.tokens -= 1
+            failed = self.random.random() < self.error_rate
+        if failed:
+            self.counter.add(f"{name}.error")
+            raise make_api_error(name, 503)
+
+
+class FakeMistral:
+    """
+    Mistral クライアントの代替。ocr.process_async でfixtureのOCR結果を返す (遅延は latency + page_latency * ページ数 秒)。
+    chat.complete_async は入力をそのまま返す (遅延は chat_latency 秒)。
+    """
+    def __init__(self, fixture: dict, counter: CallCounter, latency: float=0.0, chat_latency: float=0.0, page_latency: float=0.0, faults: FaultInjector=None):
+        self.fixture = fixture
+        self.counter = counter
+        self.latency = latency
+        self.chat_latency = chat_latency
+        self.page_latency = page_latency
+        self.faults = faults
+        self.ocr = SimpleNamespace(process_async=self.process_async)
+        self.chat = SimpleNamespace(complete_async=self.complete_async)
+
+    async def process_async(self, model: str, document: dict, include_image_base64: bool=False, pages: list=None, **kwargs):
+        self.counter.add("mistral.ocr")
+        if self.faults:
+            self.faults.check("mistral.ocr")
+        ocr_pages = self.fixture["ocr_pages"]
+        indices = pages if pages is not None else range(len(ocr_pages))
+        await asyncio.sleep(self.latency + self.page_latency * len(indices))
+        return SimpleNamespace(pages=[
+            SimpleNamespace(
+                index=i,
+                markdown=ocr_pages[i]["markdown"],
+                images=[
+                    SimpleNamespace(id=image["id"], image_base64=image["image_base64"] if include_image_base64 else None)
+                    for image in ocr_pages[i]["images"]
+                ],
+            )
+            for i in indices
+        ])
+
+
+    async def complete_async(self, model: str, messages: list, **kwargs):
+        self.counter.add("mistral.chat")
+        if self.faults:
+            self.faults.check("mistral.chat")
+        await asyncio.sleep(self.chat_latency)
+        md = messages[-1]["content"]
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=md), finish_reason="stop")],
+            usage=SimpleNamespace(prompt_tokens=len(md) // 4, completion_tokens=len(md) // 4),
+        )
+
+
+class FakeGenerativeModel:
+    """
+    genai.GenerativeModel の代替。
+    fixtureに記録された翻訳結果(key: チャンクのsha256)があればそれを返し、なければ入力をそのまま返す。
+    遅延は latency + 出力1000文字あたり latency_per_1k_chars 秒。
+    straggler_rate の割合のリクエストは遅延が straggler_factor 倍になる (ヘッジの確認用)。
+    """
+    def __init__(self, fixture: dict, counter: CallCounter, latency: float=0.0, latency_per_1k_chars: float=0.0, straggler_rate: float=0.0, straggler_factor: float=10.0, seed: int=0, faults: FaultInjector=None):
+        self.faults = faults
+        self.responses = fixture.get("gemini_responses", {})
+        self.counter = counter
+        self.latency = latency
+        self.latency_per_1k_chars = latency_per_1k_chars
+        self.straggler_rate = straggler_rate
+        self.straggler_factor = straggler_factor
+        self.random = random.Random(seed)
+
+    async def generate_content_async(self, contents: list, generation_config=None, **kwargs):
+        self.counter.add("gemini.generate_content")
+        if self.faults:
+            self.faults.check("gemini.generate_content")
+        md = contents[-1]
+        text = self.responses.get(hashlib.sha256(md.encode("utf-8")).hexdigest(), md)
+        delay = self.latency + self.latency_per_1k_chars * len(text) / 1000
+        if self.random.random() < self.straggler_rate:
+            delay *= self.straggler_factor
+        await asyncio.sleep(delay)
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(prompt_token_count=len(md) // 4, candidates_token_count=len(text) // 4),
+            candidates=[SimpleNamespace(finish_reason=SimpleNamespace(name="STOP"))],
+        )
+
+
+class FakeGyazoClient:
+    """
+    Gyazoへのアップロードに使う httpx.AsyncClient の代替。
+    """
+    def __init__(self, counter: CallCounter, latency: float=0.0, faults: FaultInjector=None):
+        self.counter = counter
+        self.latency = latency
+        self.faults = faults
+
+    async def post(self, endpoint: str, files: dict=None, data: dict=None, **kwargs):
+        self.counter.add("gyazo.upload")
+        if self.faults:
+            self.faults.check("gyazo.upload")
+        await asyncio.sleep(self.latency)
+        image_hash = hashlib.sha256(files["imagedata"]).hexdigest()[:32]
+        return SimpleNamespace(
+            status_code=200,
+            raise_for_status=lambda: None,
+            json=lambda: {"url": f"https://i.gyazo.com/{image_hash}.jpg"},
+        )
+
+
+class FakeNotion:
+    """
+    notion_client.AsyncClient の代替。書き込まれたブロックは children に保持する。
+    Translate Completed にチェックを入れた時刻(time.perf_counter)は completed_at に記録する。
+    """
+    def __init__(self, counter: CallCounter, latency: float=0.0, database_pages: list=None, faults: FaultInjector=None):
+        self.counter = counter
+        self.latency = latency
+        self.database_pages = database_pages or []
+        self.faults = faults
+        self.children = {}
+        self.completed_at = {}
+        self.lock = threading.Lock()
+        self.databases = SimpleNamespace(query=self.query)
+        self.pages = SimpleNamespace(create=self.create_page, retrieve=self.retrieve_page, update=self.update_page)
+        self.blocks = SimpleNamespace(
+            children=SimpleNamespace(append=self.append, list=self.list_children),
+            delete=self.delete_block,
+        )
+
+    async def call(self, name: str):
+        self.counter.add(f"notion.{name}")
+        if self.faults:
+            self.faults.check(f"notion.{name}")
+        await asyncio.sleep(self.latency)
+
+    async def query(self, database_id: str, filter: dict=None, start_cursor: str=None, page_size: int=100, **kwargs):
+        await self.call("databases.query")
+        start = int(start_cursor or 0)
+        if filter and filter.get("timestamp") == "last_edited_time":
+            since = filter["last_edited_time"]["on_or_after"]
+            results = sorted((page for page in self.database_pages if page["last_edited_time"] >= since), key=lambda page: page["last_edited_time"])
+        elif filter is None:
+            results = sorted(self.database_pages, key=lambda page: page["last_edited_time"])
+        else:
+            results = [page for page in self.database_pages if not page["properties"]["Translate Completed"]["checkbox"]]
+        end = start + page_size
+        return {
+            "results": results[start:end],
+            "has_more": end < len(results),
+            "next_cursor": str(end) if end < len(results) else None,
+        }
+
+    async def create_page(self, parent: dict, properties: dict, **kwargs):
+        await self.call("pages.create")
+        page_id = str(uuid.uuid4())
+        with self.lock:
+            self.children[page_id] = []
+        return {"id": page_id, "parent": parent, "properties": properties}
+
+    async def retrieve_page(self, page_id: str, **kwargs):
+        await self.call("pages.retrieve")
+        for page in self.database_pages:
+            if page["id"] == page_id:
+                return page
+        raise make_api_error("notion.pages.retrieve", 404)
+
+    async def update_page(self, page_id: str, properties: dict=None, **kwargs):
+        await self.call("pages.update")
+        for page in self.database_pages:
+            if page["id"] == page_id:
+                page["properties"].update(properties or {})
+                page["last_edited_time"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:00.000Z")
+                if page["properties"]["Translate Completed"]["checkbox"]:
+                    self.completed_at.setdefault(page_id, time.perf_counter())
+        return {"id": page_id}
+
+    async def append(self, block_id: str, children: list, after: str=None, **kwargs):
+        await self.call("blocks.children.append")
+        results = [dict(child, id=str(uuid.uuid4())) for child in children]
+        with self.lock:
+            blocks = self.children.setdefault(block_id, [])
+            index = len(blocks) if after is None else [block["id"] for block in blocks].index(after) + 1
+            blocks[index:index] = results
+        return {"results": results}
+
+    async def list_children(self, block_id: str, start_cursor: str=None, page_size: int=100, **kwargs):
+        await self.call("blocks.children.list")
+        start = int(start_cursor or 0)
+        end = start + page_size
+        with self.lock:
+            blocks = self.children.get(block_id, [])
+            return {
+                "results": blocks[start:end],
+                "has_more": end < len(blocks),
+                "next_cursor": str(end) if end < len(blocks) else None,
+            }
+
+    async def delete_block(self, block_id: str, **kwargs):
+        await self.call("blocks.delete")
+        with self.lock:
+            for blocks in self.children.values():
+                blocks[:] = [block for block in blocks if block["id"] != block_id]
+        return {"id": block_id, "archived": True}
+
+
+def make_notion_page(page_id: str, title: str, url: str, database_id: str=None) -> dict:
+    """
+    データベースの未翻訳ページを模したdictを作成する。database_idがNoneなら環境変数 NOTION_DATABASE_ID のデータベース。
+    """
+    return {
+        "id": page_id,
+        "parent": {"type": "database_id", "database_id": database_id or os.getenv("NOTION_DATABASE_ID", "")},
+        "last_edited_time": "2025-01-01T00:00:00.000Z",
+        "properties": {
+            "タイトル": {"title": [{"plain_text": title}]},
+            "リンク": {"url": url},
+            "Translate Completed": {"checkbox": False},
+        },
+    }
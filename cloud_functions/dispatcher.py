@@ -0,0 +1,188 @@
+import re
+import time
+import threading
+
+import requests
+from google.auth import default
+from google.auth.transport.requests import Request
+
+# Slackのメッセージ中のNotionのページ ex. https://www.notion.so/Title-0123456789abcdef0123456789abcdef
+NOTION_PAGE_ID_PATTERN = re.compile(r"notion\.so/[^\s\"'<>|]*?([0-9a-fA-F]{32})")
+
+
+def format_page_id(page_id: str) -> str:
+    """
+    32桁のページIDをハイフン区切り(UUID)の形式にする。
+    """
+    page_id = page_id.lower()
+    return f"{page_id[:8]}-{page_id[8:12]}-{page_id[12:16]}-{page_id[16:20]}-{page_id[20:]}"
+
+
+def find_page_ids(event: dict) -> list:
+    """
+    Slackのイベントに含まれるNotionのページIDを返す。
+    """
+    return list(dict.fromkeys(format_page_id(match) for match in NOTION_PAGE_ID_PATTERN.findall(repr(event))))
+
+
+class CredentialCache:
+    """
+    Cloud Run APIのアクセストークンを有効期限まで使い回すクラス (スレッドセーフ)
+    インスタンスが再利用される間は google.auth.default() の呼び出しとトークンの更新を省く。
+
+    Args:
+        credentials (google.auth.credentials.Credentials): 認証情報 (Noneなら最初に使うときに google.auth.default() で取得)
+    """
+    def __init__(self, credentials=None):
+        self.credentials = credentials
+        self.lock = threading.Lock()
+
+    def get_token(self) -> str:
+        with self.lock:
+            if self.credentials is None:
+                self.credentials, _ = default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+            # validは有効期限の少し前にFalseになる
+            if not self.credentials.valid:
+                self.credentials.refresh(Request())
+            return self.credentials.token
+
+
+class EventDeduper:
+    """
+    処理済みのSlackのイベントIDを一定時間覚えておくクラス (スレッドセーフ)
+    Slackは3秒以内に応答がないと同じイベントを再送する(X-Slack-Retry-Numヘッダー付き)ため、同じIDのイベントは1回だけ処理する。
+
+    Args:
+        ttl (float): イベントIDを覚えておく時間 (秒)
+    """
+    def __init__(self, ttl: float=600.0):
+        self.ttl = ttl
+        self.seen = {}
+        self.lock = threading.Lock()
+
+    def add(self, event_id: str) -> bool:
+        """
+        イベントIDを記録する。既に記録されていればFalseを返す。
+        """
+        now = time.monotonic()
+        with self.lock:
+            # 期限切れのイベントIDを捨てる (dictは記録した順)
+            for key in list(self.seen):
+                if now - self.seen[key] < self.ttl:
+                    break
+                del self.seen[key]
+            if event_id in self.seen:
+                return False
+            self.seen[event_id] = now
+            return True
+
+    def forget(self, event_ids: list):
+        """
+        イベントIDの記録を消す。(ジョブの起動に失敗したときに、再送されたイベントを処理できるようにする)
+        """
+        with self.lock:
+            for event_id in event_ids:
+                self.seen.pop(event_id, None)
+
+
+class Batch:
+    """
+    1回のジョブの実行にまとめるイベント
+
+    Attributes:
+        event_ids (list): まとめたイベントのID
+        page_ids (list): 処理するページのID
+        full_scan (bool): ページIDを含まないイベントがあれば、未翻訳のページを全て処理する
+        result (dict): ジョブの実行結果 (doneがセットされるまではNone)
+        done (threading.Event): ジョブの実行を終えたらセットする
+    """
+    def __init__(self):
+        self.event_ids = []
+        self.page_ids = []
+        self.full_scan = False
+        self.result = None
+        self.done = threading.Event()
+
+    def add(self, event_id: str, page_ids: list):
+        if event_id:
+            self.event_ids.append(event_id)
+        if page_ids:
+            self.page_ids.extend(page_id for page_id in page_ids if page_id not in self.page_ids)
+        else:
+            self.full_scan = True
+
+
+class JobDispatcher:
+    """
+    Slackのイベントを受けてCloud Run Jobを実行するクラス
+    window 秒以内に届いたイベントは1回のジョブの実行にまとめる。
+    最初のイベントのリクエストが window 秒待ってからジョブを実行し、その間に届いたイベントはそのバッチに追加してジョブの実行を待つ。
+    ジョブの起動に失敗した場合はバッチの全てのイベントが失敗を返すため、Slackがそれぞれのイベントを再送する (イベントを失わない)。
+    ジョブには処理するページのIDを環境変数 PAGE_IDS で渡す (ページIDを含まないイベントがあれば渡さず、未翻訳のページを全て処理する)。
+
+    Args:
+        run_url (str): Cloud Run Jobを実行するAPIのURL
+        credentials (CredentialCache): アクセストークンの取得元
+        window (float): イベントをまとめる時間 (秒)。Slackの再送を避けるため3秒より十分短くする
+        deduper (EventDeduper): 処理済みのイベントID (Noneなら作成)
+        session (requests.Session): Cloud Run APIへの接続 (Noneなら作成)
+        timeout (float): Cloud Run APIの呼び出しのタイムアウト (秒)
+    """
+    def __init__(self, run_url: str, credentials: CredentialCache, window: float=1.0, deduper: EventDeduper=None, session: requests.Session=None, timeout: float=30.0):
+        self.run_url = run_url
+        self.credentials = credentials
+        self.window = window
+        self.deduper = deduper or EventDeduper()
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.batch = None
+        self.lock = threading.Lock()
+
+    def dispatch(self, event_id: str, page_ids: list) -> dict:
+        """
+        イベントをバッチに追加する。バッチの最初のイベントであれば、window 秒待ってからジョブを実行する。
+        """
+        if event_id and not self.deduper.add(event_id):
+            return {"result": "Duplicate event"}
+        with self.lock:
+            is_leader = self.batch is None
+            if is_leader:
+                self.batch = Batch()
+            batch = self.batch
+            batch.add(event_id, page_ids)
+        if not is_leader:
+            # 先頭のイベントのリクエストがジョブを実行するのを待ち、起動に失敗していれば失敗を返す
+            if not batch.done.wait(self.window + self.timeout + 1.0):
+                self.deduper.forget([event_id] if event_id else [])
+                return {"result": "Job failed to start", "error": "Timed out waiting for the batch"}
+            return {"result": "Job batched"} if batch.result["result"] == "Job started successfully" else batch.result
+        try:
+            time.sleep(self.window)
+            with self.lock:
+                self.batch = None
+            batch.result = self.run_job(batch)
+        finally:
+            if batch.result is None:
+                self.deduper.forget(batch.event_ids)
+                batch.result = {"result": "Job failed to start", "error": "Dispatcher error"}
+            batch.done.set()
+        return batch.result
+
+    def run_job(self, batch: Batch) -> dict:
+        body = {}
+        if batch.page_ids and not batch.full_scan:
+            body = {"overrides": {"containerOverrides": [{"env": [{"name": "PAGE_IDS", "value": ",".join(batch.page_ids)}]}]}}
+        try:
+            headers = {
+                "Authorization": f"Bearer {self.credentials.get_token()}",
+                "Content-Type": "application/json"
+            }
+            response = self.session.post(self.run_url, headers=headers, json=body, timeout=self.timeout)
+        except Exception as e:
+            self.deduper.forget(batch.event_ids)
+            return {"result": "Job failed to start", "error": str(e)}
+        if response.status_code != 200:
+            # Slackの再送で再び実行できるようにする
+            self.deduper.forget(batch.event_ids)
+            return {"result": "Job failed to start", "error": response.text}
+        return {"result": "Job started successfully", "n_events": len(batch.event_ids), "page_ids": None if batch.full_scan else batch.page_ids}
@@ -1,45 +1,40 @@
 import os
-import requests
 
 import functions_framework
-from google.auth import default
-from google.auth.transport.requests import Request
 from flask import jsonify
 
+from dispatcher import CredentialCache, JobDispatcher, find_page_ids
+
+# Cloud Run Job の設定
+project_id = os.getenv("PROJECT_ID")
+region = os.getenv("REGION")
+job_name = os.getenv("JOB_NAME")
+# ローカルで試すときはCloud Run APIの代替のURLを指定します
+run_api_endpoint = os.getenv("RUN_API_ENDPOINT", f"https://{region}-run.googleapis.com")
+
+# インスタンスが再利用される間は認証情報、Cloud Run APIへの接続、処理済みのイベントIDを使い回し、
+# 短い間に届いたイベントは1回のジョブの実行にまとめます
+dispatcher = JobDispatcher(
+    f"{run_api_endpoint}/v2/projects/{project_id}/locations/{region}/jobs/{job_name}:run",
+    CredentialCache(),
+    float(os.getenv("DISPATCH_WINDOW", "1.0")),
+)
+
 # HTTP トリガーの Cloud Function
 @functions_framework.http
 def trigger_cloud_run_job(request):
     # リクエストの JSON データを取得
-    ret = request.get_json(silent=True)
+    ret = request.get_json(silent=True) or {}
     if ret.get("type") == "url_verification":
         return jsonify({"challenge": ret["challenge"]})
-    # Cloud Run Job の設定
-    project_id = os.getenv("PROJECT_ID")
-    region = os.getenv("REGION")
-    job_name = os.getenv("JOB_NAME")
-
-    # Cloud Run Job のエンドポイント
-    url = f"https://{region}-run.googleapis.com/v2/projects/{project_id}/locations/{region}/jobs/{job_name}:run"
-
-    # 認証トークンの取得
-    credentials, _ = default()
-    credentials.refresh(Request())
-    auth_token = credentials.token
-
-    # API リクエストのヘッダー
-    headers = {
-        "Authorization": f"Bearer {auth_token}",
-        "Content-Type": "application/json"
-    }
-
-    # ジョブ実行リクエスト
-    response = requests.post(url, headers=headers)
+    # Slackの再送(X-Slack-Retry-Num)は同じevent_idで届くため、処理済みであればジョブを実行しません
+    event_id = ret.get("event_id")
+    if request.headers.get("X-Slack-Retry-Num"):
+        print(f"Slack retry {request.headers.get('X-Slack-Retry-Num')} for event {event_id}")
 
-    # 結果を返す
-    if response.status_code == 200:
-        pass
-        ret["result"] = "Job started successfully"
-    else:
-        ret["result"] = "Job failed to start"
-        ret["error"] = response.text
+    # ジョブ実行リクエスト (短い間に届いたイベントはまとめます)
+    ret.update(dispatcher.dispatch(event_id, find_page_ids(ret.get("event", {}))))
+    # ジョブの起動に失敗した場合は5xxを返し、Slackに再送させます
+    if ret["result"] == "Job failed to start":
+        return jsonify(ret), 500
     return jsonify(ret)
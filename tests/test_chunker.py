@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from chunker import ChunkPlanner, find_headers
+from masking import Masker
+
+MD = """# 1 Introduction
+We train a model.
+
+```python
+# load the weights
+model = load()
+```
+
+The prose after the code block must be translated.
+
+$$
+# not a header
+$$
+
+## 1.1 Setup
+More prose."""
+
+
+def test_find_headers_ignores_code_and_block_math():
+    lines = MD.split("\n")
+    assert [lines[n] for n in find_headers(lines)] == ["# 1 Introduction", "## 1.1 Setup"]
+
+
+def test_split_sections_keeps_code_block_in_section():
+    sections = ChunkPlanner.split_sections(MD.split("\n"))
+    assert [section[0] for section in sections] == ["# 1 Introduction", "## 1.1 Setup"]
+    assert "The prose after the code block must be translated." in sections[0]
+
+
+def test_split_sections_stream_matches_split_sections():
+    pages = MD.split("\n\n")
+    streamed = [section for batch in ChunkPlanner.split_sections_stream(pages) for section in batch]
+    assert streamed == ['\n'.join(section) for section in ChunkPlanner.split_sections(MD.split("\n"))]
+
+
+def test_mask_per_section_hides_code_block():
+    masker = Masker()
+    placeholders = {}
+    masked = [masker.mask('\n'.join(section), placeholders) for section in ChunkPlanner.split_sections(MD.split("\n"))]
+    assert not any("load the weights" in section for section in masked)
+    assert "The prose after the code block must be translated." in masked[0]
+    assert Masker.unmask('\n'.join(masked), placeholders) == MD